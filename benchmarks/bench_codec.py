@@ -0,0 +1,121 @@
+"""Compares decoding and encoding the endpoint bodies with the codec against
+the old hand rolled json.loads parsing and Flask's indented jsonify output,
+then times whole requests to each endpoint through the test client.
+
+Run with: python -m benchmarks.bench_codec [pot_makers]
+"""
+from teabot_endpoints import codec
+from teabot_endpoints.endpoints import (
+    app, STATE_SCHEMA, CLAIM_POT_SCHEMA, DASH_BUTTON_SCHEMA)
+from teabot_endpoints.models import PotMaker, MODELS
+from benchmarks.seed import seed
+from benchmarks.utils import temporary_database, timed
+from datetime import datetime
+import json
+import sys
+
+CALLS = 20000
+ENCODES = 500
+REQUESTS = 500
+
+STATE_BODY = json.dumps({
+    'state': 'GOOD_TEAPOT',
+    'timestamp': '2017-01-01T09:00:00.000001',
+    'num_of_cups': 3,
+    'weight': 1100,
+    'temperature': 82
+})
+CLAIM_POT_BODY = json.dumps({'potMaker': 'maker00000'})
+DASH_BUTTON_BODY = json.dumps({'dash_mac_address': 'mac00000'})
+
+
+def _old_state(body):
+    data = json.loads(body)
+    return {
+        'state': data['state'],
+        'timestamp': datetime.strptime(
+            data['timestamp'], "%Y-%m-%dT%H:%M:%S.%f"),
+        'num_of_cups': data['num_of_cups'],
+        'weight': data.get('weight', -1),
+        'temperature': data.get('temperature', 1)
+    }
+
+
+def _old_claim_pot(body):
+    return json.loads(body).get('potMaker')
+
+
+def _old_dash_button(body):
+    return json.loads(body)['dash_mac_address']
+
+
+def _repeat(times, func, *args):
+    for _ in range(times):
+        func(*args)
+
+
+def _old_dumps(value):
+    # What jsonify sends outside of an XHR request
+    return json.dumps(value, indent=2)
+
+
+def _per_call(times, func, *args):
+    return timed(_repeat, times, func, *args) * 1000000 / times
+
+
+def _request(client, method, url, data=None):
+    for _ in range(REQUESTS):
+        getattr(client, method)(url, data=data)
+
+
+def main(pot_makers):
+    print "json backend: %s" % ('ujson' if codec.ujson else 'json')
+    print "%-24s %12s %12s" % ('decode, us', 'old', 'codec')
+    for name, old, schema, body in [
+            ('storeState', _old_state, STATE_SCHEMA, STATE_BODY),
+            ('claimPot', _old_claim_pot, CLAIM_POT_SCHEMA, CLAIM_POT_BODY),
+            ('flipTeapotRequest', _old_dash_button, DASH_BUTTON_SCHEMA,
+             DASH_BUTTON_BODY)]:
+        print "%-24s %12.2f %12.2f" % (
+            name, _per_call(CALLS, old, body),
+            _per_call(CALLS, codec.parse, body, schema))
+
+    with temporary_database(MODELS) as database:
+        seed(database, 1000, pot_makers)
+        responses = [
+            ('potMakers', {'potMakers': [
+                maker._asdict() for maker in PotMaker.iter_records()]}),
+            ('stats/cupsPerHour', {
+                'stat': 'cupsPerHour', 'columns': ['hour', 'cups'],
+                'rows': [('2017-01-%02d %02d:00' % (day, hour), 4)
+                         for day in range(1, 31) for hour in range(24)]}),
+            ('webhook', {'text': 'There are 3 cups of good tea'}),
+            ('requestedTeapot', {'requestedTeapot': True}),
+        ]
+        print
+        print "%-24s %12s %12s %12s %12s" % (
+            'encode', 'old us', 'codec us', 'old bytes', 'codec bytes')
+        for name, value in responses:
+            print "%-24s %12.2f %12.2f %12d %12d" % (
+                name,
+                _per_call(ENCODES, _old_dumps, value),
+                _per_call(ENCODES, codec.dumps, value),
+                len(_old_dumps(value)), len(codec.dumps(value)))
+
+        client = app.test_client()
+        print
+        print "%-24s %12s" % ('request, us', 'codec')
+        for name, method, url, data in [
+                ('GET /potMakers', 'get', '/potMakers', None),
+                ('POST /storeState', 'post', '/storeState', STATE_BODY),
+                ('POST /claimPot', 'post', '/claimPot', CLAIM_POT_BODY),
+                ('POST /flipTeapotRequest', 'post', '/flipTeapotRequest',
+                 DASH_BUTTON_BODY)]:
+            print "%-24s %12.1f" % (
+                name,
+                timed(_request, client, method, url, data) * 1000000 /
+                REQUESTS)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
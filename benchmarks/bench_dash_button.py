@@ -0,0 +1,72 @@
+"""Compares pressing a dash button by selecting the pot maker with its button
+and saving the whole row, as the endpoint used to, with the cached lookup and
+single conditional update of flip_requested_teapot, and times presses that
+repeat within the debounce window.
+
+Run with: python -m benchmarks.bench_dash_button [presses]
+"""
+from teabot_endpoints.models import PotMaker, MODELS
+from benchmarks.utils import temporary_database, timed, report
+from datetime import datetime, timedelta
+import sys
+
+POT_MAKERS = 100
+
+
+def _seed():
+    PotMaker.insert_many([
+        {
+            'name': 'maker%s' % i,
+            'number_of_pots_made': 0,
+            'total_weight_made': 0,
+            'number_of_cups_made': 0,
+            'largest_single_pot': 0,
+            'mac_address': 'mac%s' % i,
+            'requested_teapot': False
+        } for i in range(POT_MAKERS)
+    ]).execute()
+
+
+def _presses(count):
+    return ['mac%s' % (i % POT_MAKERS) for i in range(count)]
+
+
+def select_and_save(mac_addresses):
+    for mac_address in mac_addresses:
+        maker = PotMaker.get_single_pot_maker_by_mac_address(mac_address)
+        maker.requested_teapot = not maker.requested_teapot
+        maker.save()
+
+
+def flip(mac_addresses, start):
+    # Presses are spaced out so none of them are debounced
+    for index, mac_address in enumerate(mac_addresses):
+        PotMaker.flip_requested_teapot(
+            mac_address, start + timedelta(minutes=index))
+
+
+def repeated(mac_address, count, start):
+    for _ in range(count):
+        PotMaker.flip_requested_teapot(mac_address, start)
+
+
+def main(count):
+    presses = _presses(count)
+    with temporary_database(MODELS):
+        with PotMaker._meta.database.atomic():
+            _seed()
+        report("press, select and save", count,
+               timed(select_and_save, presses), 'presses')
+        report("press, flip_requested_teapot", count,
+               timed(flip, presses, datetime.now()), 'presses')
+
+        start = datetime.now() + timedelta(days=1)
+        PotMaker.flip_requested_teapot('mac0', start)
+        requested = PotMaker.get_number_of_teapot_requests()
+        report("repeated press, debounced", count,
+               timed(repeated, 'mac0', count, start), 'presses')
+        assert PotMaker.get_number_of_teapot_requests() == requested
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
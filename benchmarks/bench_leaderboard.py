@@ -0,0 +1,99 @@
+"""Compares response times of leaderboard pages sorted and paged in SQL with
+loading every pot maker and sorting them in Python, with 10k pot makers and a
+year of claimed pots.
+
+Run with: python -m benchmarks.bench_leaderboard [pot_makers] [pots]
+"""
+from teabot_endpoints.models import PotMaker, PotMakerStats, MODELS, \
+    LEADERBOARD_STATS
+from teabot_endpoints.endpoints import app
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from benchmarks.utils import temporary_database, timed
+from datetime import datetime, timedelta
+import random
+import sys
+
+READS = 50
+NOW = datetime(2017, 12, 20, 12)
+
+
+def _seed(database, pot_makers, pots):
+    """Bulk loads pot makers and claimed pots, then builds the period stats
+    from them
+    """
+    rand = random.Random(0)
+    cursor = database.get_cursor()
+    with database.atomic():
+        cursor.executemany(
+            'INSERT INTO potmaker (name, number_of_pots_made, '
+            'total_weight_made, number_of_cups_made, largest_single_pot, '
+            'inactive, requested_teapot, teapot) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0, ?)',
+            (
+                ('maker%05d' % i, rand.randint(0, 500),
+                 rand.randint(0, 500000), rand.randint(0, 3000),
+                 rand.randint(500, 2000), rand.random() < 0.2,
+                 DEFAULT_TEAPOT)
+                for i in range(pot_makers)
+            )
+        )
+        cursor.executemany(
+            'INSERT INTO state (state, timestamp, num_of_cups, weight, '
+            'temperature, claimed_by_id, teapot) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                ('FULL_TEAPOT',
+                 str(NOW - timedelta(minutes=rand.randint(0, 525600))),
+                 rand.randint(2, 8), rand.randint(500, 2000), 80,
+                 rand.randint(1, pot_makers), DEFAULT_TEAPOT)
+                for _ in range(pots)
+            )
+        )
+    PotMakerStats.rebuild()
+
+
+def _python_sorted(sort, limit):
+    """The old approach, every pot maker loaded then sorted in Python"""
+    makers = sorted(
+        PotMaker.get_all(), key=lambda m: getattr(m, sort), reverse=True)
+    return makers[:limit]
+
+
+def _read(func, *args, **kwargs):
+    for _ in range(READS):
+        func(*args, **kwargs)
+
+
+def main(pot_makers, pots):
+    with temporary_database(MODELS) as database:
+        _seed(database, pot_makers, pots)
+        client = app.test_client()
+        print "%d pot makers, %d claimed pots, ms per request" % (
+            pot_makers, pots)
+        print "%-22s %10s %10s %10s %10s" % (
+            'sort', 'python', 'all time', 'week', 'month')
+        for sort in LEADERBOARD_STATS:
+            print "%-22s %10.2f %10.2f %10.2f %10.2f" % (
+                sort,
+                timed(_read, _python_sorted, sort, 20) * 1000 / READS,
+                timed(_read, PotMaker.get_leaderboard, sort,
+                      include_inactive=False) * 1000 / READS,
+                timed(_read, PotMaker.get_leaderboard, sort,
+                      PotMakerStats.WEEK, NOW) * 1000 / READS,
+                timed(_read, PotMaker.get_leaderboard, sort,
+                      PotMakerStats.MONTH, NOW) * 1000 / READS
+            )
+
+        for url in ['/potMakers', '/leaderboard?sort=weight',
+                    '/leaderboard?sort=pots&page=400',
+                    '/leaderboard?period=month&includeInactive=true']:
+            assert client.get(url).status_code == 200
+            print "%-50s %8.2f ms" % (
+                'GET ' + url, timed(_read, client.get, url) * 1000 / READS)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    )
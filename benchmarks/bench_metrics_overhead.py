@@ -0,0 +1,62 @@
+"""Measures what the request and query instrumentation adds to each request,
+by timing the metrics hooks for a request that makes a few queries and by
+timing a real request with the hooks on and off.
+
+Run with: python -m benchmarks.bench_metrics_overhead
+"""
+from teabot_endpoints import metrics
+from teabot_endpoints.endpoints import app
+from benchmarks.utils import timed
+import shutil
+import tempfile
+
+ITERATIONS = 20000
+REQUESTS = 2000
+QUERIES_PER_REQUEST = 5
+METRIC_HOOKS = ('start_request_metrics', 'record_response_status',
+                'record_request_metrics')
+
+
+def _instrumented_request():
+    metrics.start_request()
+    for _ in range(QUERIES_PER_REQUEST):
+        metrics.record_query(0.0001)
+    metrics.finish_request('/teaReady', 'POST', 200, 0.01)
+    metrics.maybe_flush()
+
+
+def _repeat(func, times):
+    for _ in range(times):
+        func()
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    metrics.METRICS_DIR = directory
+    try:
+        seconds = timed(_repeat, _instrumented_request, ITERATIONS)
+        print "hooks for a request with %d queries: %.1f us" % (
+            QUERIES_PER_REQUEST, seconds * 1000000 / ITERATIONS)
+
+        client = app.test_client()
+
+        def request():
+            client.get('/imATeapot')
+        on = timed(_repeat, request, REQUESTS)
+        hooks = [app.before_request_funcs, app.after_request_funcs,
+                 app.teardown_request_funcs]
+        saved = [dict(functions) for functions in hooks]
+        for functions in hooks:
+            functions[None] = [
+                f for f in functions[None] if f.__name__ not in METRIC_HOOKS]
+        off = timed(_repeat, request, REQUESTS)
+        for functions, original in zip(hooks, saved):
+            functions.update(original)
+        print "GET /imATeapot with metrics: %.1f us, without: %.1f us" % (
+            on * 1000000 / REQUESTS, off * 1000000 / REQUESTS)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Shows that reading the number of new teapots from the Counter table stays
+constant time as the State history grows, compared with counting the rows.
+
+Run with: python -m benchmarks.bench_new_teapot_count [max_rows]
+"""
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from benchmarks.utils import temporary_database, timed
+from datetime import datetime, timedelta
+import sys
+
+READS = 100
+
+
+def _seed(database, start_row, end_row):
+    """Bulk loads synthetic readings, one FULL_TEAPOT every 500 rows"""
+    start = datetime(2015, 1, 1)
+    cursor = database.get_cursor()
+    with database.atomic():
+        cursor.executemany(
+            'INSERT INTO state (state, timestamp, num_of_cups, weight, '
+            'temperature, teapot) VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                ('FULL_TEAPOT' if i % 500 == 0 else 'GOOD_TEAPOT',
+                 str(start + timedelta(seconds=i)), 4, 1200, 70,
+                 DEFAULT_TEAPOT)
+                for i in range(start_row, end_row)
+            )
+        )
+
+
+def _count_by_scan():
+    return len([s for s in State.select().where(
+        State.state == 'FULL_TEAPOT')])
+
+
+def _read(func):
+    for _ in range(READS):
+        func()
+
+
+def main(max_rows):
+    sizes = [10 ** power for power in range(3, 8) if 10 ** power < max_rows]
+    sizes.append(max_rows)
+    print "%12s %18s %18s" % ('rows', 'scan (ms/read)', 'counter (ms/read)')
+    with temporary_database(MODELS) as database:
+        seeded = 0
+        for size in sizes:
+            _seed(database, seeded, size)
+            seeded = size
+            State.backfill_counters()
+            assert _count_by_scan() == State.get_number_of_new_teapots()
+            print "%12d %18.3f %18.3f" % (
+                size,
+                timed(_read, _count_by_scan) * 1000 / READS,
+                timed(_read, State.get_number_of_new_teapots) * 1000 / READS
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000000)
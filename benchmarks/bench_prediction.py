@@ -0,0 +1,93 @@
+"""Times /teapotPrediction's forecast, kept up to date one reading at a time,
+against fitting the window's readings afresh on every request, as simulated
+pots are stored on top of a seeded history. Then reports how far out the
+predictions were.
+
+Run with: python -m benchmarks.bench_prediction [states] [pots]
+"""
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.prediction import Forecaster, TeapotForecast
+from teabot_endpoints.settings import PREDICTION_WINDOW
+from teabot_endpoints.tests.pot_trace import pot_readings
+from benchmarks.seed import seed
+from benchmarks.utils import temporary_database
+from datetime import datetime, timedelta
+import sys
+import time
+
+START = datetime(2017, 12, 20, 9)
+
+
+def refit(window=PREDICTION_WINDOW):
+    """Fits the window's readings from scratch"""
+    newest = State.get_newest_state_record()
+    forecast = TeapotForecast(window)
+    for timestamp, state, weight, temperature in State.select(
+            State.timestamp, State.state, State.weight, State.temperature
+    ).where(
+        State.teapot == newest.teapot,
+        State.timestamp >= newest.timestamp - timedelta(seconds=window)
+    ).order_by(State.timestamp).tuples():
+        forecast.observe(timestamp, state, weight, temperature)
+    return forecast.predict()
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else float('nan')
+
+
+def main(states, pots):
+    forecaster = Forecaster()
+    timings = {'incremental': 0.0, 'unchanged': 0.0, 'refit': 0.0}
+    requests = 0
+    empty_errors = []
+    cold_errors = []
+    with temporary_database(MODELS) as database:
+        seed(database, states, 100, end=START - timedelta(hours=1))
+        start = START
+        for seed_value in range(pots):
+            readings = list(pot_readings(
+                start, cups=4 + seed_value % 5, seed_value=seed_value))
+            empty_at = readings[-1]['timestamp']
+            cold_at = next((reading['timestamp'] for reading in readings
+                            if reading['state'] == 'COLD_TEAPOT'), None)
+            for reading in readings:
+                State.record_reading(reading)
+                requests += 1
+
+                began = time.time()
+                prediction = forecaster.predict()
+                timings['incremental'] += time.time() - began
+                began = time.time()
+                forecaster.predict()
+                timings['unchanged'] += time.time() - began
+                began = time.time()
+                refit()
+                timings['refit'] += time.time() - began
+
+                if reading['state'] != 'GOOD_TEAPOT':
+                    continue
+                if prediction.empty_at is not None:
+                    empty_errors.append(
+                        abs((prediction.empty_at - empty_at).total_seconds()) /
+                        (empty_at - reading['timestamp']).total_seconds())
+                if cold_at is not None and prediction.cold_at is not None:
+                    cold_errors.append(
+                        abs((prediction.cold_at - cold_at).total_seconds()))
+            start = empty_at + timedelta(minutes=30)
+
+    print "%d readings of history, %d requests, ms per request" % (
+        states, requests)
+    for name in ('refit', 'incremental', 'unchanged'):
+        print "%-40s %8.3f" % (name, timings[name] * 1000 / requests)
+    print
+    print "%-40s %8.2f" % ("empty, median error / time left",
+                           _median(empty_errors))
+    print "%-40s %8.2f" % ("cold, median error in minutes",
+                           _median(cold_errors) / 60)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,79 @@
+"""Compares the latency and memory of reading model instances with reading
+the lightweight namedtuple records, for the pot makers list and the newest
+teapot state lookups the JSON endpoints make.
+
+Run with: python -m benchmarks.bench_records [pot_makers]
+"""
+from teabot_endpoints.models import PotMaker, State, MODELS
+from benchmarks.seed import seed
+from benchmarks.utils import temporary_database, timed
+import sys
+
+READS = 20
+STATE_READS = 2000
+
+
+def _deep_size(obj, seen=None):
+    """Bytes used by obj and everything it holds that was built for it.
+    Classes, fields and other objects shared between rows are skipped.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen or isinstance(obj, type):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, tuple):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+def _bytes_per_row(rows):
+    seen = set()
+    return float(sum(_deep_size(row, seen) for row in rows)) / len(rows)
+
+
+def _read(func, times):
+    for _ in range(times):
+        result = func()
+        if not isinstance(result, (list, State, tuple, type(None))):
+            list(result)
+
+
+def main(pot_makers):
+    with temporary_database(MODELS) as database:
+        seed(database, 10000, pot_makers)
+        print "%d pot makers" % pot_makers
+        print "%-32s %12s %12s" % ('', 'models', 'records')
+        print "%-32s %12.2f %12.2f" % (
+            'all pot makers, ms',
+            timed(_read, PotMaker.get_all, READS) * 1000 / READS,
+            timed(_read, PotMaker.iter_records, READS) * 1000 / READS)
+        print "%-32s %12.0f %12.0f" % (
+            'bytes per pot maker',
+            _bytes_per_row(PotMaker.get_all()),
+            _bytes_per_row(list(PotMaker.iter_records())))
+        print "%-32s %12.1f %12.1f" % (
+            'newest state, us',
+            timed(_read, State._query_newest_state, STATE_READS) *
+            1000000 / STATE_READS,
+            timed(_read, State._query_newest_state_record, STATE_READS) *
+            1000000 / STATE_READS)
+        print "%-32s %12.1f %12.1f" % (
+            'latest full teapot, us',
+            timed(_read, State._query_latest_full_teapot, STATE_READS) *
+            1000000 / STATE_READS,
+            timed(_read, State._query_latest_full_teapot_record,
+                  STATE_READS) * 1000000 / STATE_READS)
+        print "%-32s %12.0f %12.0f" % (
+            'bytes per state',
+            _bytes_per_row([State._query_newest_state()]),
+            _bytes_per_row([State._query_newest_state_record()]))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
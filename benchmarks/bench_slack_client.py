@@ -0,0 +1,67 @@
+"""Compares calling the fake Slack API with a new connection per call, as
+slacker did, with the pooled keep-alive SlackClient, and counts the
+reactions.get calls that reach Slack when many callers ask at once.
+
+Run with: python -m benchmarks.bench_slack_client [calls]
+"""
+from benchmarks.fake_slack import FakeSlackServer
+from benchmarks.utils import timed
+from teabot_endpoints.slack_client import SlackClient
+import requests
+import sys
+import threading
+
+CONCURRENT_CALLERS = 20
+
+
+def _new_connections(url, calls):
+    for _ in range(calls):
+        requests.post(url + '/chat.postMessage', timeout=10,
+                      data={'channel': '#teapot', 'text': 'Tea'}).json()
+
+
+def _pooled(client, calls):
+    for _ in range(calls):
+        client.post_message('#teapot', 'Tea')
+
+
+def _concurrent_reactions(client):
+    threads = [
+        threading.Thread(target=client.get_reactions,
+                         args=('C0TEAPOT', '1234.5'))
+        for _ in range(CONCURRENT_CALLERS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main(calls):
+    server = FakeSlackServer().start()
+    try:
+        client = SlackClient('xoxb-bench', base_url=server.url,
+                             rate=1000000, burst=calls)
+        print "%-32s %10s %12s" % ('', 'ms / call', 'connections')
+        for name, func, args in [
+                ('new connection per call', _new_connections,
+                 (server.url, calls)),
+                ('pooled keep-alive', _pooled, (client, calls))]:
+            before = server.connections
+            seconds = timed(func, *args)
+            print "%-32s %10.3f %12d" % (
+                name, seconds * 1000 / calls, server.connections - before)
+
+        server.latency = 0.1
+        server.calls.clear()
+        _concurrent_reactions(client)
+        print
+        print "%d concurrent reactions.get callers, %d reached Slack" % (
+            CONCURRENT_CALLERS, server.calls['reactions.get'])
+        client.session.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
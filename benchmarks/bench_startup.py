@@ -0,0 +1,147 @@
+"""Measures how long a worker takes to start and to answer its first
+requests. Fresh interpreters time importing the app, create_app, warm_up and
+the first and second request to a few routes, with and without warm_up.
+Then gunicorn is run with one worker restarted every few requests by
+--max-requests, with and without preloading the app in the master, and the
+latency of the requests around the restarts is reported.
+
+Run with: python -m benchmarks.bench_startup [runs]
+"""
+from benchmarks.fake_slack import FakeSlackServer
+from benchmarks.load_test import gunicorn_command, _free_port, \
+    _wait_until_ready, _percentile
+from benchmarks.seed import main as seed_database
+import json
+import os
+import requests
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROUTES = ['/teabotWebhook', '/potMakers', '/teapotAge',
+          '/getNumberOfTeapotRequests']
+MAX_REQUESTS = 20
+RESTART_REQUESTS = 400
+
+
+def child(warm):
+    """Runs in a fresh interpreter, prints its timings as JSON"""
+    timings = {}
+    start = time.time()
+    from teabot_endpoints import endpoints
+    timings['import'] = time.time() - start
+
+    start = time.time()
+    app = endpoints.create_app()
+    timings['create_app'] = time.time() - start
+
+    if warm:
+        start = time.time()
+        endpoints.warm_up()
+        timings['warm_up'] = time.time() - start
+
+    client = app.test_client()
+    for route in ROUTES:
+        for attempt in ('first', 'second'):
+            start = time.time()
+            client.get(route)
+            timings['%s %s' % (route, attempt)] = time.time() - start
+    print json.dumps(timings)
+
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def in_process(env, runs):
+    results = {}
+    for mode in ('cold', 'warm'):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.bench_startup', '--child',
+                 mode], env=env)
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        results[mode] = dict(
+            (name, _median([sample[name] for sample in samples]) * 1000)
+            for name in samples[0])
+    return results
+
+
+def restarts(env, preload):
+    """Sends sequential requests to a single worker that's replaced every
+    MAX_REQUESTS requests
+
+    Returns:
+        - (seconds to first response, sorted request latencies)
+    """
+    port = _free_port()
+    command = gunicorn_command(port) + ['--max-requests', str(MAX_REQUESTS)]
+    env = dict(env, GUNICORN_WORKERS='1', GUNICORN_WORKER_CLASS='sync',
+               GUNICORN_PRELOAD_APP='1' if preload else '0')
+    start = time.time()
+    process = subprocess.Popen(command, env=env)
+    try:
+        url = 'http://127.0.0.1:%d' % port
+        _wait_until_ready(url, process)
+        ready = time.time() - start
+        session = requests.Session()
+        latencies = []
+        for _ in range(RESTART_REQUESTS):
+            start = time.time()
+            session.get(url + '/teabotWebhook', timeout=30)
+            latencies.append(time.time() - start)
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    return ready, sorted(latencies)
+
+
+def main(runs):
+    directory = tempfile.mkdtemp()
+    slack = FakeSlackServer().start()
+    try:
+        database_path = os.path.join(directory, 'teapot.db')
+        seed_database(database_path, 10000, 100)
+        env = dict(
+            os.environ,
+            DATABASE_URL='sqlite:///%s' % database_path,
+            SLACK_API_URL=slack.url,
+            SLACK_API_TOKEN='xoxb-load-test',
+            METRICS_DIR=os.path.join(directory, 'metrics'),
+        )
+
+        results = in_process(env, runs)
+        print "median of %d fresh interpreters, ms" % runs
+        print "%-40s %10s %10s" % ('', 'cold', 'warm')
+        for name in ['import', 'create_app', 'warm_up'] + [
+                '%s %s' % (route, attempt) for route in ROUTES
+                for attempt in ('first', 'second')]:
+            print "%-40s %10s %10s" % (name, '%.2f' % results['cold'][name]
+                                       if name in results['cold'] else '-',
+                                       '%.2f' % results['warm'][name])
+
+        print
+        print "gunicorn, 1 worker replaced every %d requests, ms" % (
+            MAX_REQUESTS)
+        print "%-16s %12s %10s %10s %10s" % (
+            'preload', 'first start', 'p50', 'p99', 'max')
+        for preload in (False, True):
+            ready, latencies = restarts(env, preload)
+            print "%-16s %12.1f %10.2f %10.2f %10.2f" % (
+                'on' if preload else 'off', ready * 1000,
+                _percentile(latencies, 50) * 1000,
+                _percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+    finally:
+        slack.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2] == 'warm')
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,102 @@
+"""Load test for /stateStream fan-out. Connects hundreds of simulated stream
+clients to one worker's StateBroadcaster, stores a series of state changes
+and reports how quickly every client received them alongside the number of
+database queries issued, which stays flat however many clients connect.
+
+Run with: python -m benchmarks.bench_state_stream [clients ...]
+"""
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.events import StateBroadcaster
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from benchmarks.utils import temporary_database
+from playhouse.test_utils import count_queries
+from datetime import datetime
+import sys
+import threading
+import time
+
+CHANGES = 20
+POLL_INTERVAL = 0.05
+# Time between readings, comfortably longer than a poll so no change is
+# coalesced with the next one
+CHANGE_INTERVAL = 0.2
+
+
+class Client(threading.Thread):
+    """Simulates one connected stream client"""
+
+    def __init__(self, broadcaster, expected):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.broadcaster = broadcaster
+        self.expected = expected
+        self.events = broadcaster.subscribe()
+        self.latencies = []
+
+    def run(self):
+        try:
+            while len(self.latencies) < self.expected:
+                event = self.events.get(timeout=10)
+                self.latencies.append(time.time() - event['sent'])
+        finally:
+            self.broadcaster.unsubscribe(self.events)
+
+
+def _run(clients):
+    broadcaster = StateBroadcaster(POLL_INTERVAL)
+    sent = {}
+    publish = broadcaster.publish
+
+    def stamped_publish(event, teapot=DEFAULT_TEAPOT):
+        sent_at = sent.get(event['num_of_cups'], time.time())
+        publish(dict(event, sent=sent_at), teapot)
+    broadcaster.publish = stamped_publish
+
+    # Store the first reading before anyone connects, so clients only wait
+    # for the changes below
+    State.create(state='FULL_TEAPOT', timestamp=datetime.now(),
+                 num_of_cups=CHANGES, weight=2000, temperature=90)
+    broadcaster.start()
+    time.sleep(POLL_INTERVAL * 4)
+
+    threads = [Client(broadcaster, CHANGES) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+
+    start = time.time()
+    with count_queries(only_select=True) as counter:
+        for cups in reversed(range(CHANGES)):
+            sent[cups] = time.time()
+            State.create(state='GOOD_TEAPOT', timestamp=datetime.now(),
+                         num_of_cups=cups, weight=100 * cups, temperature=80)
+            time.sleep(CHANGE_INTERVAL)
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - start
+    broadcaster.stop()
+
+    latencies = sorted(l for thread in threads for l in thread.latencies)
+    assert len(latencies) == clients * CHANGES
+    return {
+        'delivered': len(latencies),
+        'queries': counter.count,
+        'polls': int(elapsed / POLL_INTERVAL),
+        'median': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000
+    }
+
+
+def main(client_counts):
+    print "%8s %10s %14s %10s %10s %10s" % (
+        'clients', 'delivered', 'select queries', '~polls',
+        'p50 (ms)', 'p99 (ms)')
+    for clients in client_counts:
+        with temporary_database(MODELS):
+            result = _run(clients)
+        print "%8d %10d %14d %10d %10.1f %10.1f" % (
+            clients, result['delivered'], result['queries'],
+            result['polls'], result['median'], result['p99'])
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1, 100, 500, 1000])
@@ -0,0 +1,78 @@
+"""Compares building the /stats/* charts from State model instances in Python
+with aggregating in SQLite, and with the closed buckets served from the
+cache, over a seeded history of sensor readings.
+
+Run with: python -m benchmarks.bench_stats [states]
+"""
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints import stats
+from benchmarks.seed import seed
+from benchmarks.utils import temporary_database, timed
+from collections import defaultdict
+from datetime import datetime, timedelta
+import sys
+
+READS = 5
+NOW = datetime(2017, 12, 20, 12)
+
+
+def _python_cups_per_hour(start, end):
+    """The old approach, every reading loaded as a model instance"""
+    cups = defaultdict(int)
+    previous = None
+    for state in State.select().where(
+            State.timestamp >= start,
+            State.timestamp < end).order_by(State.timestamp):
+        if previous is not None and state.state != 'FULL_TEAPOT':
+            cups[state.timestamp.replace(minute=0, second=0)] += max(
+                previous - state.num_of_cups, 0)
+        previous = state.num_of_cups
+    return sorted(cups.items())
+
+
+def _python_pots_per_day(start, end):
+    pots = defaultdict(int)
+    for state in State.select().where(
+            State.timestamp >= start,
+            State.timestamp < end):
+        if state.state == 'FULL_TEAPOT':
+            pots[state.timestamp.date()] += 1
+    return sorted(pots.items())
+
+
+def _read(func, *args, **kwargs):
+    for _ in range(READS):
+        list(func(*args, **kwargs))
+
+
+def _cached(name, start, end):
+    stat = stats.STATS[name]
+    return stats.stats_cache.get_rows(
+        name, stat, stats.bucket_range(stat, start, end), NOW)
+
+
+def main(states):
+    with temporary_database(MODELS) as database:
+        seed(database, states, 100, end=NOW)
+        print "%d readings, ms per request" % states
+        print "%-16s %6s %10s %10s %10s" % (
+            'stat', 'days', 'python', 'sql', 'cached')
+        for name, python in [('potsPerDay', _python_pots_per_day),
+                             ('cupsPerHour', _python_cups_per_hour),
+                             ('potAge', None), ('temperature', None)]:
+            for days in (1, 7, 30):
+                start = NOW - timedelta(days=days)
+                stats.stats_cache.clear()
+                _cached(name, start, NOW)
+                print "%-16s %6d %10s %10.2f %10.2f" % (
+                    name, days,
+                    '%.2f' % (timed(_read, python, start, NOW) * 1000 / READS)
+                    if python else '-',
+                    timed(_read, stats.STATS[name].query, start, NOW) *
+                    1000 / READS,
+                    timed(_read, _cached, name, start, NOW) * 1000 / READS
+                )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,57 @@
+"""Compares ingestion throughput of /storeState against /storeStates.
+
+Run with: python -m benchmarks.bench_store_states [number_of_readings]
+"""
+from teabot_endpoints.endpoints import app
+from teabot_endpoints.models import State, MODELS
+from benchmarks.utils import temporary_database, timed, report
+from datetime import datetime, timedelta
+import json
+import sys
+
+
+def _readings(count):
+    start = datetime(2017, 1, 1, 9, 0, 0)
+    return [
+        {
+            'state': 'FULL_TEAPOT',
+            'timestamp': (start + timedelta(seconds=i)).isoformat() + '.0',
+            'num_of_cups': 4,
+            'weight': 1500 - i % 500,
+            'temperature': 80
+        } for i in range(count)
+    ]
+
+
+def single_row(client, readings):
+    for reading in readings:
+        client.post("/storeState", data=json.dumps(reading))
+
+
+def batched(client, readings, batch_size):
+    for start in range(0, len(readings), batch_size):
+        client.post(
+            "/storeStates",
+            data="\n".join(
+                json.dumps(r) for r in readings[start:start + batch_size])
+        )
+
+
+def main(count):
+    readings = _readings(count)
+    client = app.test_client()
+
+    with temporary_database(MODELS):
+        report("storeState (one row per request)",
+               count, timed(single_row, client, readings))
+        assert State.select().count() == count
+
+    for batch_size in (10, 100, 1000):
+        with temporary_database(MODELS):
+            report("storeStates (batch of %s)" % batch_size,
+                   count, timed(batched, client, readings, batch_size))
+            assert State.select().count() == count
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
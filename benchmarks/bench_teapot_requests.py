@@ -0,0 +1,58 @@
+"""Compares the set based teapot request operations with updating pot makers
+one row at a time.
+
+Run with: python -m benchmarks.bench_teapot_requests [number_of_pot_makers]
+"""
+from teabot_endpoints.models import PotMaker, MODELS
+from benchmarks.utils import temporary_database, timed, report
+import sys
+
+
+def _seed(count):
+    PotMaker.insert_many([
+        {
+            'name': 'maker%s' % i,
+            'number_of_pots_made': 0,
+            'total_weight_made': 0,
+            'number_of_cups_made': 0,
+            'largest_single_pot': 0,
+            'mac_address': 'mac%s' % i,
+            'requested_teapot': i % 2 == 0
+        } for i in range(count)
+    ]).execute()
+
+
+def reset_row_by_row():
+    for maker in PotMaker.get_all():
+        maker.requested_teapot = False
+        maker.save()
+
+
+def flip_row_by_row(mac_addresses):
+    for mac_address in mac_addresses:
+        maker = PotMaker.get_single_pot_maker_by_mac_address(mac_address)
+        maker.requested_teapot = not maker.requested_teapot
+        maker.save()
+
+
+def main(count):
+    mac_addresses = ['mac%s' % i for i in range(0, count, 2)]
+    with temporary_database(MODELS):
+        with PotMaker._meta.database.atomic():
+            _seed(count)
+        report("reset, row by row", count, timed(reset_row_by_row),
+               'makers')
+        report("flip, row by row", len(mac_addresses),
+               timed(flip_row_by_row, mac_addresses), 'makers')
+        report("reset_teapot_requests", count,
+               timed(PotMaker.reset_teapot_requests), 'makers')
+        report("flip_requested_teapots", len(mac_addresses),
+               timed(PotMaker.flip_requested_teapots, mac_addresses),
+               'makers')
+        report("get_number_of_teapot_requests", count,
+               timed(PotMaker.get_number_of_teapot_requests), 'makers')
+        assert PotMaker.get_number_of_teapot_requests() == len(mac_addresses)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,69 @@
+"""Shows that reading one teapot costs the same however many teapots share
+the database, for the uncached reads behind the endpoints: the newest and
+latest full readings, the teapot's requests and reaction message, a day of
+stats and catching a prediction up with its readings.
+
+Run with: python -m benchmarks.bench_teapots [states per teapot]
+"""
+from teabot_endpoints.models import State, PotMaker, SlackMessages, MODELS
+from teabot_endpoints.prediction import Forecaster
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from teabot_endpoints import stats
+from benchmarks.seed import seed
+from benchmarks.utils import temporary_database, timed
+from datetime import datetime, timedelta
+import sys
+
+READS = 200
+STATS_READS = 20
+NOW = datetime(2017, 12, 20, 12)
+
+
+def _read(func, times, *args):
+    for _ in range(times):
+        result = func(*args)
+        if not isinstance(result, (int, tuple, type(None))):
+            list(result)
+
+
+def _catch_up(teapot):
+    forecaster = Forecaster(teapot=teapot)
+    forecaster.catch_up()
+
+
+def main(states):
+    reads = [
+        ('newest state', READS, State._query_newest_state_record),
+        ('latest full teapot', READS,
+         State._query_latest_full_teapot_record),
+        ('teapot requests', READS, PotMaker.get_number_of_teapot_requests),
+        ('reaction message', READS,
+         SlackMessages.get_reaction_message_details),
+        ('pots per day, 1 day', STATS_READS,
+         lambda teapot: stats.pots_per_day(
+             NOW - timedelta(days=1), NOW, teapot=teapot)),
+        ('cups per hour, 1 day', STATS_READS,
+         lambda teapot: stats.cups_per_hour(
+             NOW - timedelta(days=1), NOW, teapot=teapot)),
+        ('prediction catch up', STATS_READS, _catch_up),
+    ]
+    counts = (1, 10, 100)
+    print "%d readings per teapot, us per read" % states
+    print "%-24s" % 'teapots' + ''.join('%12d' % count for count in counts)
+    timings = dict((name, []) for name, _, _ in reads)
+    for count in counts:
+        teapots = [DEFAULT_TEAPOT] + [
+            'office%03d' % number for number in range(1, count)]
+        with temporary_database(MODELS) as database:
+            seed(database, states, 100, end=NOW, teapots=teapots)
+            for name, times, func in reads:
+                timings[name].append(
+                    timed(_read, func, times, DEFAULT_TEAPOT) * 1000000 /
+                    times)
+    for name, _, _ in reads:
+        print "%-24s" % name + ''.join(
+            '%12.1f' % timing for timing in timings[name])
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
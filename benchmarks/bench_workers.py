@@ -0,0 +1,46 @@
+"""Load tests the routes that wait on Slack or on other requests with each
+gunicorn worker class, with the fake Slack API answering slowly, and prints
+their throughput and p99 latency side by side.
+
+Run with: python -m benchmarks.bench_workers [slack_latency] [concurrency]
+"""
+from benchmarks import load_test
+import sys
+
+ROUTES = [
+    'GET /getNumberOfTeapotRequests',
+    'POST /teaReady',
+    'POST /storeState',
+    'GET /potMakers',
+    'GET /stateStream',
+]
+WORKERS = [
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync'}),
+    ('gthread', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8'}),
+    ('gevent', {'GUNICORN_WORKER_CLASS': 'gevent'}),
+]
+
+
+def main(slack_latency, concurrency):
+    results = [
+        (name, load_test.run(10000, 100, 5, concurrency, slack_latency,
+                             ROUTES, dict(env, GUNICORN_WORKERS='4')))
+        for name, env in WORKERS
+    ]
+    print "%d clients, Slack answering in %.0fms, 4 workers" % (
+        concurrency, slack_latency * 1000)
+    print "%-34s %s" % ('req/s, p99 ms', ''.join(
+        '%20s' % name for name, _ in results))
+    for route in ROUTES:
+        print "%-34s %s" % (route, ''.join(
+            '%10.1f %9.1f' % (result['routes'][route]['throughput'],
+                              result['routes'][route]['p99_ms'] or 0)
+            for _, result in results))
+    print "%-34s %s" % ('errors', ''.join(
+        '%20d' % sum(route['errors'] for route in result['routes'].values())
+        for _, result in results))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.2,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 32)
@@ -0,0 +1,94 @@
+"""Measures the sustained rate readings can be stored at, committing each
+one as it arrives and with write-behind buffering. First in process, one
+reading after another, then against gunicorn with several workers sending
+/storeState at once.
+
+Run with: python -m benchmarks.bench_write_behind [readings] [duration]
+"""
+from benchmarks import load_test
+from benchmarks.utils import temporary_database, timed, report
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.write_behind import WriteBehindBuffer
+from datetime import datetime, timedelta
+import shutil
+import sys
+import tempfile
+
+CONCURRENCY = [8, 32]
+WORKERS = '4'
+
+
+def _readings(count):
+    start = datetime(2017, 1, 1, 9)
+    return [
+        {
+            'state': 'GOOD_TEAPOT',
+            'timestamp': start + timedelta(seconds=number),
+            'num_of_cups': 4,
+            # Pairs of readings repeat each other, as in the load test
+            'weight': 1400 - (number // 2) % 2 * 100,
+            'temperature': 80
+        } for number in range(count)
+    ]
+
+
+def one_at_a_time(readings):
+    for reading in readings:
+        State.record_reading(reading)
+
+
+def buffered(buffer, readings):
+    for reading in readings:
+        buffer.append(reading)
+        if buffer.flush_due.is_set():
+            buffer.flush()
+    buffer.flush()
+
+
+def in_process(count):
+    readings = _readings(count)
+    with temporary_database(MODELS):
+        report("record_reading", count, timed(one_at_a_time, readings),
+               'readings')
+        stored = State.select().count()
+
+    directory = tempfile.mkdtemp()
+    try:
+        with temporary_database(MODELS):
+            buffer = WriteBehindBuffer(directory)
+            State.write_behind_buffer = buffer
+            report("write-behind", count, timed(buffered, buffer, readings),
+                   'readings')
+            assert State.select().count() == stored
+    finally:
+        State.write_behind_buffer = None
+        shutil.rmtree(directory)
+
+
+def against_gunicorn(duration):
+    print "%-34s %20s %20s" % ('req/s, p99 ms', 'one at a time',
+                               'write-behind')
+    for concurrency in CONCURRENCY:
+        results = [
+            load_test.run(10000, 100, duration, concurrency, 0.05,
+                          ['POST /storeState'],
+                          {'GUNICORN_WORKERS': WORKERS,
+                           'STATE_WRITE_BEHIND': write_behind})
+            ['routes']['POST /storeState']
+            for write_behind in ('0', '1')
+        ]
+        print "%-34s %s" % (
+            '%d clients, %s workers' % (concurrency, WORKERS),
+            ''.join('%10.1f %9.1f' % (result['throughput'], result['p99_ms'])
+                    for result in results))
+
+
+def main(count, duration):
+    in_process(count)
+    print
+    against_gunicorn(duration)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 10)
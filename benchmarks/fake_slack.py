@@ -0,0 +1,119 @@
+"""A local stand-in for the Slack Web API, so load tests don't post to a real
+Slack room. Point the app at it with SLACK_API_URL=http://127.0.0.1:<port>/api
+
+Run with: python -m benchmarks.fake_slack [port] [latency_ms]
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import json
+import sys
+import threading
+import time
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    """Answers chat.postMessage and reactions.get like Slack would, keeping
+    connections open between requests
+    """
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are written separately, with Nagle's algorithm
+    # the body would wait for the client's delayed ACK on a kept alive
+    # connection
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        api = self.path.split('?')[0].rsplit('/', 1)[-1]
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        retry_after = self.server.record_call(api)
+        time.sleep(self.server.latency)
+
+        if retry_after is not None:
+            self.send_response(429)
+            self.send_header('Retry-After', retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if api == 'chat.postMessage':
+            body = {'ok': True, 'channel': 'C0TEAPOT',
+                    'ts': '%.6f' % time.time()}
+        elif api == 'reactions.get':
+            body = {'ok': True, 'type': 'message', 'message': {
+                'reactions': [{'name': 'tea', 'count': 3},
+                              {'name': '+1', 'count': 2}]}}
+        else:
+            body = {'ok': False, 'error': 'unknown_method'}
+        payload = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSlackServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeSlackHandler)
+        self.latency = latency
+        self.calls = {}
+        self.connections = 0
+        self._rate_limits = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/api' % self.server_address[1]
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def rate_limit(self, api, times, retry_after):
+        """Answers the next calls to api with 429 Too Many Requests
+
+        Args:
+            - api (String) - The API method, e.g. chat.postMessage
+            - times (int) - Number of calls to refuse
+            - retry_after (String) - The Retry-After header sent
+        """
+        with self._lock:
+            self._rate_limits[api] = (times, retry_after)
+
+    def record_call(self, api):
+        """Counts a call, returning the Retry-After to refuse it with or
+        None to answer it
+        """
+        with self._lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+            times, retry_after = self._rate_limits.get(api, (0, None))
+            if not times:
+                return None
+            self._rate_limits[api] = (times - 1, retry_after)
+            return retry_after
+
+    def start(self):
+        """Serves requests from a background thread"""
+        thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+if __name__ == "__main__":
+    server = FakeSlackServer(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8900,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    )
+    print "Fake Slack API listening on %s" % server.url
+    server.serve_forever()
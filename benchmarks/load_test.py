@@ -0,0 +1,343 @@
+"""Load tests every route against gunicorn, started with the same command as
+the run script, on a freshly seeded database with Slack replaced by a local
+fake. Reports p50/p99 latency and throughput per route, writes them as JSON
+and compares them with an earlier run.
+
+Run with:
+    python -m benchmarks.load_test --states 1000000 --output results.json
+    python -m benchmarks.load_test --baseline results.json
+"""
+from benchmarks.fake_slack import FakeSlackServer
+from benchmarks.seed import main as seed_database
+from datetime import datetime, timedelta
+import argparse
+import itertools
+import json
+import os
+import requests
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RUN_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run')
+STARTUP_TIMEOUT = 30
+# Latency changes smaller than this are noise rather than regressions
+NOISE_FLOOR_MS = 1.0
+
+_reading_numbers = itertools.count()
+_reading_start = datetime.now() + timedelta(seconds=1)
+
+
+def _reading(number):
+    """A sensor reading after every seeded one. Pairs of readings repeat each
+    other, so half of them are dropped as repeats.
+    """
+    return {
+        'state': 'GOOD_TEAPOT',
+        'timestamp': (_reading_start + timedelta(
+            seconds=number, microseconds=1)).isoformat(),
+        'num_of_cups': 4,
+        'weight': 1400 - (number // 2) % 2 * 100,
+        'temperature': 80
+    }
+
+
+def _store_state(number):
+    return json.dumps(_reading(next(_reading_numbers)))
+
+
+def _store_states(number):
+    return '\n'.join(
+        json.dumps(_reading(next(_reading_numbers))) for _ in range(50))
+
+
+def _claim_pot(number):
+    return json.dumps({'potMaker': 'maker%05d' % (number % 100)})
+
+
+def _flip_teapot_request(number):
+    return json.dumps({'dash_mac_address': 'mac%05d' % (number % 100)})
+
+
+# (name, method, path, request body builder)
+SCENARIOS = [
+    ('GET /imATeapot', 'GET', '/imATeapot', None),
+    ('GET /teabotWebhook', 'GET', '/teabotWebhook', None),
+    ('POST /teabotWebhook', 'POST', '/teabotWebhook', None),
+    ('GET /numberOfNewTeapots', 'GET', '/numberOfNewTeapots', None),
+    ('GET /teapotAge', 'GET', '/teapotAge', None),
+    ('GET /teapotPrediction', 'GET', '/teapotPrediction', None),
+    ('GET /potMakers', 'GET', '/potMakers', None),
+    ('GET /leaderboard', 'GET', '/leaderboard?sort=weight&page=2', None),
+    ('GET /leaderboard week', 'GET', '/leaderboard?period=week', None),
+    ('GET /stats/potsPerDay', 'GET', '/stats/potsPerDay', None),
+    ('GET /stats/potAge', 'GET', '/stats/potAge', None),
+    ('GET /stats/cupsPerHour', 'GET', '/stats/cupsPerHour', None),
+    ('GET /stats/temperature', 'GET', '/stats/temperature', None),
+    ('GET /getNumberOfTeapotRequests', 'GET', '/getNumberOfTeapotRequests',
+     None),
+    ('GET /metrics', 'GET', '/metrics', None),
+    ('POST /storeState', 'POST', '/storeState', _store_state),
+    ('POST /storeStates', 'POST', '/storeStates', _store_states),
+    ('POST /claimPot', 'POST', '/claimPot', _claim_pot),
+    ('POST /flipTeapotRequest', 'POST', '/flipTeapotRequest',
+     _flip_teapot_request),
+    ('POST /teaReady', 'POST', '/teaReady', None),
+    # Last, a sync worker stays busy with a stream until its next keepalive
+    ('GET /stateStream', 'STREAM', '/stateStream', None),
+]
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def gunicorn_command(port):
+    """The gunicorn command from the run script, bound to port"""
+    with open(RUN_SCRIPT) as run_script:
+        line = [l for l in run_script if l.startswith('exec gunicorn')][0]
+    args = shlex.split(line)[1:]
+    args[0] = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    args[args.index('-b') + 1] = '127.0.0.1:%d' % port
+    if '--log-level' in args:
+        args[args.index('--log-level') + 1] = 'warning'
+    return args
+
+
+def _wait_until_ready(url, process):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with %s" % process.returncode)
+        try:
+            requests.get(url + '/imATeapot', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn didn't start within %ss" % STARTUP_TIMEOUT)
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def _send(session, method, url, body):
+    if method == 'STREAM':
+        response = session.get(url, stream=True, timeout=30)
+        # Without chunk_size=1 requests waits for 512 bytes before it splits
+        # the first line, which only the keepalives would fill
+        for line in response.iter_lines(chunk_size=1):
+            if line.startswith('data:'):
+                break
+        response.close()
+        return response.status_code
+    return session.request(method, url, data=body, timeout=30).status_code
+
+
+def run_scenario(base_url, scenario, duration, concurrency):
+    """Sends requests for one route from concurrency threads for duration
+    seconds
+
+    Returns:
+        - dict - requests, errors, throughput and p50/p99 latency in ms
+    """
+    name, method, path, body = scenario
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    numbers = itertools.count()
+    deadline = time.time() + duration
+
+    def client():
+        session = requests.Session()
+        while time.time() < deadline:
+            data = body(next(numbers)) if body else None
+            start = time.time()
+            try:
+                failed = _send(session, method, base_url + path, data) >= 500
+            except requests.RequestException:
+                failed = True
+            elapsed = time.time() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+
+    start = time.time()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': _percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lists the routes that got slower than the baseline
+
+    Args:
+        - results (dict) - This run's results
+        - baseline (dict) - An earlier run's results
+        - tolerance (float) - Allowed change, 0.25 is 25%
+    Returns:
+        - list of strings describing each regression
+    """
+    regressions = []
+    for name, result in sorted(results['routes'].items()):
+        before = baseline['routes'].get(name)
+        if not before or not before['requests'] or not result['requests']:
+            continue
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance) and \
+                result['p99_ms'] - before['p99_ms'] > NOISE_FLOOR_MS:
+            regressions.append("%s p99 %.1fms -> %.1fms" % (
+                name, before['p99_ms'], result['p99_ms']))
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append("%s throughput %.0f/s -> %.0f/s" % (
+                name, before['throughput'], result['throughput']))
+        if result['errors'] > before['errors']:
+            regressions.append("%s errors %d -> %d" % (
+                name, before['errors'], result['errors']))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print "%-34s %8s %7s %10s %9s %9s %9s" % (
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms',
+        'p99 was')
+    for name, _, _, _ in SCENARIOS:
+        result = results['routes'].get(name)
+        if result is None:
+            continue
+        before = (baseline or {}).get('routes', {}).get(name)
+        print "%-34s %8d %7d %10.1f %9.2f %9.2f %9s" % (
+            name, result['requests'], result['errors'],
+            result['throughput'], result['p50_ms'] or 0,
+            result['p99_ms'] or 0,
+            '%.2f' % before['p99_ms'] if before else '-')
+
+
+def run(states, pot_makers, duration, concurrency, slack_latency,
+        routes=None, worker_env=None):
+    """Seeds a database, starts the fake Slack API and gunicorn, and load
+    tests each route in turn
+
+    Args:
+        - worker_env (dict) - Optional GUNICORN_* settings for the workers
+    Returns:
+        - dict - The results
+    """
+    directory = tempfile.mkdtemp()
+    slack = FakeSlackServer(latency=slack_latency).start()
+    port = _free_port()
+    command = gunicorn_command(port)
+    try:
+        database_path = os.path.join(directory, 'teapot.db')
+        seed_database(database_path, states, pot_makers)
+        env = dict(
+            os.environ,
+            DATABASE_URL='sqlite:///%s' % database_path,
+            SLACK_API_URL=slack.url,
+            SLACK_API_TOKEN='xoxb-load-test',
+            METRICS_DIR=os.path.join(directory, 'metrics'),
+            STATE_WRITE_BEHIND_DIR=os.path.join(directory, 'write_behind'),
+            STATE_STREAM_KEEPALIVE='1',
+            **(worker_env or {})
+        )
+        process = subprocess.Popen(command, env=env, cwd=os.path.dirname(
+            RUN_SCRIPT))
+        try:
+            base_url = 'http://127.0.0.1:%d' % port
+            _wait_until_ready(base_url, process)
+            results = {}
+            for scenario in SCENARIOS:
+                if routes and scenario[0] not in routes:
+                    continue
+                results[scenario[0]] = run_scenario(
+                    base_url, scenario, duration, concurrency)
+        finally:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+    finally:
+        slack.shutdown()
+        shutil.rmtree(directory)
+
+    return {
+        'config': {
+            'states': states,
+            'pot_makers': pot_makers,
+            'duration': duration,
+            'concurrency': concurrency,
+            'slack_latency': slack_latency,
+            'command': ' '.join(command[1:]),
+            'workers': worker_env or {},
+        },
+        'routes': results,
+        'slack_calls': slack.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--states', type=int, default=100000,
+                        help='State rows to seed, from 1000 to 10000000')
+    parser.add_argument('--pot-makers', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=5,
+                        help='Seconds to load each route for')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--slack-latency', type=float, default=0.05,
+                        help='Seconds the fake Slack API takes to answer')
+    parser.add_argument('--worker-class',
+                        help='gunicorn worker class, e.g. sync or gevent')
+    parser.add_argument('--threads', help='Threads per gthread worker')
+    parser.add_argument('--route', action='append', dest='routes',
+                        help='Only test this route, e.g. "GET /potMakers"')
+    parser.add_argument('--output', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    worker_env = {}
+    if args.worker_class:
+        worker_env['GUNICORN_WORKER_CLASS'] = args.worker_class
+    if args.threads:
+        worker_env['GUNICORN_THREADS'] = args.threads
+    results = run(args.states, args.pot_makers, args.duration,
+                  args.concurrency, args.slack_latency, args.routes,
+                  worker_env)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print "REGRESSION: %s" % regression
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Fills a SQLite database with realistic teapot data for load testing: pot
+makers with dash buttons, a sensor reading every ten seconds from each teapot
+cycling through full, good, cold and empty teapots, most pots claimed, and
+each teapot's current Slack reaction message.
+
+Run with: python -m benchmarks.seed path/to/teapot.db [states] [pot_makers]
+"""
+from teabot_endpoints.models import MODELS, State, PotMakerStats, \
+    DataVersion, create_database, teapot_key, STATE_VERSION, \
+    POT_MAKER_VERSION, STATE_HISTORY_VERSION
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from playhouse.test_utils import test_database
+from datetime import datetime, timedelta
+from itertools import islice
+import random
+import sys
+
+READING_INTERVAL = timedelta(seconds=10)
+# Readings per pot, from full through to empty
+POT_CYCLE = [('FULL_TEAPOT', 1), ('GOOD_TEAPOT', 120), ('COLD_TEAPOT', 60),
+             ('EMPTY_TEAPOT', 180)]
+CHUNK_SIZE = 50000
+
+
+def _readings(states, pot_makers, end, rand):
+    """Generates (state, timestamp, num_of_cups, weight, temperature,
+    claimed_by_id) rows, the last one at end
+    """
+    timestamp = end - READING_INTERVAL * (states - 1)
+    produced = 0
+    while produced < states:
+        cups = rand.randint(2, 8)
+        full_weight = 400 + cups * 250
+        claimed_by = rand.randint(1, pot_makers) \
+            if pot_makers and rand.random() < 0.7 else None
+        for state, readings in POT_CYCLE:
+            for reading in range(readings):
+                if produced == states:
+                    return
+                if state == 'FULL_TEAPOT':
+                    row = (state, cups, full_weight, 95, claimed_by)
+                elif state == 'EMPTY_TEAPOT':
+                    row = (state, 0, 400, 25, None)
+                else:
+                    left = max(1, cups - reading * cups // 120)
+                    row = (state, left, 400 + left * 250,
+                           max(30, 90 - reading // 3), None)
+                yield (row[0], str(timestamp), row[1], row[2], row[3],
+                       row[4])
+                timestamp += READING_INTERVAL
+                produced += 1
+
+
+def seed(database, states, pot_makers, end=None, seed_value=0,
+         teapots=(DEFAULT_TEAPOT,)):
+    """Inserts the load test data into an empty database
+
+    Args:
+        - database (Database) - Database the MODELS tables exist in
+        - states (int) - Number of State readings of each teapot
+        - pot_makers (int) - Number of pot makers, their dash buttons have
+        mac addresses mac00000, mac00001...
+        - end (datetime) - Time of the newest reading, defaults to now
+        - teapots (list) - Names of the teapots, the pot makers' requests
+        are spread across them
+    """
+    rand = random.Random(seed_value)
+    end = end or datetime.now()
+    cursor = database.get_cursor()
+    with database.atomic():
+        cursor.executemany(
+            'INSERT INTO potmaker (name, number_of_pots_made, '
+            'total_weight_made, number_of_cups_made, largest_single_pot, '
+            'inactive, requested_teapot, mac_address, teapot) '
+            'VALUES (?, 0, 0, 0, 0, ?, ?, ?, ?)',
+            (
+                ('maker%05d' % i, rand.random() < 0.1, rand.random() < 0.3,
+                 'mac%05d' % i, teapots[i % len(teapots)])
+                for i in range(pot_makers)
+            )
+        )
+    for teapot in teapots:
+        rows = _readings(states, pot_makers, end, rand)
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            with database.atomic():
+                cursor.executemany(
+                    'INSERT INTO state (state, timestamp, num_of_cups, '
+                    'weight, temperature, claimed_by_id, last_seen, teapot) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (row + (row[1], teapot) for row in chunk)
+                )
+    with database.atomic():
+        cursor.execute(
+            'UPDATE potmaker SET '
+            'number_of_pots_made = (SELECT COUNT(*) FROM state '
+            'WHERE claimed_by_id = potmaker.id), '
+            'total_weight_made = (SELECT COALESCE(SUM(weight), 0) FROM state '
+            'WHERE claimed_by_id = potmaker.id), '
+            'number_of_cups_made = (SELECT COALESCE(SUM(num_of_cups), 0) '
+            'FROM state WHERE claimed_by_id = potmaker.id), '
+            'largest_single_pot = (SELECT COALESCE(MAX(weight), 0) '
+            'FROM state WHERE claimed_by_id = potmaker.id)'
+        )
+        cursor.executemany(
+            "INSERT INTO slackmessages (timestamp, channel, teapot) "
+            "VALUES (?, ?, ?)",
+            (('1500000000.%06d' % (i + 100), 'C%dTEAPOT' % i, teapot)
+             for i, teapot in enumerate(teapots))
+        )
+    State.backfill_counters()
+    PotMakerStats.rebuild()
+    # The rows skipped the models, so stamp them like model writes would
+    for name in [teapot_key(STATE_VERSION, teapot) for teapot in teapots] + \
+            [POT_MAKER_VERSION, STATE_HISTORY_VERSION]:
+        DataVersion.bump(name)
+
+
+def main(path, states, pot_makers):
+    database = create_database('sqlite:///%s' % path)
+    with test_database(database, MODELS, drop_tables=False):
+        seed(database, states, pot_makers)
+    database.close()
+    print "Seeded %s with %d readings and %d pot makers" % (
+        path, states, pot_makers)
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    )
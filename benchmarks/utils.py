@@ -0,0 +1,40 @@
+from contextlib import contextmanager
+from playhouse.sqlite_ext import SqliteExtDatabase
+from playhouse.test_utils import test_database
+import shutil
+import tempfile
+import os
+import time
+
+
+@contextmanager
+def temporary_database(models):
+    """Binds the given models to a fresh on-disk SQLite database, so that
+    benchmarks pay the same commit costs as production.
+
+    Args:
+        - models (list) - Model classes to create tables for
+    Yields:
+        - SqliteExtDatabase - The temporary database
+    """
+    directory = tempfile.mkdtemp()
+    database = SqliteExtDatabase(os.path.join(directory, 'teapot.db'))
+    try:
+        with test_database(database, models):
+            yield database
+        database.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def timed(func, *args, **kwargs):
+    """Runs func and returns how long it took in seconds"""
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def report(name, count, seconds, unit='rows'):
+    """Prints a single throughput line"""
+    print "%-40s %8d %s in %7.3fs  %10.1f %s/sec" % (
+        name, count, unit, seconds, count / seconds, unit)
@@ -1,21 +1,44 @@
-from flask import Flask, Response, jsonify, request, got_request_exception
-import rollbar
-import rollbar.contrib.flask
-from settings import ROLLBAR_API_TOKEN
+from flask import Flask, Response, request, got_request_exception, \
+    make_response, g
+from settings import ROLLBAR_API_TOKEN, STATE_STREAM_KEEPALIVE, \
+    STATE_STREAM_MAX_DURATION, HTTP_CACHE_MAX_AGE, STATS_MAX_BUCKETS, \
+    STATE_WRITE_BEHIND, DEFAULT_TEAPOT, TEAPOT_ROOMS
 import os
 from slack_communicator import SlackCommunicator
-from models import State, PotMaker, SlackMessages
-import json
+from retention import start_retention_worker
+import retention
+import write_behind
+from events import StateBroadcaster
+from prediction import Forecaster
+import codec
+from codec import json_response
+import metrics
+import stats
+import models
+from models import db, State, PotMaker, PotMakerStats, SlackMessages, \
+    DataVersion, STATE_VERSION, POT_MAKER_VERSION, period_start, teapot_key
+from functools import wraps
+import hashlib
+import sys
+import threading
+import time
+import Queue
 from datetime import datetime
 
 
 app = Flask(__name__)
 slack_communicator_wrapper = SlackCommunicator()
+state_broadcaster = StateBroadcaster()
+# Each teapot's Forecaster, created when its prediction is first asked for
+teapot_forecasters = {}
+teapot_forecasters_lock = threading.Lock()
 
 
-@app.before_first_request
 def init_rollbar():
-    """init rollbar module"""
+    """Reports the app's exceptions to rollbar"""
+    import rollbar
+    import rollbar.contrib.flask
+
     rollbar.init(
         # api key
         ROLLBAR_API_TOKEN,
@@ -31,6 +54,171 @@ def init_rollbar():
     got_request_exception.connect(rollbar.contrib.flask.report_exception, app)
 
 
+def create_app():
+    """Sets up the app and returns it, this is the entry point gunicorn runs
+    (teabot_endpoints.endpoints:create_app()). Rollbar is set up here, when
+    a token is configured, rather than on the first request, and the Slack
+    client and database are left for warm_up to prepare in each worker.
+
+    Returns:
+        - Flask - The app
+    """
+    if ROLLBAR_API_TOKEN and not app.extensions.get('rollbar'):
+        init_rollbar()
+        app.extensions['rollbar'] = True
+    return app
+
+
+def warm_up():
+    """Builds the Slack client, generates the record queries' SQL and
+    connects to the database, called in each worker once it has been forked
+    so its first requests are as fast as the rest
+    """
+    slack_communicator_wrapper.slack
+    models.warm_up()
+    # The first strptime call imports _strptime and compiles its patterns,
+    # which is slow and isn't thread safe
+    datetime.strptime('2017-01-01T09:00:00.000000', STATE_TIMESTAMP_FORMAT)
+    # Creates the metrics directory and this worker's snapshot
+    metrics.flush()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.time()
+    metrics.start_request()
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exception):
+    """Records the request's latency and database queries, requests that
+    raised are counted as 500s
+    """
+    start = getattr(g, 'request_start', None)
+    if start is None:
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.finish_request(
+        route,
+        request.method,
+        getattr(g, 'response_status', 500) if exception is None else 500,
+        time.time() - start
+    )
+    metrics.maybe_flush()
+
+
+@app.teardown_request
+def close_database(exception):
+    """Closes the database connection opened by the request's first query,
+    returning it to the pool when one is configured
+    """
+    if not db.is_closed():
+        db.close()
+
+
+# Slack calls time out after ten seconds, anything still running after this
+# is left to die with the worker
+BACKGROUND_WORKER_STOP_TIMEOUT = 2
+
+
+def start_background_workers():
+    """Starts the threads that do slow work outside of requests, called once
+    in each worker process after it has been forked
+    """
+    slack_communicator_wrapper.start_outbox_worker()
+    start_retention_worker()
+    if STATE_WRITE_BEHIND:
+        write_behind.start_write_behind()
+
+
+def stop_background_workers(timeout=BACKGROUND_WORKER_STOP_TIMEOUT):
+    """Stops the background threads, called as a worker exits so they don't
+    run on while the interpreter shuts down
+
+    Args:
+        - timeout (float) - Seconds to wait for each thread to finish
+    """
+    workers = [
+        worker for worker in (slack_communicator_wrapper.outbox_worker,
+                              retention.retention_worker, state_broadcaster,
+                              write_behind.write_behind_worker)
+        if worker is not None
+    ]
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
+
+
+def _cache_control(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = HTTP_CACHE_MAX_AGE
+    return response
+
+
+def _teapot():
+    """Returns the teapot the request is for, from its teapot argument
+
+    Returns:
+        - String - Name of the teapot, DEFAULT_TEAPOT if none is given
+    Raises:
+        - codec.RequestError 404 if the teapot isn't one of TEAPOT_ROOMS
+    """
+    teapot = request.args.get('teapot', DEFAULT_TEAPOT)
+    if teapot not in TEAPOT_ROOMS:
+        raise codec.RequestError("Unknown teapot: %s" % teapot, status=404)
+    return teapot
+
+
+def versioned(*version_names, **options):
+    """Decorator for GET endpoints whose response only changes when one of
+    the named DataVersion stamps does. Responses carry an ETag built from the
+    stamps and a request with a matching If-None-Match gets a 304 without
+    the view running.
+
+    Args:
+        - version_names (String) - Names of the DataVersion stamps the
+        response is built from
+        - key (callable) - Optional, returns a string identifying anything
+        else the response depends on, such as the current time period
+        - teapot (callable) - Optional, returns the teapot the request is
+        for, whose own stamps are used, see models.teapot_key
+    """
+    key = options.get('key')
+    teapot = options.get('teapot')
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            names = version_names
+            if teapot is not None:
+                names = [teapot_key(name, teapot()) for name in names]
+            parts = [request.full_path] + [
+                DataVersion.get_stamp(name) or '' for name in names
+            ]
+            if key is not None:
+                parts.append(key())
+            # The path is unicode and may hold any character
+            etag = hashlib.sha1(':'.join(parts).encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            return _cache_control(response)
+        return wrapper
+    return decorator
+
+
 def _cup_puraliser(number_of_cups):
     """Correctly puralises the number of cups remaining
 
@@ -50,12 +238,13 @@ def teaReady():
     alerting everyone that a teapot is ready with X number of cups in it.
 
     Args:
-        - num_of_cups (int) - The number of cups in the teapot
+        - teapot (string) - The teapot that's ready, posted to its room
     Returns
         - 200
     """
-    latest_state = State.get_newest_state()
-    last_full_pot = State.get_latest_full_teapot()
+    teapot = _teapot()
+    latest_state = State.get_newest_state_record(teapot)
+    last_full_pot = State.get_latest_full_teapot_record(teapot)
     number_of_cups = latest_state.num_of_cups
     message = "The Teapot :teapot: is ready with %s" % (
         _cup_puraliser(number_of_cups)
@@ -63,37 +252,189 @@ def teaReady():
     reaction_message = \
         "Want a cup of tea from the next teapot ? " + \
         "React to this message to let everyone know!"
-    if last_full_pot.claimed_by:
-        message += ", thanks to %s" % last_full_pot.claimed_by.name
-    slack_communicator_wrapper.post_message_to_room(message)
-    PotMaker.reset_teapot_requests()
-    SlackMessages.clear_slack_message()
-    slack_communicator_wrapper.post_message_to_room(reaction_message, True)
+    if last_full_pot.claimed_by_id:
+        message += ", thanks to %s" % last_full_pot.claimed_by_name
+    slack_communicator_wrapper.post_message_to_room(
+        message, teapot=teapot)
+    PotMaker.reset_teapot_requests(teapot)
+    SlackMessages.clear_slack_message(teapot)
+    slack_communicator_wrapper.post_message_to_room(
+        reaction_message, True, teapot)
     return Response()
 
 
+STATE_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _state_timestamp(value):
+    return datetime.strptime(value, STATE_TIMESTAMP_FORMAT)
+
+
+# A reading sent by the teapot sensor, converted to State field values
+STATE_SCHEMA = codec.Schema({
+    'state': codec.Field(codec.string),
+    'timestamp': codec.Field(_state_timestamp),
+    'num_of_cups': codec.Field(codec.integer),
+    'weight': codec.Field(
+        codec.integer, required=False, default=-1, nullable=True),
+    'temperature': codec.Field(
+        codec.integer, required=False, default=1, nullable=True)
+})
+CLAIM_POT_SCHEMA = codec.Schema({
+    'potMaker': codec.Field(codec.string, required=False)
+})
+DASH_BUTTON_SCHEMA = codec.Schema({
+    'dash_mac_address': codec.Field(codec.string)
+})
+
+
+@app.errorhandler(codec.RequestError)
+def request_error(error):
+    return error.response()
+
+
+def _load_readings(body):
+    """Splits a request body into individual readings. The body is either a
+    JSON array or newline delimited JSON, one reading per line.
+
+    Args:
+        - body (string) - The raw request body
+    Returns:
+        - list of (reading, error) tuples, error is None if the reading
+        could be decoded
+    Raises:
+        - ValueError if the body is a malformed JSON array
+    """
+    body = body.strip()
+    if body.startswith('['):
+        return [(reading, None) for reading in codec.loads(body)]
+
+    readings = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            readings.append((codec.loads(line), None))
+        except ValueError as e:
+            readings.append((None, str(e)))
+    return readings
+
+
 @app.route("/storeState", methods=['POST'])
 def storeState():
-    """Inserts the state of the teapot into the database
+    """Inserts the state of the teapot into the database. Readings that
+    repeat the last stored reading only update its last_seen time. With
+    write-behind on, readings that don't change the state of the teapot are
+    buffered and stored in batches.
 
     Args:
         - state (string) - The current state of the teapot
         - timestamp (string) - The time that this state happened
         - num_of_cups (int) - The number of cups left in the teapot
+        - teapot (string) - Query argument, the teapot that sent the reading
     Returns
         - 200
+        - 400 {error: string, fields: {field: string}} if the reading is
+        invalid
     """
-    data = json.loads(request.data)
-    State.create(
-        state=data["state"],
-        timestamp=datetime.strptime(data["timestamp"], "%Y-%m-%dT%H:%M:%S.%f"),
-        num_of_cups=data["num_of_cups"],
-        weight=data.get("weight", -1),
-        temperature=data.get("temperature", 1)
-    )
+    teapot = _teapot()
+    reading = codec.parse(request.data, STATE_SCHEMA)
+    reading['teapot'] = teapot
+    if write_behind.state_buffer is not None:
+        # Buffered readings are counted in the metrics once they're stored
+        stored = write_behind.state_buffer.append(reading)
+    else:
+        stored = State.record_reading(reading)
+        metrics.record_state_reading(stored)
+    if stored:
+        state_broadcaster.notify()
     return Response()
 
 
+@app.route("/storeStates", methods=['POST'])
+def storeStates():
+    """Inserts a batch of teapot states into the database in one transaction.
+    Readings that fail validation are reported back and skipped, the rest of
+    the batch is still stored.
+
+    Args:
+        - A JSON array or newline delimited JSON of readings, each taking the
+        same arguments as /storeState
+        - teapot (string) - Query argument, the teapot that sent the readings
+    Returns:
+        - {stored: int, errors: [{index: int, error: string}]}
+    """
+    teapot = _teapot()
+    try:
+        readings = _load_readings(request.data)
+    except ValueError as e:
+        return json_response(
+            {'stored': 0, 'errors': [{'error': str(e)}]}, 400)
+
+    rows = []
+    errors = []
+    for index, (reading, error) in enumerate(readings):
+        if error is None:
+            try:
+                rows.append(dict(
+                    STATE_SCHEMA.validate(reading), teapot=teapot))
+                continue
+            except codec.RequestError as e:
+                error = str(e)
+        errors.append({'index': index, 'error': error})
+
+    stored = State.store_states(rows)
+    if stored:
+        state_broadcaster.notify()
+    return json_response({'stored': stored, 'errors': errors})
+
+
+def _server_sent_event(event):
+    return "event: state\ndata: %s\n\n" % codec.dumps(event)
+
+
+@app.route("/stateStream")
+def stateStream():
+    """Streams teapot state changes as server-sent events. The current state
+    is sent as soon as the client connects, followed by an event each time
+    the state or number of cups changes.
+
+    Args:
+        - teapot (string) - The teapot to watch
+    Returns
+        - text/event-stream of state events
+            - {state, timestamp, num_of_cups, weight, temperature}
+    """
+    teapot = _teapot()
+    events = state_broadcaster.subscribe(teapot)
+
+    def stream():
+        try:
+            yield "retry: 1000\n\n"
+            current_event = state_broadcaster.current_event(teapot)
+            if current_event:
+                yield _server_sent_event(current_event)
+            deadline = time.time() + STATE_STREAM_MAX_DURATION
+            while time.time() < deadline:
+                try:
+                    # Waits no later than the deadline, so the stream can't
+                    # outlast the worker timeout by a keepalive interval
+                    event = events.get(timeout=max(0, min(
+                        STATE_STREAM_KEEPALIVE, deadline - time.time())))
+                except Queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _server_sent_event(event)
+        finally:
+            state_broadcaster.unsubscribe(events, teapot)
+
+    return Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 def _human_teapot_state(state):
     base_text = 'There %s %s left' % \
         (_are_or_is(state.num_of_cups), _cup_puraliser(state.num_of_cups))
@@ -108,26 +449,49 @@ def _are_or_is(number_of_cups):
     return "are"
 
 
+def _webhook_teapot():
+    """Returns the teapot a Slack webhook is asking about, the one whose room
+    the command was sent from unless the teapot argument says otherwise
+    """
+    channel = request.values.get('channel_name')
+    if 'teapot' not in request.args and channel:
+        for teapot, room in TEAPOT_ROOMS.items():
+            if room.lstrip('#') == channel:
+                return teapot
+    return _teapot()
+
+
 @app.route("/teabotWebhook", methods=["POST", "GET"])
+@versioned(STATE_VERSION, teapot=_webhook_teapot)
 def webhook():
     """Listens for POSTs from Slack, which are requests for the current
     state of the teapot.
 
     Args:
-        - None
+        - teapot (string) - The teapot to describe, defaults to the one
+        whose room the request came from
     Returns
         - JSON payload
             - text (string) - Describing the current state of the teapot
     """
-    latest_state = State.get_newest_state()
+    latest_state = State.get_newest_state_record(_webhook_teapot())
     if latest_state:
-        return jsonify(
+        return json_response(
             {
                 'text': _human_teapot_state(latest_state)
             }
         )
     else:
-        return jsonify({'text': 'Theres no teapot data :('})
+        return json_response({'text': 'Theres no teapot data :('})
+
+
+@app.route("/metrics")
+def metricsEndpoint():
+    """Returns request, database and Slack metrics for every worker in the
+    Prometheus text format
+    """
+    return Response(
+        metrics.collect(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route("/imATeapot")
@@ -137,16 +501,17 @@ def imATeapot():
 
 
 @app.route("/numberOfNewTeapots")
+@versioned(STATE_VERSION, teapot=_teapot)
 def numberOfNewTeapots():
     """Returns a JSON blob containing the total number of teapots made
 
     Args:
-        - None
+        - teapot (string) - The teapot to count the pots of
     Returns
         - {numberOfTeapots: X}
     """
-    number_of_teapots = State.get_number_of_new_teapots()
-    return jsonify({"numberOfTeapots": number_of_teapots})
+    number_of_teapots = State.get_number_of_new_teapots(_teapot())
+    return json_response({"numberOfTeapots": number_of_teapots})
 
 
 def _get_current_time():
@@ -158,18 +523,67 @@ def teapotAge():
     """Returns a JSON blob containing the age of the teapot in minutes
 
     Args:
-        - None
+        - teapot (string) - The teapot to give the age of
     Returns
         - {teapotAge: X}
     """
-    latest_pot = State.get_latest_full_teapot()
+    latest_pot = State.get_latest_full_teapot_record(_teapot())
     teapot_age = _get_current_time() - latest_pot.timestamp
     teapot_age = teapot_age.total_seconds() / 60
 
-    return jsonify({"teapotAge": teapot_age})
+    # The age changes every request, so it can only be cached for max-age
+    return _cache_control(json_response({"teapotAge": teapot_age}))
+
+
+def _teapot_forecaster(teapot):
+    forecaster = teapot_forecasters.get(teapot)
+    if forecaster is None:
+        with teapot_forecasters_lock:
+            forecaster = teapot_forecasters.setdefault(
+                teapot, Forecaster(teapot=teapot))
+    return forecaster
+
+
+def _minutes_until(now, then):
+    if then is None:
+        return None
+    return max(0.0, (then - now).total_seconds() / 60)
+
+
+@app.route("/teapotPrediction")
+def teapotPrediction():
+    """Returns a JSON blob predicting when the teapot will be empty and when
+    it will have gone cold, from the trend of its recent readings
+
+    Args:
+        - teapot (string) - The teapot to predict
+    Returns
+        - {
+            minutesUntilEmpty: float,
+            minutesUntilCold: float,
+            emptyAt: string,
+            coldAt: string,
+            weightPerMinute: float,
+            temperaturePerMinute: float
+        }
+        Values are null if there aren't enough readings to predict from, or
+        the pot isn't getting emptier or colder. Minutes are 0 once it's
+        empty or cold.
+    """
+    prediction = _teapot_forecaster(_teapot()).predict()
+    now = _get_current_time()
+    return _cache_control(json_response({
+        'minutesUntilEmpty': _minutes_until(now, prediction.empty_at),
+        'minutesUntilCold': _minutes_until(now, prediction.cold_at),
+        'emptyAt': prediction.empty_at and prediction.empty_at.isoformat(),
+        'coldAt': prediction.cold_at and prediction.cold_at.isoformat(),
+        'weightPerMinute': prediction.weight_per_minute,
+        'temperaturePerMinute': prediction.temperature_per_minute
+    }))
 
 
 @app.route("/potMakers")
+@versioned(POT_MAKER_VERSION)
 def potMakers():
     """Returns a JSON blob containing details on potmakers
 
@@ -185,9 +599,8 @@ def potMakers():
             inactive: bool
         }]
     """
-    all_pot_makers = PotMaker.get_all()
     results = []
-    for pot_maker in all_pot_makers:
+    for pot_maker in PotMaker.iter_records():
         results.append({
             'name': pot_maker.name,
             'numberOfPotsMade': pot_maker.number_of_pots_made,
@@ -197,7 +610,207 @@ def potMakers():
             'inactive': pot_maker.inactive
         })
 
-    return jsonify({"potMakers": results})
+    return json_response({"potMakers": results})
+
+
+LEADERBOARD_SORTS = {
+    'pots': 'number_of_pots_made',
+    'weight': 'total_weight_made',
+    'cups': 'number_of_cups_made',
+    'largest': 'largest_single_pot'
+}
+LEADERBOARD_PERIODS = {
+    'all': None,
+    'week': PotMakerStats.WEEK,
+    'month': PotMakerStats.MONTH
+}
+LEADERBOARD_MAX_PER_PAGE = 100
+
+
+def _leaderboard_period_key():
+    """The week and month leaderboards roll over with time as well as with
+    new claims
+    """
+    now = _get_current_time()
+    return ':'.join(
+        str(period_start(period, now)) for period in PotMakerStats.PERIODS)
+
+
+def _int_argument(name, default, minimum, maximum):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ValueError("Invalid %s: %r" % (name, request.args[name]))
+    if not minimum <= value <= maximum:
+        raise ValueError("%s must be between %s and %s" % (
+            name, minimum, maximum))
+    return value
+
+
+@app.route("/leaderboard")
+@versioned(POT_MAKER_VERSION, key=_leaderboard_period_key)
+def leaderboard():
+    """Returns a page of pot makers ranked by one of their stats
+
+    Args:
+        - sort (string) - pots, weight, cups or largest, defaults to pots
+        - period (string) - all, week or month, defaults to all. week and
+        month rank by the pots made so far this week or month
+        - page (int) - Page to return, starting at 1
+        - perPage (int) - Pot makers per page, at most 100
+        - includeInactive (string) - true to rank inactive pot makers too
+    Returns
+        - {
+            leaderboard: [{
+                rank: int,
+                name: string,
+                numberOfPotsMade: int,
+                totalWeightMade: int,
+                largestSinglePot: int,
+                numberOfCupsMade: int,
+                inactive: bool
+            }],
+            total: int,
+            page: int,
+            perPage: int
+        }
+        - 400 {error: string} if an argument is invalid
+    """
+    sort = request.args.get('sort', 'pots')
+    period = request.args.get('period', 'all')
+    try:
+        if sort not in LEADERBOARD_SORTS:
+            raise ValueError("Invalid sort: %r" % sort)
+        if period not in LEADERBOARD_PERIODS:
+            raise ValueError("Invalid period: %r" % period)
+        page = _int_argument('page', 1, 1, sys.maxint)
+        per_page = _int_argument(
+            'perPage', 20, 1, LEADERBOARD_MAX_PER_PAGE)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    offset = (page - 1) * per_page
+    total, rows = PotMaker.get_leaderboard(
+        LEADERBOARD_SORTS[sort],
+        period=LEADERBOARD_PERIODS[period],
+        at=_get_current_time(),
+        include_inactive=request.args.get('includeInactive') == 'true',
+        offset=offset,
+        limit=per_page
+    )
+    results = []
+    for rank, (name, pots, weight, cups, largest, inactive) in enumerate(
+            rows, offset + 1):
+        results.append({
+            'rank': rank,
+            'name': name,
+            'numberOfPotsMade': pots,
+            'totalWeightMade': weight,
+            'largestSinglePot': largest,
+            'numberOfCupsMade': cups,
+            'inactive': inactive
+        })
+
+    return json_response({
+        'leaderboard': results,
+        'total': total,
+        'page': page,
+        'perPage': per_page
+    })
+
+
+# Buckets returned when no start time is given
+STATS_DEFAULT_BUCKETS = {
+    stats.DAY: 30,
+    stats.HOUR: 48
+}
+STATS_TIME_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", STATE_TIMESTAMP_FORMAT)
+
+
+def _datetime_argument(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    for time_format in STATS_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    raise ValueError("Invalid %s: %r" % (name, value))
+
+
+@app.route("/stats/<name>")
+def statsEndpoint(name):
+    """Returns a statistic over the teapot history, one or more rows per day
+    or hour
+
+    Args:
+        - name (string) - potsPerDay, potAge, cupsPerHour or temperature
+        - from (string) - Start of the range as 2017-12-20 or
+        2017-12-20T09:00:00, rounded down to the start of its day or hour.
+        Defaults to 30 days or 48 hours before to. Stats other than
+        potsPerDay start no earlier than the first day or hour whose
+        readings haven't been pruned.
+        - to (string) - End of the range, defaults to now
+        - interval (int) - temperature only, minutes per point on the curves
+        - teapot (string) - The teapot whose history to use
+    Returns
+        - {
+            stat: string,
+            bucket: 'day' or 'hour',
+            from: string,
+            to: string,
+            columns: [string],
+            rows: [[value]]
+        }
+        - 400 {error: string} if an argument is invalid
+        - 404 {error: string} if there is no such statistic or teapot
+    """
+    teapot = _teapot()
+    stat = stats.STATS.get(name)
+    if stat is None:
+        return json_response({'error': "Unknown statistic: %r" % name}, 404)
+
+    now = _get_current_time()
+    try:
+        end = _datetime_argument('to', now)
+        start = _datetime_argument(
+            'from', end - stat.bucket_size * STATS_DEFAULT_BUCKETS[
+                stat.bucket])
+        if start >= end:
+            raise ValueError("from must be before to")
+        if stat.raw:
+            # Older readings are being pruned, which would change the rows
+            retained = stats.first_whole_bucket(
+                stat, retention.raw_readings_cutoff(now))
+            if end <= retained:
+                raise ValueError(
+                    "Readings before %s are no longer kept" %
+                    retained.isoformat())
+            start = max(start, retained)
+        options = tuple(sorted(
+            (option, _int_argument(option, *limits))
+            for option, limits in stat.options.items()
+        ))
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    if end - stats.bucket_start(stat.bucket, start) > \
+            stat.bucket_size * STATS_MAX_BUCKETS:
+        return json_response({'error': "Range covers more than %s %ss" % (
+            STATS_MAX_BUCKETS, stat.bucket)}, 400)
+    starts = stats.bucket_range(stat, start, end)
+
+    rows = stats.stats_cache.get_rows(
+        name, stat, starts, now, options, teapot)
+    return _cache_control(json_response({
+        'stat': name,
+        'bucket': stat.bucket,
+        'from': starts[0].isoformat(),
+        'to': (starts[-1] + stat.bucket_size).isoformat(),
+        'columns': stat.columns,
+        'rows': rows
+    }))
 
 
 @app.route("/claimPot", methods=['POST'])
@@ -205,28 +818,27 @@ def claimPot():
     """Lets a user claim to have made a teapot
 
     Args:
-        - None
+        - teapot (string) - The teapot the pot was made in
     Returns:
         - {'submitMessage': 'Error / Success Message'}
+        - 400 {error: string} if the body isn't a JSON object with a string
+        potMaker
     """
-    latest_full_pot = State.get_latest_full_teapot()
-    if latest_full_pot.claimed_by:
-        return jsonify({'submitMessage': 'Pot has already been claimed'})
-    try:
-        maker = json.loads(request.data)['potMaker']
-    except KeyError:
-        return jsonify({'submitMessage': 'You need to select a pot maker'})
-
-    maker = PotMaker.get_single_pot_maker(maker)
-    maker.number_of_pots_made += 1
-    maker.total_weight_made += latest_full_pot.weight
-    maker.number_of_cups_made += latest_full_pot.num_of_cups
-    if maker.largest_single_pot < latest_full_pot.weight:
-        maker.largest_single_pot = latest_full_pot.weight
-    maker.save()
-    latest_full_pot.claimed_by = maker
-    latest_full_pot.save()
-    return jsonify({'submitMessage': 'Pot claimed, thanks, %s' % maker.name})
+    teapot = _teapot()
+    latest_full_pot = State.get_latest_full_teapot_record(teapot)
+    if latest_full_pot is None:
+        return json_response({'submitMessage': 'There is no pot to claim'})
+    if latest_full_pot.claimed_by_id:
+        return json_response({'submitMessage': 'Pot has already been claimed'})
+    name = codec.parse(request.data, CLAIM_POT_SCHEMA)['potMaker']
+    maker = PotMaker.get_record(name) if name is not None else None
+    if maker is None:
+        return json_response(
+            {'submitMessage': 'You need to select a pot maker'})
+    if not State.claim_latest_full_teapot(maker, teapot):
+        return json_response({'submitMessage': 'Pot has already been claimed'})
+    return json_response(
+        {'submitMessage': 'Pot claimed, thanks, %s' % maker.name})
 
 
 @app.route("/flipTeapotRequest", methods=['POST'])
@@ -234,17 +846,21 @@ def flipTeapotRequest():
     """Lets users reguster / deregister interest in a cup of tea via dash button
 
     Args:
-        None
+        teapot (string) - The teapot the button was pressed for
 
     Returns:
         {'requestedTeapot': teapot request status}
+        404 {error: string} if the dash button or teapot isn't known
     """
+    teapot = _teapot()
+    mac_address = codec.parse(
+        request.data, DASH_BUTTON_SCHEMA)['dash_mac_address']
+    maker = PotMaker.flip_requested_teapot(mac_address, teapot=teapot)
+    if maker is None:
+        raise codec.RequestError(
+            "Unknown dash button: %s" % mac_address, status=404)
 
-    data = json.loads(request.data)
-
-    maker = PotMaker.flip_requested_teapot(data['dash_mac_address'])
-
-    return jsonify({'requestedTeapot': maker.requested_teapot})
+    return json_response({'requestedTeapot': maker.requested_teapot})
 
 
 @app.route("/getNumberOfTeapotRequests", methods=['GET'])
@@ -252,17 +868,21 @@ def getNumberOfTeapotRequests():
     """Gets number of teapot requests
 
     Args:
-        None
+        teapot (string) - The teapot to count the requests for
 
     Returns:
         {'teaRequests': number of tea requests}
 
     """
-    tea_requests = PotMaker.get_number_of_teapot_requests() + \
-        slack_communicator_wrapper.get_message_reaction_count()
+    teapot = _teapot()
+    tea_requests = PotMaker.get_number_of_teapot_requests(teapot) + \
+        slack_communicator_wrapper.get_message_reaction_count(teapot)
 
-    return jsonify({'teaRequests': tea_requests})
+    return json_response({'teaRequests': tea_requests})
 
 
 if __name__ == "__main__":
+    create_app()
+    warm_up()
+    start_background_workers()
     app.run(host="127.0.0.1", debug=True, port=8000)
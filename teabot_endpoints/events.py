@@ -0,0 +1,166 @@
+from settings import STATE_STREAM_POLL_INTERVAL, STATE_STREAM_QUEUE_SIZE, \
+    DEFAULT_TEAPOT
+from models import DataVersion, State, STATE_VERSION, teapot_key
+import logging
+import Queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def state_event(state):
+    """Converts a State row into the event sent to stream clients
+
+    Args:
+        - state (State or StateRecord) - The newest state of the teapot
+    Returns:
+        - dict - The event
+    """
+    return {
+        'state': state.state,
+        'timestamp': state.timestamp.isoformat(),
+        'num_of_cups': state.num_of_cups,
+        'weight': state.weight,
+        'temperature': state.temperature
+    }
+
+
+class StateBroadcaster(object):
+    """Watches for teapot state changes and fans them out to every connected
+    stream client. Each worker process runs a single poller that checks the
+    State DataVersion stamps of the teapots clients are watching in one
+    query, so the database load doesn't grow with the number of clients or
+    teapots.
+    """
+
+    def __init__(self, poll_interval=STATE_STREAM_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        # The newest event and stamp seen for each teapot
+        self._current_events = {}
+        self._stamps = {}
+        # Sets of subscriber queues, keyed by the teapot they're watching
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, teapot=DEFAULT_TEAPOT):
+        """Registers a client, starting the poller if it isn't running
+
+        Args:
+            - teapot (String) - Name of the teapot to watch
+        Returns:
+            - Queue - Receives an event for every state change
+        """
+        events = Queue.Queue(STATE_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(teapot, set()).add(events)
+        self.start()
+        return events
+
+    def unsubscribe(self, events, teapot=DEFAULT_TEAPOT):
+        with self._lock:
+            subscribers = self._subscribers.get(teapot, set())
+            subscribers.discard(events)
+            if not subscribers:
+                self._subscribers.pop(teapot, None)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers)
+                       for subscribers in self._subscribers.values())
+
+    def current_event(self, teapot=DEFAULT_TEAPOT):
+        """Returns the newest event seen for the teapot, None if it hasn't
+        been polled yet
+        """
+        return self._current_events.get(teapot)
+
+    def notify(self):
+        """Wakes the poller, called after a write in this process so local
+        clients don't wait for the next poll
+        """
+        self._changed.set()
+
+    def poll(self):
+        """Checks the watched teapots for state changes and publishes them
+
+        Returns:
+            - dict - The events published, keyed by teapot
+        """
+        with self._lock:
+            teapots = list(self._subscribers)
+        if not teapots:
+            return {}
+        keys = dict((teapot_key(STATE_VERSION, teapot), teapot)
+                    for teapot in teapots)
+        published = {}
+        for key, stamp in DataVersion.get_stamps(list(keys)).items():
+            teapot = keys[key]
+            if stamp is None or stamp == self._stamps.get(teapot):
+                continue
+            self._stamps[teapot] = stamp
+            event = self._poll_teapot(teapot)
+            if event is not None:
+                published[teapot] = event
+        return published
+
+    def _poll_teapot(self, teapot):
+        state = State.get_newest_state_record(teapot)
+        if state is None:
+            return None
+        event = state_event(state)
+        previous = self._current_events.get(teapot)
+        self._current_events[teapot] = event
+        if previous is not None and \
+                (previous['state'], previous['num_of_cups']) == \
+                (event['state'], event['num_of_cups']):
+            return None
+        self.publish(event, teapot)
+        return event
+
+    def publish(self, event, teapot=DEFAULT_TEAPOT):
+        """Sends an event to every subscriber watching the teapot. A client
+        too slow to keep up loses its oldest event rather than holding up the
+        others.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(teapot, ()))
+        for events in subscribers:
+            while True:
+                try:
+                    events.put_nowait(event)
+                    break
+                except Queue.Full:
+                    try:
+                        events.get_nowait()
+                    except Queue.Empty:
+                        pass
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='state-broadcaster')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._changed.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Error polling for state changes")
+            self._changed.wait(self.poll_interval)
+            self._changed.clear()
@@ -0,0 +1,54 @@
+"""Gunicorn settings, used with gunicorn -c teabot_endpoints/gunicorn_config.py
+
+The worker class and concurrency come from the GUNICORN_* environment
+variables, see teabot_endpoints/settings.py.
+"""
+import imp
+import os
+
+# Lets the master process import the app's modules from its hooks
+pythonpath = '.'
+
+# The package isn't importable until gunicorn has read this file, and
+# settings.py only reads the environment, so it's loaded by path
+settings = imp.load_source('teabot_endpoints_settings', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'settings.py'))
+
+workers = settings.GUNICORN_WORKERS
+worker_class = settings.GUNICORN_WORKER_CLASS
+# Gunicorn swaps sync workers for gthread ones when threads is over 1
+threads = settings.GUNICORN_THREADS if worker_class == 'gthread' else 1
+worker_connections = settings.GUNICORN_WORKER_CONNECTIONS
+# settings.py closes /stateStream responses on sync workers before this runs
+# out
+timeout = settings.GUNICORN_TIMEOUT
+# The master imports the app once and each worker is forked with it already
+# loaded, so workers restarted by --max-requests start serving sooner
+preload_app = settings.GUNICORN_PRELOAD_APP
+
+# Cooperative workers only patch the standard library once they're
+# initialised, after the hooks below have imported the app. Patching here,
+# before anything else is imported, makes the app's locks, events,
+# thread locals and background threads cooperative too.
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif worker_class == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+
+def on_starting(server):
+    from teabot_endpoints.metrics import clear_snapshots
+    clear_snapshots()
+
+
+def post_worker_init(worker):
+    from teabot_endpoints.endpoints import warm_up, start_background_workers
+    warm_up()
+    start_background_workers()
+
+
+def worker_exit(server, worker):
+    from teabot_endpoints.endpoints import stop_background_workers
+    stop_background_workers()
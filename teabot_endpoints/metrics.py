@@ -0,0 +1,317 @@
+from settings import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'teabot_requests_total': (
+        'counter', 'Requests handled, by route, method and status', None),
+    'teabot_request_duration_seconds': (
+        'histogram', 'Time taken to handle a request', LATENCY_BUCKETS),
+    'teabot_request_db_queries': (
+        'histogram', 'Database queries issued per request',
+        QUERY_COUNT_BUCKETS),
+    'teabot_request_db_duration_seconds': (
+        'histogram', 'Time per request spent executing database queries',
+        LATENCY_BUCKETS),
+    'teabot_db_queries_total': (
+        'counter', 'Database queries issued by requests and background work',
+        None),
+    'teabot_db_query_duration_seconds_total': (
+        'counter', 'Time spent executing database queries', None),
+    'teabot_slack_call_duration_seconds': (
+        'histogram', 'Time taken by calls to the Slack API', LATENCY_BUCKETS),
+    'teabot_slack_call_errors_total': (
+        'counter', 'Calls to the Slack API that raised', None),
+    'teabot_state_readings_total': (
+        'counter', 'Readings sent to /storeState, by whether they were stored '
+        'or dropped as repeats', None),
+    'teabot_state_compression_ratio': (
+        'gauge', 'Readings received per reading stored by /storeState', None),
+}
+
+
+def _compression_ratio(counters):
+    stored = counters.get(
+        ('teabot_state_readings_total', (('outcome', 'stored'),)), 0)
+    dropped = counters.get(
+        ('teabot_state_readings_total', (('outcome', 'repeat'),)), 0)
+    if not stored:
+        return None
+    return float(stored + dropped) / stored
+
+# Gauges calculated from the combined counters of every worker
+DERIVED_GAUGES = {
+    'teabot_state_compression_ratio': _compression_ratio,
+}
+
+
+class MetricsRegistry(object):
+    """Counters and histograms for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels=(), amount=1):
+        """Adds amount to a counter
+
+        Args:
+            - name (String) - One of METRICS
+            - labels (tuple) - (label, value) pairs
+            - amount (number) - How much to add
+        """
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Records a value in a histogram
+
+        Args:
+            - name (String) - One of METRICS
+            - labels (tuple) - (label, value) pairs
+            - value (number) - The observation
+        """
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Bucket counts, then the +Inf bucket, sum and count
+                histogram = self._histograms[key] = [0] * (len(buckets) + 3)
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        """Returns the metrics as JSON serialisable lists"""
+        with self._lock:
+            return {
+                'counters': [
+                    [name, list(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [name, list(labels), list(values)]
+                    for (name, labels), values in self._histograms.items()
+                ]
+            }
+
+
+def merge(snapshots):
+    """Sums the snapshots of several processes
+
+    Args:
+        - snapshots (list) - Results of MetricsRegistry.snapshot
+    Returns:
+        - (dict, dict) - Counter values and histogram values keyed by
+        (name, labels)
+    """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key in histograms:
+                values = [a + b for a, b in zip(histograms[key], values)]
+            histograms[key] = values
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"')) for label, value in labels)
+
+
+def render(snapshots):
+    """Renders the combined snapshots in the Prometheus text format
+
+    Args:
+        - snapshots (list) - Results of MetricsRegistry.snapshot
+    Returns:
+        - String - The exposition
+    """
+    counters, histograms = merge(snapshots)
+    lines = []
+    for name in sorted(METRICS):
+        metric_type, help_text, buckets = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        if metric_type == 'gauge':
+            value = DERIVED_GAUGES[name](counters)
+            if value is not None:
+                lines.append('%s %r' % (name, value))
+            continue
+        if metric_type == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('%s%s %r' % (
+                        name, _format_labels(labels), value))
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _format_labels(labels, (('le', bound),)),
+                    cumulative))
+            lines.append('%s_sum%s %r' % (
+                name, _format_labels(labels), values[-2]))
+            lines.append('%s_count%s %d' % (
+                name, _format_labels(labels), values[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+# Each worker keeps its metrics in memory and regularly writes a snapshot of
+# them to the metrics directory, /metrics sums the snapshots of every worker
+# so a scrape sees the whole server whichever worker answers it
+registry = MetricsRegistry()
+_request = threading.local()
+_last_flush = [0]
+
+
+def _snapshot_directory():
+    return METRICS_DIR or os.path.join(
+        tempfile.gettempdir(), 'teabot_metrics')
+
+
+def _snapshot_path():
+    return os.path.join(_snapshot_directory(), '%s.json' % os.getpid())
+
+
+def flush():
+    """Writes this process's snapshot for the other workers to read"""
+    directory = _snapshot_directory()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = _snapshot_path()
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as snapshot_file:
+        json.dump(registry.snapshot(), snapshot_file)
+    os.rename(temporary, path)
+    _last_flush[0] = time.time()
+
+
+def maybe_flush():
+    """Flushes if the last flush was more than METRICS_FLUSH_INTERVAL ago"""
+    if time.time() - _last_flush[0] >= METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def clear_snapshots():
+    """Removes the snapshots left by a previous run, called once before the
+    workers start
+    """
+    directory = _snapshot_directory()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+
+
+def collect():
+    """Returns the metrics of every worker in the Prometheus text format,
+    this process's metrics are read live rather than from its snapshot
+    """
+    snapshots = [registry.snapshot()]
+    directory = _snapshot_directory()
+    own = os.path.basename(_snapshot_path())
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name == own or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (IOError, ValueError):
+                # The worker exited and the file was cleared, or the file
+                # is unreadable, either way there's nothing to add
+                continue
+    return render(snapshots)
+
+
+def start_request():
+    """Starts counting the database queries made by this thread's request"""
+    _request.queries = 0
+    _request.query_seconds = 0.0
+
+
+def finish_request(route, method, status, seconds):
+    """Records a finished request and the queries it made
+
+    Args:
+        - route (String) - The URL rule that handled the request
+        - method (String) - HTTP method
+        - status (int) - Response status code
+        - seconds (float) - Time taken to handle the request
+    """
+    labels = (('route', route), ('method', method))
+    registry.inc('teabot_requests_total', labels + (('status', status),))
+    registry.observe('teabot_request_duration_seconds', labels, seconds)
+    registry.observe('teabot_request_db_queries', labels,
+                     getattr(_request, 'queries', 0))
+    registry.observe('teabot_request_db_duration_seconds', labels,
+                     getattr(_request, 'query_seconds', 0.0))
+    _request.queries = None
+
+
+def record_query(seconds):
+    """Records one database query, counting it against the current request
+    if this thread is handling one
+    """
+    registry.inc('teabot_db_queries_total')
+    registry.inc('teabot_db_query_duration_seconds_total', amount=seconds)
+    if getattr(_request, 'queries', None) is not None:
+        _request.queries += 1
+        _request.query_seconds += seconds
+
+
+def record_state_reading(stored, count=1):
+    """Counts readings sent to /storeState
+
+    Args:
+        - stored (bool) - False if they were dropped as repeats
+        - count (int) - Number of readings
+    """
+    if count:
+        registry.inc('teabot_state_readings_total',
+                     (('outcome', 'stored' if stored else 'repeat'),), count)
+
+
+@contextmanager
+def slack_call(method):
+    """Times a call to the Slack API
+
+    Args:
+        - method (String) - The API method, e.g. chat.postMessage
+    """
+    labels = (('method', method),)
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        registry.inc('teabot_slack_call_errors_total', labels)
+        raise
+    finally:
+        registry.observe(
+            'teabot_slack_call_duration_seconds', labels,
+            time.time() - start)
@@ -0,0 +1,314 @@
+"""Predicts when the teapot will be empty and when its tea will have gone
+cold. Straight lines are fitted to the current pot's readings from the last
+PREDICTION_WINDOW seconds and followed to the empty weight and the cold
+temperature: one to the weight, and one to the log of how far the tea is
+above room temperature, which falls in a straight line as it cools.
+
+The fits are kept as running sums that readings are added to and expire
+from one at a time. Each worker catches up with the readings stored since it
+last looked when a prediction is asked for, so a prediction costs the same
+however long the history is, and every worker sees every reading whichever
+worker stored it.
+"""
+from settings import PREDICTION_WINDOW, PREDICTION_MIN_READINGS, \
+    PREDICTION_EMPTY_WEIGHT, PREDICTION_COLD_TEMPERATURE, \
+    PREDICTION_ROOM_TEMPERATURE, DEFAULT_TEAPOT
+from models import State, DataVersion, STATE_VERSION, teapot_key
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+import math
+import threading
+
+EPOCH = datetime(1970, 1, 1)
+
+Prediction = namedtuple('Prediction', [
+    'empty_at', 'cold_at', 'weight_per_minute', 'temperature_per_minute'
+])
+
+
+def _seconds(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+def _timestamp(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class RollingLinearFit(object):
+    """Least squares line through the points of the last window seconds.
+    Points are added and expired in O(1) by keeping running sums of x, y,
+    x * x, x * y and y * y, with x measured from an early point in the window
+    so the sums stay small enough to be accurate.
+
+    Args:
+        - window (float) - Seconds of points to fit
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.clear()
+
+    def clear(self):
+        self._points = deque()
+        self._origin = None
+        self._sum_x = self._sum_y = self._sum_xx = self._sum_xy = 0.0
+        self._sum_yy = 0.0
+
+    def __len__(self):
+        return len(self._points)
+
+    def _update_sums(self, x, y, sign):
+        self._sum_x += sign * x
+        self._sum_y += sign * y
+        self._sum_xx += sign * x * x
+        self._sum_xy += sign * x * y
+        self._sum_yy += sign * y * y
+
+    def add(self, x, y):
+        """Adds a point and drops the points now outside the window
+
+        Args:
+            - x (float) - Time of the point in seconds
+            - y (float) - Value at that time
+        Returns:
+            - bool - False if the point was ignored for being older than the
+            newest point
+        """
+        if self._points and x < self._origin + self._points[-1][0]:
+            return False
+        if not self._points:
+            self._origin = x
+        x -= self._origin
+        self._points.append((x, y))
+        self._update_sums(x, y, 1)
+        while self._points[0][0] < x - self.window:
+            self._update_sums(*self._points.popleft(), sign=-1)
+            if len(self._points) == 1:
+                # Start again from the one point left, dropping any rounding
+                # errors the sums have built up
+                self._origin += x
+                self._points[0] = (0.0, y)
+                self._sum_x = self._sum_xx = self._sum_xy = 0.0
+                self._sum_y = float(y)
+                self._sum_yy = float(y) * y
+        return True
+
+    def line(self):
+        """Returns the fitted line
+
+        Returns:
+            - (slope, intercept, slope_error) - y per second, y at time 0 and
+            the standard error of the slope, or None if there are too few
+            points, or they're all at the same time
+        """
+        count = len(self._points)
+        if count < 3:
+            return None
+        xx = self._sum_xx - self._sum_x * self._sum_x / count
+        if xx <= 0:
+            return None
+        xy = self._sum_xy - self._sum_x * self._sum_y / count
+        yy = self._sum_yy - self._sum_y * self._sum_y / count
+        slope = xy / xx
+        intercept = (self._sum_y - slope * self._sum_x) / count
+        residual = max(0.0, yy - slope * xy) / (count - 2)
+        return (slope, intercept - slope * self._origin,
+                math.sqrt(residual / xx))
+
+    def solve(self, y, confidence=2.0):
+        """Returns when the fitted line falls to y
+
+        Args:
+            - y (float) - Value to solve for
+            - confidence (float) - Standard errors the slope must be below
+            zero by, so noise on a level line isn't followed
+        Returns:
+            - float - The time in seconds, None if the line isn't falling
+        """
+        line = self.line()
+        if line is None:
+            return None
+        slope, intercept, slope_error = line
+        if slope + confidence * slope_error >= 0:
+            return None
+        return (y - intercept) / slope
+
+
+class TeapotForecast(object):
+    """Follows the readings of the current pot and predicts when it will be
+    empty and cold. The fits are started again for every new pot.
+
+    Args:
+        - window (float) - Seconds of readings to fit
+        - min_readings (int) - Fewest readings to predict from
+        - empty_weight (int) - Weight of an empty pot, until one is seen
+        - cold_temperature (int) - Temperature tea is cold at, until the
+        teapot reports it
+        - room_temperature (int) - Temperature tea cools towards
+    """
+
+    def __init__(self, window=PREDICTION_WINDOW,
+                 min_readings=PREDICTION_MIN_READINGS,
+                 empty_weight=PREDICTION_EMPTY_WEIGHT,
+                 cold_temperature=PREDICTION_COLD_TEMPERATURE,
+                 room_temperature=PREDICTION_ROOM_TEMPERATURE):
+        self.min_readings = min_readings
+        self.empty_weight = empty_weight
+        self.cold_temperature = cold_temperature
+        self.room_temperature = room_temperature
+        self.weight = RollingLinearFit(window)
+        # Fitted to the log of the degrees above room temperature
+        self.temperature = RollingLinearFit(window)
+        self.state = None
+        self.timestamp = None
+        self.latest_temperature = None
+        # When the pot was first seen empty or cold
+        self.empty_since = None
+        self.cold_since = None
+
+    def observe(self, timestamp, state, weight, temperature):
+        """Adds a reading, readings older than the newest are ignored
+
+        Args:
+            - timestamp (datetime) - When it was read
+            - state (String) - e.g. GOOD_TEAPOT
+            - weight (int) - Grams, None or negative if unknown
+            - temperature (int) - Degrees, None if unknown
+        """
+        if self.timestamp is not None and timestamp < self.timestamp:
+            return
+        if weight is not None and weight < 0:
+            weight = None
+
+        if state == 'FULL_TEAPOT':
+            self.weight.clear()
+            self.temperature.clear()
+            self.empty_since = self.cold_since = None
+        elif state == 'EMPTY_TEAPOT':
+            if self.empty_since is None:
+                self.empty_since = timestamp
+                if weight is not None:
+                    self.empty_weight = weight
+        elif state == 'COLD_TEAPOT' and self.cold_since is None:
+            self.cold_since = timestamp
+            # Trust the teapot's idea of cold over ours
+            if self.state not in (None, 'COLD_TEAPOT') and \
+                    temperature is not None:
+                self.cold_temperature = temperature
+
+        if state != 'EMPTY_TEAPOT':
+            x = _seconds(timestamp)
+            if weight is not None:
+                self.weight.add(x, weight)
+            if temperature is not None and \
+                    temperature > self.room_temperature:
+                self.temperature.add(
+                    x, math.log(temperature - self.room_temperature))
+                self.latest_temperature = temperature
+        self.state = state
+        self.timestamp = timestamp
+
+    def _line(self, fit):
+        return fit.line() if len(fit) >= self.min_readings else None
+
+    def _solve(self, fit, y):
+        if len(fit) < self.min_readings:
+            return None
+        seconds = fit.solve(y)
+        return _timestamp(seconds) if seconds is not None else None
+
+    def predict(self):
+        """Returns the prediction for the current pot
+
+        Returns:
+            - Prediction - Times are None if there aren't enough readings or
+            the trend never gets there, and in the past if it has already
+            got there
+        """
+        if self.state == 'EMPTY_TEAPOT':
+            return Prediction(self.empty_since, None, None, None)
+
+        cold_at = self.cold_since
+        if cold_at is None and self.cold_temperature > self.room_temperature:
+            cold_at = self._solve(self.temperature, math.log(
+                self.cold_temperature - self.room_temperature))
+
+        weight_line = self._line(self.weight)
+        temperature_line = self._line(self.temperature)
+        return Prediction(
+            self._solve(self.weight, self.empty_weight),
+            cold_at,
+            weight_line[0] * 60 if weight_line else None,
+            # How fast the newest temperature is falling
+            temperature_line[0] * 60 *
+            (self.latest_temperature - self.room_temperature)
+            if temperature_line else None
+        )
+
+
+class Forecaster(object):
+    """Keeps a worker's TeapotForecast of one teapot up to date with its
+    stored readings. Only the readings newer than the forecast's are read,
+    through the teapot's (teapot, timestamp) index, and the forecast only
+    starts again from the window's readings if it's fallen more than the
+    window behind.
+
+    Args:
+        - window (float) - Seconds of readings to fit
+        - teapot (String) - Name of the teapot
+    """
+
+    def __init__(self, window=PREDICTION_WINDOW, teapot=DEFAULT_TEAPOT):
+        self.window = window
+        self.teapot = teapot
+        self.forecast = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def predict(self):
+        """Returns the prediction for the current pot, see
+        TeapotForecast.predict
+        """
+        with self._lock:
+            self.catch_up()
+            if self.forecast is None:
+                return Prediction(None, None, None, None)
+            return self.forecast.predict()
+
+    def _select(self):
+        return State.select(
+            State.timestamp, State.state, State.weight, State.temperature
+        ).where(State.teapot == self.teapot)
+
+    def catch_up(self):
+        """Adds the readings stored since the last catch up
+
+        Returns:
+            - int - Number of readings read
+        """
+        stamp = DataVersion.get_stamp(teapot_key(STATE_VERSION, self.teapot))
+        if stamp is not None and stamp == self._stamp:
+            return 0
+        self._stamp = stamp
+
+        newest = State.get_newest_state_record(self.teapot)
+        if newest is None:
+            return 0
+        if self.forecast is None or self.forecast.timestamp is None or \
+                newest.timestamp - timedelta(seconds=self.window) > \
+                self.forecast.timestamp:
+            self.forecast = TeapotForecast(self.window)
+            rows = self._select().where(
+                State.timestamp >=
+                newest.timestamp - timedelta(seconds=self.window)
+            ).order_by(State.timestamp)
+        else:
+            rows = self._select().where(
+                State.timestamp > self.forecast.timestamp
+            ).order_by(State.timestamp)
+
+        count = 0
+        for timestamp, state, weight, temperature in rows.tuples():
+            self.forecast.observe(timestamp, state, weight, temperature)
+            count += 1
+        return count
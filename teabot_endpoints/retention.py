@@ -0,0 +1,315 @@
+from settings import RETENTION_RAW_DAYS, RETENTION_BATCH_SIZE, \
+    RETENTION_INTERVAL, TEAPOT_ROOMS
+from models import State, StateRollup, DataVersion, Counter, \
+    immediate_transaction, STATE_HISTORY_VERSION, \
+    ROLLED_UP_STATE_ID_COUNTER, STATE_INSERT_BATCH_SIZE
+from peewee import fn
+from datetime import datetime, timedelta
+from itertools import groupby
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pause between batches so requests get a turn at SQLite's write lock
+BATCH_PAUSE = 0.05
+
+retention_worker = None
+
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _minute(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def raw_readings_cutoff(now):
+    """Returns the time raw readings older than RETENTION_RAW_DAYS are pruned
+    up to. It moves on a whole hour at a time, so the stats caches that
+    pruning invalidates are only dropped once an hour.
+
+    Args:
+        - now (datetime) - The current time
+    Returns:
+        - datetime - Readings before this may have been pruned
+    """
+    return _hour(now - timedelta(days=RETENTION_RAW_DAYS))
+
+
+def _summarise(period, bucket, readings, previous_state):
+    """Builds a StateRollup row from the readings in one bucket
+
+    Args:
+        - period (String) - StateRollup.MINUTE or StateRollup.HOUR
+        - bucket (datetime) - Start of the bucket
+        - readings (list) - (timestamp, state, weight, temperature) tuples
+        ordered by timestamp
+        - previous_state (String) - State of the reading before the bucket,
+        None if there isn't one
+    Returns:
+        - dict - StateRollup field values
+    """
+    weights = [r[2] for r in readings if r[2] is not None]
+    temperatures = [r[3] for r in readings if r[3] is not None]
+    transitions = 0
+    for _, state, _, _ in readings:
+        if previous_state is not None and state != previous_state:
+            transitions += 1
+        previous_state = state
+
+    return {
+        'period': period,
+        'bucket': bucket,
+        'readings': len(readings),
+        'min_weight': min(weights) if weights else None,
+        'max_weight': max(weights) if weights else None,
+        'avg_weight': float(sum(weights)) / len(weights) if weights else None,
+        'min_temperature': min(temperatures) if temperatures else None,
+        'max_temperature': max(temperatures) if temperatures else None,
+        'avg_temperature':
+            float(sum(temperatures)) / len(temperatures)
+            if temperatures else None,
+        'first_state': readings[0][1],
+        'last_state': readings[-1][1],
+        'transitions': transitions
+    }
+
+
+def _previous_state(teapot, before):
+    """Returns the state the teapot was last in before an hour, from its
+    newest hourly summary
+
+    Args:
+        - teapot (String) - Name of the teapot
+        - before (datetime) - Start of the hour
+    Returns:
+        - String - The state or None if the teapot has no earlier summary
+    """
+    for last_state, in StateRollup.select(StateRollup.last_state).where(
+        StateRollup.teapot == teapot,
+        StateRollup.period == StateRollup.HOUR,
+        StateRollup.bucket < before
+    ).order_by(-StateRollup.bucket).limit(1).tuples():
+        return last_state
+    return None
+
+
+def _roll_up_hour(start):
+    """Writes the hourly and per minute summaries of every teapot with
+    readings in an hour
+
+    Args:
+        - start (datetime) - Start of the hour
+    Returns:
+        - None
+    """
+    end = start + timedelta(hours=1)
+    hour = sorted(State.select(
+        State.teapot, State.timestamp, State.state, State.weight,
+        State.temperature
+    ).where(
+        State.timestamp >= start,
+        State.timestamp < end
+    ).tuples())
+
+    rows = []
+    for teapot, readings in groupby(hour, lambda r: r[0]):
+        readings = [reading[1:] for reading in readings]
+        previous_state = hour_previous_state = _previous_state(teapot, start)
+        for minute, minute_readings in groupby(
+                readings, lambda r: _minute(r[0])):
+            minute_readings = list(minute_readings)
+            rows.append(dict(_summarise(
+                StateRollup.MINUTE, minute, minute_readings,
+                previous_state), teapot=teapot))
+            previous_state = minute_readings[-1][1]
+        rows.append(dict(_summarise(
+            StateRollup.HOUR, start, readings, hour_previous_state),
+            teapot=teapot))
+    for batch in range(0, len(rows), STATE_INSERT_BATCH_SIZE):
+        StateRollup.insert_many(
+            rows[batch:batch + STATE_INSERT_BATCH_SIZE]).execute()
+
+
+def _late_hours(latest, rolled_up_id):
+    """Returns the hours already rolled up that readings have since been
+    stored for, such as by a write-behind replay
+
+    Args:
+        - latest (datetime) - Start of the newest hour rolled up
+        - rolled_up_id (int) - Highest State id when it was rolled up
+    Returns:
+        - list of the start of each hour, oldest first
+    """
+    end = latest + timedelta(hours=1)
+    # Only the readings stored since are read, through the primary key. Given
+    # the timestamp too, SQLite would search the timestamp index instead,
+    # through every older reading.
+    return sorted(set(
+        _hour(timestamp) for timestamp, in State.select(
+            State.timestamp
+        ).where(
+            State.id > rolled_up_id
+        ).tuples() if timestamp < end
+    ))
+
+
+def roll_up_next_hour(now=None):
+    """Rolls up the oldest complete hour of readings that hasn't been rolled
+    up yet into one hourly and up to sixty per minute summaries for each
+    teapot with readings in the hour. Hours already rolled up that readings
+    have been stored for since are rolled up again first, unless their
+    readings have started being pruned.
+
+    Args:
+        - now (datetime) - The current time, hours that haven't finished yet
+        are left alone
+    Returns:
+        - datetime - Start of the first hour rolled up or None if there was
+        nothing left to roll up
+    """
+    now = now or datetime.now()
+    rolled_up = []
+    with immediate_transaction(State._meta.database):
+        latest = StateRollup.get_latest_bucket(StateRollup.HOUR)
+        newest_id = State.select(fn.MAX(State.id)).scalar() or 0
+        rolled_up_id = Counter.get_value(ROLLED_UP_STATE_ID_COUNTER)
+        if latest is not None and not rolled_up_id:
+            # Rolled up before late readings were looked for
+            rolled_up_id = newest_id
+
+        for start in _late_hours(latest, rolled_up_id) if latest else []:
+            hour_rollups = StateRollup.select().where(
+                StateRollup.period << [StateRollup.MINUTE, StateRollup.HOUR],
+                StateRollup.bucket >= start,
+                StateRollup.bucket < start + timedelta(hours=1)
+            )
+            if start < raw_readings_cutoff(now) and hour_rollups.exists():
+                logger.warning(
+                    "Readings for %s arrived after it was pruned, they "
+                    "aren't in its summaries", start)
+                continue
+            StateRollup.delete().where(
+                StateRollup.id << hour_rollups.select(StateRollup.id)
+            ).execute()
+            _roll_up_hour(start)
+            rolled_up.append(start)
+
+        query = State.select(State.timestamp)
+        if latest is not None:
+            query = query.where(State.timestamp >= latest + timedelta(hours=1))
+        first = [t for t, in query.order_by(State.timestamp).limit(1).tuples()]
+        if first and _hour(first[0]) + timedelta(hours=1) <= _hour(now):
+            _roll_up_hour(_hour(first[0]))
+            rolled_up.append(_hour(first[0]))
+
+        if newest_id != rolled_up_id:
+            Counter.set_value(ROLLED_UP_STATE_ID_COUNTER, newest_id)
+    return rolled_up[0] if rolled_up else None
+
+
+def prune_raw_readings(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    """Deletes one batch of raw readings older than the cutoff that have
+    already been rolled up. FULL_TEAPOT readings and the newest reading of
+    each teapot in TEAPOT_ROOMS are always kept, so the State model queries
+    keep returning the same answers. Deleting readings bumps the state
+    history version, so no worker keeps serving stats from before.
+
+    Args:
+        - cutoff (datetime) - Readings older than this may be deleted
+        - batch_size (int) - Most readings to delete
+    Returns:
+        - int - number of readings deleted
+    """
+    with immediate_transaction(State._meta.database):
+        latest = StateRollup.get_latest_bucket(StateRollup.HOUR)
+        if latest is None:
+            return 0
+        cutoff = min(cutoff, latest + timedelta(hours=1))
+        # Readings that arrived late haven't been rolled up yet
+        rolled_up_id = Counter.get_value(ROLLED_UP_STATE_ID_COUNTER)
+        newest = [State._query_newest_state_record(teapot)
+                  for teapot in TEAPOT_ROOMS]
+        query = State.select(State.id).where(
+            State.timestamp < cutoff,
+            State.state != 'FULL_TEAPOT',
+            # + 0 keeps SQLite on the timestamp index, the primary key would
+            # lead it through every reading up to rolled_up_id
+            State.id + 0 <= rolled_up_id
+        )
+        newest_ids = [record.id for record in newest if record is not None]
+        if newest_ids:
+            query = query.where(~(State.id << newest_ids))
+        ids = [
+            state_id for state_id, in query.limit(batch_size).tuples()
+        ]
+        if ids:
+            State.delete().where(State.id << ids).execute()
+            # Buckets of stats that were closed may have lost readings
+            DataVersion.bump(STATE_HISTORY_VERSION)
+    return len(ids)
+
+
+def run_retention(now=None):
+    """Rolls up every complete hour and prunes expired raw readings, one
+    short transaction at a time
+
+    Args:
+        - now (datetime) - The current time
+    Returns:
+        - (int, int) - Hours rolled up and readings pruned
+    """
+    now = now or datetime.now()
+    hours = 0
+    while roll_up_next_hour(now) is not None:
+        hours += 1
+        time.sleep(BATCH_PAUSE)
+
+    pruned = 0
+    cutoff = raw_readings_cutoff(now)
+    while True:
+        deleted = prune_raw_readings(cutoff, RETENTION_BATCH_SIZE)
+        pruned += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(BATCH_PAUSE)
+    return hours, pruned
+
+
+class RetentionWorker(threading.Thread):
+    """Background thread that periodically runs run_retention"""
+
+    def __init__(self, interval=RETENTION_INTERVAL):
+        super(RetentionWorker, self).__init__(name='retention')
+        self.daemon = True
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                hours, pruned = run_retention()
+                if hours or pruned:
+                    logger.info(
+                        "Rolled up %s hours and pruned %s readings",
+                        hours, pruned)
+            except Exception:
+                logger.exception("Error running State retention")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_retention_worker():
+    """Starts the retention thread if one isn't already running in this
+    process
+    """
+    global retention_worker
+    if retention_worker is None or not retention_worker.is_alive():
+        retention_worker = RetentionWorker()
+        retention_worker.start()
+    return retention_worker
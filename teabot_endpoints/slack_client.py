@@ -0,0 +1,236 @@
+"""Client for the Slack Web API. Calls share a pool of keep-alive
+connections, each API method is rate limited with a token bucket that also
+waits out Slack's Retry-After when it answers 429, and identical
+reactions.get calls made at the same time only reach Slack once.
+"""
+from settings import SLACK_API_URL, SLACK_CONNECT_TIMEOUT, \
+    SLACK_READ_TIMEOUT, SLACK_POOL_SIZE, SLACK_RATE_LIMIT, SLACK_RATE_BURST, \
+    SLACK_MAX_RETRY_WAIT, SLACK_RATE_LIMIT_RETRIES
+from requests.adapters import HTTPAdapter
+import requests
+import sys
+import threading
+import time
+
+
+class SlackError(Exception):
+    """Slack answered a call with an error"""
+
+
+class SlackRateLimited(SlackError):
+    """Slack is rate limiting an API method for longer than we'll wait
+
+    Args:
+        - method (String) - The API method, e.g. chat.postMessage
+        - retry_after (float) - Seconds until it can be called again
+    """
+
+    def __init__(self, method, retry_after):
+        super(SlackRateLimited, self).__init__(
+            "%s is rate limited for %.1fs" % (method, retry_after))
+        self.method = method
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """Lets calls through at rate a second on average, in bursts of up to
+    capacity calls, and not at all while paused
+
+    Args:
+        - rate (float) - Calls allowed per second
+        - capacity (int) - Most calls allowed in a burst
+        - clock (callable) - Returns the current time in seconds
+        - sleep (callable) - Waits for a number of seconds
+    """
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - start) * self.rate)
+            self._updated = now
+
+    def acquire(self, max_wait=None):
+        """Takes a token, sleeping until it's due
+
+        Args:
+            - max_wait (float) - Longest to wait, None waits for as long as
+            it takes
+        Returns:
+            - bool - False without taking a token if it isn't due within
+            max_wait
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            wait = max(self._paused_until - now, 0)
+            if self._tokens < 1:
+                wait += (1 - self._tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return False
+            self._tokens -= 1
+        if wait > 0:
+            self.sleep(wait)
+        return True
+
+    def pause(self, seconds):
+        """Lets no calls through for the next seconds, then a single call
+        before the rate applies again
+        """
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, self.clock() + seconds)
+            self._tokens = min(self._tokens, 1.0)
+
+    def paused_for(self):
+        """Returns the seconds left in the current pause"""
+        return max(self._paused_until - self.clock(), 0)
+
+
+class _Call(object):
+    """The result of a call that other callers are waiting on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+class SlackClient(object):
+    """Calls the Slack Web API
+
+    Args:
+        - token (String) - Slack API token
+        - base_url (String) - URL the API method names are appended to
+        - timeout (tuple) - Connect and read timeouts in seconds
+        - pool_size (int) - Most connections kept open to Slack
+        - rate (float) - Calls a second allowed for each API method
+        - burst (int) - Calls allowed in a burst for each API method
+        - max_wait (float) - Longest a call waits on a rate limit
+        - retries (int) - Times a call answered 429 is retried
+    """
+
+    def __init__(self, token, base_url=SLACK_API_URL,
+                 timeout=(SLACK_CONNECT_TIMEOUT, SLACK_READ_TIMEOUT),
+                 pool_size=SLACK_POOL_SIZE, rate=SLACK_RATE_LIMIT,
+                 burst=SLACK_RATE_BURST, max_wait=SLACK_MAX_RETRY_WAIT,
+                 retries=SLACK_RATE_LIMIT_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if token:
+            self.session.headers['Authorization'] = 'Bearer %s' % token
+        self._buckets = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, method):
+        """Returns the rate limit of an API method"""
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                bucket = self._buckets[method] = TokenBucket(
+                    self.rate, self.burst)
+            return bucket
+
+    def call(self, method, params=None, data=None):
+        """Calls an API method, GETting it unless there's data to POST
+
+        Args:
+            - method (String) - The API method, e.g. chat.postMessage
+            - params (dict) - Query string arguments
+            - data (dict) - Form arguments
+        Returns:
+            - dict - The decoded response
+        Raises:
+            - SlackRateLimited if Slack's rate limit outlasts max_wait or the
+            retries
+            - SlackError if Slack answers with an error
+            - requests.RequestException if Slack can't be reached
+        """
+        bucket = self.bucket(method)
+        for _ in range(self.retries + 1):
+            if not bucket.acquire(self.max_wait):
+                raise SlackRateLimited(method, bucket.paused_for())
+            response = self.session.request(
+                'GET' if data is None else 'POST',
+                '%s/%s' % (self.base_url, method),
+                params=params,
+                data=data,
+                timeout=self.timeout
+            )
+            if response.status_code == 429:
+                bucket.pause(float(response.headers.get('Retry-After', 1)))
+                continue
+            response.raise_for_status()
+            body = response.json()
+            if not body.get('ok'):
+                raise SlackError(body.get('error'))
+            return body
+        raise SlackRateLimited(method, bucket.paused_for())
+
+    def coalesced(self, key, func, *args, **kwargs):
+        """Calls func unless a call with the same key is already running, in
+        which case it waits for that call and shares its result or error
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result
+
+    def post_message(self, channel, text, **options):
+        """Posts a message, see chat.postMessage for the options
+
+        Returns:
+            - dict - The response, with the message's channel and ts
+        """
+        return self.call(
+            'chat.postMessage', data=dict(options, channel=channel, text=text))
+
+    def get_reactions(self, channel, timestamp):
+        """Fetches a message and its reactions
+
+        Returns:
+            - dict - The response, with the reactions in message
+        """
+        params = {'channel': channel, 'timestamp': timestamp}
+        return self.coalesced(
+            ('reactions.get', channel, timestamp),
+            self.call, 'reactions.get', params=params)
@@ -1,44 +1,197 @@
-from slacker import Slacker
-from settings import SLACK_API_TOKEN, TEABOT_ROOM
-from models import SlackMessages
+from slack_client import SlackClient, SlackRateLimited
+from settings import SLACK_API_TOKEN, TEABOT_ROOM, \
+    SLACK_OUTBOX_POLL_INTERVAL, SLACK_OUTBOX_LEASE, SLACK_OUTBOX_RETRY_DELAY, \
+    SLACK_OUTBOX_MAX_RETRY_DELAY, SLACK_OUTBOX_MAX_ATTEMPTS, \
+    REACTION_COUNT_TTL, REACTION_COUNT_REFRESH_LEASE, TEAPOT_ROOMS, \
+    DEFAULT_TEAPOT
+from models import SlackMessages, SlackOutbox, ReactionCount
+from datetime import datetime, timedelta
+import logging
+import math
+import metrics
+import threading
+
+logger = logging.getLogger(__name__)
 
 
 class SlackCommunicator(object):
     """Handles communicating with Slack"""
 
     def __init__(self):
-        self.slack = Slacker(SLACK_API_TOKEN)
+        self._slack = None
+        self._slack_lock = threading.Lock()
+        self.outbox_worker = None
+        self._message_queued = threading.Event()
+
+    @property
+    def slack(self):
+        """The Slack API client, built on first use rather than when the app
+        is imported
+        """
+        if self._slack is None:
+            with self._slack_lock:
+                if self._slack is None:
+                    self._slack = SlackClient(SLACK_API_TOKEN)
+        return self._slack
 
-    def post_message_to_room(self, message, reaction_message=False):
-        """Posts a message to the Slack room specified in the settings.
+    def post_message_to_room(self, message, reaction_message=False,
+                             teapot=DEFAULT_TEAPOT):
+        """Queues a message to be posted to the teapot's Slack room, from
+        TEAPOT_ROOMS in the settings. The message is delivered by
+        deliver_next_message.
 
         Args:
             - Message (string) - Message to post to the slack room
+            - reaction_message (bool) - Whether to track reactions to the
+            message once it has been posted
+            - teapot (String) - The teapot the message is about
         """
-        response = self.slack.chat.post_message(
-            TEABOT_ROOM, message, icon_emoji=":teapot:"
-        )
+        SlackOutbox.enqueue(message, reaction_message, teapot)
+        self.notify_message_queued()
+
+    def deliver_next_message(self):
+        """Posts the next queued message to Slack.
+
+        Returns:
+            - bool - True if a message was posted, False if there was nothing
+            due or the post failed
+        """
+        message = SlackOutbox.claim_next_message(SLACK_OUTBOX_LEASE)
+        if message is None:
+            return False
 
-        if reaction_message:
-            message_ts = response.body['ts']
-            message_channel = response.body['channel']
-            SlackMessages.store_message_details(message_ts, message_channel)
+        try:
+            with metrics.slack_call('chat.postMessage'):
+                response = self.slack.post_message(
+                    TEAPOT_ROOMS.get(message.teapot, TEABOT_ROOM),
+                    message.message, icon_emoji=":teapot:"
+                )
+        except Exception as e:
+            logger.exception("Failed to post message %s to Slack", message.id)
+            retry_delay = SLACK_OUTBOX_RETRY_DELAY
+            if isinstance(e, SlackRateLimited):
+                retry_delay = max(retry_delay, int(math.ceil(e.retry_after)))
+            message.mark_failed(
+                str(e),
+                retry_delay,
+                SLACK_OUTBOX_MAX_RETRY_DELAY,
+                SLACK_OUTBOX_MAX_ATTEMPTS
+            )
+            return False
+
+        if message.reaction_message:
+            message_ts = response['ts']
+            message_channel = response['channel']
+            SlackMessages.store_message_details(
+                message_ts, message_channel, message.teapot)
+        message.mark_delivered()
+        return True
+
+    def start_outbox_worker(self):
+        """Starts a background thread that delivers queued messages, if one
+        isn't already running in this process.
+        """
+        if self.outbox_worker is None or not self.outbox_worker.is_alive():
+            self.outbox_worker = SlackOutboxWorker(self)
+            self.outbox_worker.start()
+        return self.outbox_worker
+
+    def notify_message_queued(self):
+        """Wakes the outbox worker"""
+        self._message_queued.set()
+
+    def wait_for_message(self, timeout):
+        """Blocks until a message is queued in this process or the timeout
+        expires.
+        """
+        self._message_queued.wait(timeout)
+        self._message_queued.clear()
 
-    def get_message_reaction_count(self):
-        """Get the counts of reactions on a slack message.
+    def get_message_reaction_count(self, teapot=DEFAULT_TEAPOT):
+        """Get the counts of reactions on the teapot's slack message. Counts
+        are served from the shared ReactionCount cache, a stale count triggers
+        one background refresh and is served until the refresh completes. A
+        message's first count is fetched in the background too, 0 is served
+        until it's stored, so requests never wait on Slack.
 
         Args:
+            - teapot (String) - Name of the teapot
+        Returns:
             - count (int) - Total reaction count.
         """
-        message = SlackMessages.get_reaction_message_details()
-        if message:
-            response = self.slack.reactions.get(
-                channel=message.channel, timestamp=message.timestamp)
+        message = SlackMessages.get_reaction_message_details(teapot)
+        if not message:
+            return 0
 
-        count = 0
-        if response:
-            if 'reactions' in response.body['message'].keys():
-                for reaction in response.body['message']['reactions']:
-                    count += reaction['count']
+        cached = ReactionCount.get_cached(message.channel, message.timestamp)
+        stale = cached is None or cached.fetched is None or \
+            datetime.now() - cached.fetched > \
+            timedelta(seconds=REACTION_COUNT_TTL)
+        if stale and ReactionCount.claim_refresh(
+                message.channel, message.timestamp,
+                REACTION_COUNT_REFRESH_LEASE):
+            self._refresh_in_background(message.channel, message.timestamp)
+        return cached.count if cached is not None else 0
 
+    def _refresh_in_background(self, channel, timestamp):
+        thread = threading.Thread(
+            target=self._try_refresh_reaction_count,
+            args=(channel, timestamp),
+            name='reaction-count-refresh'
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _try_refresh_reaction_count(self, channel, timestamp):
+        try:
+            self._refresh_reaction_count(channel, timestamp)
+        except Exception:
+            logger.exception(
+                "Failed to refresh the reaction count of message %s",
+                timestamp)
+
+    def _refresh_reaction_count(self, channel, timestamp):
+        """Fetches the reaction count of a message from Slack and caches it
+
+        Returns:
+            - int - The reaction count
+        """
+        try:
+            count = self._fetch_reaction_count(channel, timestamp)
+        except Exception:
+            ReactionCount.store_count(channel, timestamp, None)
+            raise
+        ReactionCount.store_count(channel, timestamp, count)
         return count
+
+    def _fetch_reaction_count(self, channel, timestamp):
+        with metrics.slack_call('reactions.get'):
+            response = self.slack.get_reactions(channel, timestamp)
+
+        return sum(reaction['count']
+                   for reaction in response['message'].get('reactions', []))
+
+
+class SlackOutboxWorker(threading.Thread):
+    """Background thread that drains the Slack outbox"""
+
+    def __init__(self, communicator, poll_interval=SLACK_OUTBOX_POLL_INTERVAL):
+        super(SlackOutboxWorker, self).__init__(name='slack-outbox')
+        self.daemon = True
+        self.communicator = communicator
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                delivered = self.communicator.deliver_next_message()
+            except Exception:
+                logger.exception("Error draining the Slack outbox")
+                delivered = False
+            if not delivered:
+                self.communicator.wait_for_message(self.poll_interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.communicator.notify_message_queued()
@@ -0,0 +1,398 @@
+"""Statistics over the teapot history for charts. Counts per bucket are done
+by SQLite. Stats that relate each reading to the one before it or to the pot
+it belongs to read the range's readings in order, in one pass over the
+timestamp index, and relate them in Python. Window functions would do it in
+SQL but need SQLite 3.25, newer than the Docker image's. Rows are plain
+tuples. The queries use SQLite's date functions, so they need a SQLite
+database.
+
+Every query is of one teapot's readings, so it's served by the indexes that
+lead with the teapot and costs the same however many teapots there are.
+
+Buckets that have finished only change when old readings are uploaded or
+pruned, both of which bump the state history version, so their rows are
+cached and only the buckets still open are queried again. Stats of pruned
+readings are only served for the buckets wholly after the pruning cutoff.
+"""
+from settings import STATS_BUCKET_GRACE, STATS_CACHE_MAX_BUCKETS, \
+    DEFAULT_TEAPOT
+from models import State, DataVersion, STATE_HISTORY_VERSION
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from itertools import groupby
+import threading
+
+DAY = 'day'
+HOUR = 'hour'
+BUCKET_SIZES = {
+    DAY: timedelta(days=1),
+    HOUR: timedelta(hours=1)
+}
+# Pots still not empty this long after being made were forgotten about
+MAX_POT_AGE = timedelta(days=1)
+# How long after a pot is made its temperature curve is followed for
+TEMPERATURE_CURVE_LENGTH = timedelta(hours=4)
+
+POTS_PER_DAY_SQL = """
+SELECT date(timestamp) AS day, COUNT(*), SUM(num_of_cups)
+FROM state
+WHERE teapot = ? AND state = 'FULL_TEAPOT' AND timestamp >= ?
+    AND timestamp < ?
+GROUP BY day
+ORDER BY day
+"""
+
+# The readings that start and end pots, oldest first. Each one is labelled
+# with the newest FULL_TEAPOT at or before it in Python, the pot's age is the
+# time until the first EMPTY_TEAPOT that follows.
+POT_READINGS_SQL = """
+SELECT timestamp, state
+FROM state
+WHERE teapot = ? AND state IN ('FULL_TEAPOT', 'EMPTY_TEAPOT')
+    AND timestamp >= ? AND timestamp < ?
+ORDER BY timestamp
+"""
+
+# Every drop in the number of cups between one reading and the next is a pour,
+# except when a new pot replaces the old one. The reading before the range is
+# included so a pour at the start of the range is counted.
+CUPS_READINGS_SQL = """
+SELECT timestamp, state, num_of_cups
+FROM state
+WHERE teapot = ? AND timestamp >= COALESCE(
+    (SELECT MAX(timestamp) FROM state
+     WHERE teapot = ? AND timestamp < ?), ?)
+    AND timestamp < ?
+ORDER BY timestamp
+"""
+
+TEMPERATURE_READINGS_SQL = """
+SELECT timestamp, state, temperature
+FROM state
+WHERE teapot = ? AND timestamp >= ? AND timestamp < ?
+ORDER BY timestamp
+"""
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Seconds since the epoch at the start of each day a timestamp was read from
+DAY_SECONDS = {}
+
+
+def _minutes(delta):
+    return delta.total_seconds() / 60
+
+
+def _execute(sql, params):
+    return State._meta.database.execute_sql(
+        sql, [str(p) if isinstance(p, datetime) else p for p in params],
+        require_commit=False)
+
+
+def pots_per_day(start, end, teapot=DEFAULT_TEAPOT):
+    """Rows of (day, pots made, cups made)"""
+    return _execute(POTS_PER_DAY_SQL, (teapot, start, end))
+
+
+def _seconds(timestamp):
+    """Whole seconds since the epoch of a stored timestamp, as SQLite's
+    strftime('%s') gives them
+    """
+    day = timestamp[:10]
+    seconds = DAY_SECONDS.get(day)
+    if seconds is None:
+        seconds = DAY_SECONDS[day] = (date(
+            int(day[:4]), int(day[5:7]), int(day[8:10])
+        ).toordinal() - EPOCH_ORDINAL) * 86400
+    return (seconds + int(timestamp[11:13]) * 3600 +
+            int(timestamp[14:16]) * 60 + int(timestamp[17:19]))
+
+
+def _hour(timestamp):
+    """The stored timestamp's hour, as strftime('%Y-%m-%d %H:00') gives it"""
+    return '%s %s:00' % (timestamp[:10], timestamp[11:13])
+
+
+def _by_pot(rows):
+    """Labels ordered readings with the newest FULL_TEAPOT at or before each
+    one, including any taken at the same time
+
+    Args:
+        - rows (iterable) - Rows whose first two columns are the timestamp
+        and the state, oldest first
+    Returns:
+        - generator of (pot, row), pot is None before the first FULL_TEAPOT
+    """
+    pot = None
+    # Readings taken at the same time as the last one, held back until it's
+    # known whether one of them is a FULL_TEAPOT
+    same_time = []
+    for row in rows:
+        if same_time and row[0] != same_time[0][0]:
+            for held in same_time:
+                yield pot, held
+            same_time = []
+        if row[1] == 'FULL_TEAPOT':
+            pot = row[0]
+        same_time.append(row)
+    for held in same_time:
+        yield pot, held
+
+
+def pot_age(start, end, teapot=DEFAULT_TEAPOT):
+    """Rows of (day, pots made, pots emptied, average and longest minutes
+    from full to empty). Pots replaced or forgotten before they were empty
+    aren't included in the times.
+    """
+    end_key = str(end)
+    max_age = _minutes(MAX_POT_AGE)
+    emptied = OrderedDict()
+    for pot, (timestamp, state) in _by_pot(_execute(
+            POT_READINGS_SQL, (teapot, start, end + MAX_POT_AGE))):
+        if pot is None or pot >= end_key:
+            continue
+        emptied.setdefault(pot, None)
+        if state == 'EMPTY_TEAPOT' and emptied[pot] is None:
+            emptied[pot] = timestamp
+    ages = OrderedDict()
+    for pot, timestamp in emptied.items():
+        age = None
+        if timestamp is not None:
+            age = (_seconds(timestamp) - _seconds(pot)) / 60.0
+        ages.setdefault(pot[:10], []).append(
+            age if age is not None and age <= max_age else None)
+    rows = []
+    for day, pot_ages in ages.items():
+        known = [minutes for minutes in pot_ages if minutes is not None]
+        rows.append((
+            day, len(pot_ages), len(known),
+            sum(known) / len(known) if known else None,
+            max(known) if known else None
+        ))
+    return rows
+
+
+def cups_per_hour(start, end, teapot=DEFAULT_TEAPOT):
+    """Rows of (hour, cups poured)"""
+    start_key = str(start)
+    hours = OrderedDict()
+    previous = None
+    for timestamp, state, cups in _execute(
+            CUPS_READINGS_SQL, (teapot, teapot, start, start, end)):
+        if timestamp >= start_key:
+            hour = _hour(timestamp)
+            poured = hours.get(hour, 0)
+            if state not in (None, 'FULL_TEAPOT') and \
+                    previous is not None and cups is not None:
+                poured += max(previous - cups, 0)
+            hours[hour] = poured
+        previous = cups
+    return hours.items()
+
+
+def temperature_curve(start, end, interval=10, teapot=DEFAULT_TEAPOT):
+    """Rows of (day, minutes since the pot was made, average temperature,
+    readings) for the pots made each day, the minutes rounded down to a
+    multiple of interval
+    """
+    end_key = str(end)
+    length = TEMPERATURE_CURVE_LENGTH.total_seconds()
+    curves = {}
+    pot = None
+    for reading_pot, (timestamp, _, temperature) in _by_pot(_execute(
+            TEMPERATURE_READINGS_SQL,
+            (teapot, start, end + TEMPERATURE_CURVE_LENGTH))):
+        if reading_pot != pot:
+            pot = reading_pot
+            if pot is not None:
+                made = _seconds(pot)
+                # Readings from then on are too late for the pot's curve,
+                # found without working out their age
+                curve_end = str(datetime.utcfromtimestamp(made + length))
+        if pot is None or pot >= end_key or temperature is None or \
+                timestamp >= curve_end:
+            continue
+        # Ages are whole seconds so readings on an interval boundary aren't
+        # rounded into the interval before
+        age = _seconds(timestamp) - made
+        total = curves.setdefault(
+            (pot[:10], age // (interval * 60) * interval), [0, 0])
+        total[0] += temperature
+        total[1] += 1
+    return [
+        (day, minute, float(temperatures) / readings, readings)
+        for (day, minute), (temperatures, readings) in sorted(curves.items())
+    ]
+
+
+class Stat(object):
+    """A statistic reported per bucket of time
+
+    Args:
+        - query (callable) - Takes the start and end of a range of buckets,
+        any options and the teapot, returns rows whose first column is the
+        bucket's key
+        - bucket (String) - DAY or HOUR
+        - columns (list) - Names of the columns in each row
+        - settle (timedelta) - How long after a bucket ends its rows can
+        still change, e.g. a pot's age isn't known until it's empty
+        - options (dict) - Integer options the query takes, as
+        name: (default, minimum, maximum)
+        - raw (bool) - Whether the query reads readings that are pruned
+        after RETENTION_RAW_DAYS, rather than only FULL_TEAPOT ones
+    """
+
+    def __init__(self, query, bucket, columns, settle=timedelta(),
+                 options=None, raw=False):
+        self.query = query
+        self.bucket = bucket
+        self.columns = columns
+        self.settle = settle
+        self.options = options or {}
+        self.raw = raw
+
+    @property
+    def bucket_size(self):
+        return BUCKET_SIZES[self.bucket]
+
+
+STATS = {
+    'potsPerDay': Stat(pots_per_day, DAY, ['day', 'pots', 'cups']),
+    'potAge': Stat(
+        pot_age, DAY,
+        ['day', 'pots', 'emptied', 'averageMinutes', 'longestMinutes'],
+        settle=MAX_POT_AGE, raw=True),
+    'cupsPerHour': Stat(cups_per_hour, HOUR, ['hour', 'cups'], raw=True),
+    'temperature': Stat(
+        temperature_curve, DAY,
+        ['day', 'minutesSinceMade', 'averageTemperature', 'readings'],
+        settle=TEMPERATURE_CURVE_LENGTH,
+        options={'interval': (10, 1, 60)}, raw=True),
+}
+
+
+def bucket_start(bucket, timestamp):
+    """Returns the start of the day or hour timestamp falls in"""
+    if bucket == DAY:
+        return datetime.combine(timestamp.date(), datetime.min.time())
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_key(bucket, start):
+    """The bucket's key as SQLite's date functions format it"""
+    if bucket == DAY:
+        return start.strftime('%Y-%m-%d')
+    return start.strftime('%Y-%m-%d %H:00')
+
+
+def first_whole_bucket(stat, cutoff):
+    """Returns the start of the first bucket that begins at or after the
+    cutoff
+
+    Args:
+        - stat (Stat) - The statistic
+        - cutoff (datetime) - Earliest time the bucket may cover
+    Returns:
+        - datetime
+    """
+    start = bucket_start(stat.bucket, cutoff)
+    if start < cutoff:
+        start += stat.bucket_size
+    return start
+
+
+def bucket_range(stat, start, end):
+    """Widens a time range to whole buckets
+
+    Args:
+        - stat (Stat) - The statistic
+        - start (datetime) - Start of the range
+        - end (datetime) - End of the range
+    Returns:
+        - list of the start of each bucket in the range
+    """
+    size = stat.bucket_size
+    current = bucket_start(stat.bucket, start)
+    starts = []
+    while current < end:
+        starts.append(current)
+        current += size
+    return starts
+
+
+_UNSET = object()
+
+
+class ClosedBucketCache(object):
+    """Per process cache of the rows of buckets that have finished. Entries
+    are dropped when the DataVersion stamp changes, which happens when old
+    readings are uploaded or pruned.
+    """
+
+    def __init__(self, version_name, max_buckets=STATS_CACHE_MAX_BUCKETS):
+        self.version_name = version_name
+        self.max_buckets = max_buckets
+        self._stamp = _UNSET
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def get_rows(self, name, stat, starts, now, options=(),
+                 teapot=DEFAULT_TEAPOT):
+        """Returns the rows of the buckets, querying only the ones that aren't
+        cached
+
+        Args:
+            - name (String) - Name the statistic is cached under
+            - stat (Stat) - The statistic
+            - starts (list) - Start of each bucket, in order
+            - now (datetime) - The current time
+            - options (tuple) - (name, value) pairs passed to the query
+            - teapot (String) - Name of the teapot
+        Returns:
+            - list of row tuples
+        """
+        stamp = DataVersion.get_stamp(self.version_name)
+        buckets = [
+            (start, (name, teapot, options, bucket_key(stat.bucket, start)))
+            for start in starts
+        ]
+        with self._lock:
+            if self._stamp != stamp:
+                self._stamp = stamp
+                self._rows = {}
+            found = dict(
+                (key, self._rows[key])
+                for _, key in buckets if key in self._rows
+            )
+
+        missing = [(start, key) for start, key in buckets if key not in found]
+        if missing:
+            queried = dict(
+                (bucket, list(rows)) for bucket, rows in groupby(
+                    stat.query(missing[0][0],
+                               missing[-1][0] + stat.bucket_size,
+                               teapot=teapot, **dict(options)),
+                    lambda row: row[0]
+                )
+            )
+            closed_before = now - stat.settle - timedelta(
+                seconds=STATS_BUCKET_GRACE)
+            closed = {}
+            for start, key in missing:
+                found[key] = queried.get(key[-1], [])
+                if start + stat.bucket_size <= closed_before:
+                    closed[key] = found[key]
+            with self._lock:
+                if self._stamp == stamp:
+                    if len(self._rows) + len(closed) > self.max_buckets:
+                        self._rows = {}
+                    self._rows.update(closed)
+
+        return [row for _, key in buckets for row in found[key]]
+
+    def clear(self):
+        with self._lock:
+            self._stamp = _UNSET
+            self._rows = {}
+
+
+stats_cache = ClosedBucketCache(STATE_HISTORY_VERSION)
@@ -0,0 +1,59 @@
+"""Simulated teapot sensor readings for a pot from full to empty, a reading
+every ten seconds: the tea cools towards room temperature and cups are poured
+at random, with a little sensor noise on both. The prediction tests and
+benchmark replay them in place of recorded readings.
+"""
+from datetime import timedelta
+import math
+import random
+
+READING_INTERVAL = timedelta(seconds=10)
+EMPTY_WEIGHT = 400
+CUP_WEIGHT = 250
+ROOM_TEMPERATURE = 20
+# Temperature the teapot reports COLD_TEAPOT below
+COLD_TEMPERATURE = 50
+
+
+def pot_readings(start, cups=6, minutes_per_cup=10, cooling_minutes=60,
+                 seed_value=0):
+    """Generates the readings of one pot, the first FULL_TEAPOT at start
+    and the last the first EMPTY_TEAPOT
+
+    Args:
+        - start (datetime) - When the pot is made
+        - cups (int) - Cups in the pot
+        - minutes_per_cup (float) - Mean time between cups being poured
+        - cooling_minutes (float) - Time constant of the tea cooling
+    Returns:
+        - generator of dict - State field values
+    """
+    rand = random.Random(seed_value)
+    left = cups
+    elapsed = 0
+    next_pour = rand.expovariate(1.0 / minutes_per_cup) * 60
+    while True:
+        temperature = ROOM_TEMPERATURE + 75 * math.exp(
+            -elapsed / 60.0 / cooling_minutes)
+        if elapsed == 0:
+            state = 'FULL_TEAPOT'
+        elif left == 0:
+            state = 'EMPTY_TEAPOT'
+        elif temperature < COLD_TEMPERATURE:
+            state = 'COLD_TEAPOT'
+        else:
+            state = 'GOOD_TEAPOT'
+        yield {
+            'state': state,
+            'timestamp': start + timedelta(seconds=elapsed),
+            'num_of_cups': left,
+            'weight': int(EMPTY_WEIGHT + left * CUP_WEIGHT +
+                          rand.uniform(-4, 4)),
+            'temperature': int(round(temperature + rand.uniform(-0.5, 0.5)))
+        }
+        if state == 'EMPTY_TEAPOT':
+            return
+        elapsed += READING_INTERVAL.total_seconds()
+        while left and elapsed >= next_pour:
+            left -= 1
+            next_pour += rand.expovariate(1.0 / minutes_per_cup) * 60
@@ -0,0 +1,36 @@
+from playhouse.test_utils import count_queries
+import re
+
+# Plan lines for a scan that doesn't go through an index, the word TABLE was
+# dropped from EXPLAIN QUERY PLAN output in SQLite 3.36
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+# Plans name tables by the alias peewee gives them, e.g. "state" AS t1
+TABLE_ALIAS = re.compile(r'"(\w+)" AS (\w+)')
+
+
+def full_table_scans(database, func, *args, **kwargs):
+    """Calls func and runs EXPLAIN QUERY PLAN on every query it issued
+
+    Args:
+        - database (Database) - The database the queries ran against
+        - func (callable) - The function to check
+    Returns:
+        - list of (sql, table) tuples for each query that scans a whole table
+    """
+    with count_queries() as counter:
+        func(*args, **kwargs)
+
+    scans = []
+    for record in counter.get_queries():
+        sql, params = record.msg
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        aliases = dict(
+            (alias, table) for table, alias in TABLE_ALIAS.findall(sql))
+        plan = database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+        for row in plan.fetchall():
+            match = FULL_SCAN.match(row[-1])
+            if match:
+                table = match.group(1)
+                scans.append((sql, aliases.get(table, table)))
+    return scans
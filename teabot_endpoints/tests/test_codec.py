@@ -0,0 +1,85 @@
+from unittest import TestCase
+from teabot_endpoints import codec
+from teabot_endpoints.codec import Field, RequestError, Schema
+import json
+
+SCHEMA = Schema({
+    'name': Field(codec.string),
+    'cups': Field(int),
+    'weight': Field(float, required=False, default=-1)
+})
+
+
+class TestCodec(TestCase):
+
+    def test_validate(self):
+        self.assertEqual(
+            SCHEMA.validate({'name': 'pot', 'cups': '3', 'extra': True}),
+            {'name': 'pot', 'cups': 3, 'weight': -1}
+        )
+
+    def test_validate_reports_every_field(self):
+        with self.assertRaises(RequestError) as context:
+            SCHEMA.validate({'cups': 'three', 'weight': None})
+        error = context.exception
+        self.assertEqual(error.status, 400)
+        self.assertEqual(error.fields, {
+            'cups': "Invalid cups: 'three'",
+            'name': 'Missing field: name',
+            'weight': 'Invalid weight: None'
+        })
+
+    def test_validate_rejects_non_objects(self):
+        with self.assertRaises(RequestError) as context:
+            SCHEMA.validate(['pot', 3])
+        self.assertEqual(str(context.exception), 'Expected a JSON object')
+
+    def test_string_rejects_numbers(self):
+        with self.assertRaises(RequestError) as context:
+            SCHEMA.validate({'name': 5, 'cups': 1})
+        self.assertEqual(context.exception.fields, {'name': 'Invalid name: 5'})
+
+    def test_integer_rejects_other_numbers(self):
+        self.assertEqual(codec.integer(3), 3)
+        self.assertEqual(codec.integer(2 ** 70), 2 ** 70)
+        for value in (2.9, 3.0, '3', True):
+            with self.assertRaises(TypeError):
+                codec.integer(value)
+
+    def test_nullable_field_accepts_null(self):
+        schema = Schema({
+            'weight': Field(codec.integer, required=False, default=-1,
+                            nullable=True)
+        })
+        self.assertEqual(schema.validate({'weight': None}), {'weight': None})
+        self.assertEqual(schema.validate({'weight': 900}), {'weight': 900})
+        self.assertEqual(schema.validate({}), {'weight': -1})
+        with self.assertRaises(RequestError):
+            schema.validate({'weight': 900.5})
+
+    def test_parse(self):
+        self.assertEqual(
+            codec.parse('{"name": "pot", "cups": 2, "weight": 900}', SCHEMA),
+            {'name': 'pot', 'cups': 2, 'weight': 900.0}
+        )
+
+    def test_parse_invalid_json(self):
+        with self.assertRaises(RequestError) as context:
+            codec.parse('{"name": ', SCHEMA)
+        self.assertTrue(str(context.exception).startswith('Invalid JSON'))
+
+    def test_json_response_is_compact(self):
+        response = codec.json_response({'a': [1, 2], 'b': 'c/d'}, 201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, 'application/json')
+        body = response.get_data()
+        self.assertNotIn(' ', body)
+        self.assertNotIn('\n', body)
+        self.assertEqual(json.loads(body), {'a': [1, 2], 'b': 'c/d'})
+
+    def test_error_response(self):
+        response = RequestError(
+            'Bad', {'cups': 'Missing field: cups'}).response()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data()), {
+            'error': 'Bad', 'fields': {'cups': 'Missing field: cups'}})
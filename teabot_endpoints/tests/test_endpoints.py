@@ -1,12 +1,17 @@
 from unittest import TestCase
-from playhouse.test_utils import test_database
-from teabot_endpoints.models import State, PotMaker, \
-    SlackMessages
+from playhouse.test_utils import test_database, count_queries
+from teabot_endpoints.models import State, PotMaker, SlackMessages, MODELS
+from teabot_endpoints.slack_communicator import SlackCommunicator
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from teabot_endpoints import endpoints, metrics, stats, write_behind
 from teabot_endpoints.endpoints import app, _cup_puraliser, \
     _human_teapot_state, _are_or_is
 from peewee import SqliteDatabase
 from mock import patch
 import json
+import shutil
+import tempfile
+import time
 from datetime import datetime, timedelta
 
 test_db = SqliteDatabase(':memory:')
@@ -18,14 +23,38 @@ class TestEndpoints(TestCase):
         self.app = app.test_client()
 
     def run(self, result=None):
-        with test_database(test_db, [State, PotMaker, SlackMessages]):
-            super(TestEndpoints, self).run(result)
+        directory = tempfile.mkdtemp()
+        try:
+            with patch.object(metrics, 'METRICS_DIR', directory), \
+                    test_database(test_db, MODELS):
+                super(TestEndpoints, self).run(result)
+        finally:
+            shutil.rmtree(directory)
+
+    @patch("teabot_endpoints.endpoints.init_rollbar")
+    def test_create_app_without_rollbar_token(self, mock_init_rollbar):
+        self.assertIs(endpoints.create_app(), app)
+        self.assertFalse(mock_init_rollbar.called)
+
+    @patch.dict(app.extensions)
+    @patch("teabot_endpoints.endpoints.ROLLBAR_API_TOKEN", 'token')
+    @patch("teabot_endpoints.endpoints.init_rollbar")
+    def test_create_app_sets_up_rollbar_once(self, mock_init_rollbar):
+        endpoints.create_app()
+        endpoints.create_app()
+        self.assertEqual(mock_init_rollbar.call_count, 1)
 
     def test_im_a_teapot(self):
         result = self.app.get("/imATeapot")
         self.assertTrue(result)
         self.assertEqual(result.status_code, 418)
 
+    @patch("teabot_endpoints.endpoints.db", autospec=True)
+    def test_database_closed_after_request(self, mock_db):
+        mock_db.is_closed.return_value = False
+        self.app.get("/imATeapot")
+        mock_db.close.assert_called_once_with()
+
     @patch(
         "teabot_endpoints.endpoints.slack_communicator_wrapper",
         auto_spec=True)
@@ -38,13 +67,12 @@ class TestEndpoints(TestCase):
         result = self.app.post("/teaReady")
         self.assertEqual(result.status_code, 200)
         mock_slack.post_message_to_room.assert_any_call(
-            "The Teapot :teapot: is ready with 3 cups"
-        )
+            "The Teapot :teapot: is ready with 3 cups", teapot=DEFAULT_TEAPOT)
         reaction_message = \
             "Want a cup of tea from the next teapot ? " + \
             "React to this message to let everyone know!"
         mock_slack.post_message_to_room.assert_any_call(
-            reaction_message, True)
+            reaction_message, True, DEFAULT_TEAPOT)
 
         self.assertEqual(mock_slack.post_message_to_room.call_count, 2)
 
@@ -68,16 +96,40 @@ class TestEndpoints(TestCase):
         result = self.app.post("/teaReady")
         self.assertEqual(result.status_code, 200)
         mock_slack.post_message_to_room.assert_any_call(
-            "The Teapot :teapot: is ready with 3 cups, thanks to bob"
-        )
+            "The Teapot :teapot: is ready with 3 cups, thanks to bob",
+            teapot=DEFAULT_TEAPOT)
         reaction_message = \
             "Want a cup of tea from the next teapot ? " + \
             "React to this message to let everyone know!"
         mock_slack.post_message_to_room.assert_any_call(
-            reaction_message, True)
+            reaction_message, True, DEFAULT_TEAPOT)
 
         self.assertEqual(mock_slack.post_message_to_room.call_count, 2)
 
+    @patch("teabot_endpoints.slack_communicator.SlackClient")
+    def test_tea_ready_twice_before_delivery(self, mock_client):
+        communicator = SlackCommunicator()
+        slack = mock_client.return_value
+        slack.post_message.side_effect = [
+            {'ok': True, 'ts': ts, 'channel': 'C1234'}
+            for ts in ('ts1', 'ts2', 'ts3', 'ts4')]
+        State.create(
+            state="FULL_TEAPOT",
+            timestamp=datetime.now().isoformat(),
+            num_of_cups=3
+        )
+        with patch.object(
+                endpoints, 'slack_communicator_wrapper', communicator):
+            self.app.post("/teaReady")
+            self.app.post("/teaReady")
+            while communicator.deliver_next_message():
+                pass
+
+        messages = SlackMessages.select()
+        self.assertEqual([m.timestamp for m in messages], ['ts4'])
+        self.assertEqual(
+            SlackMessages.get_reaction_message_details().timestamp, 'ts4')
+
     def test_tea_webhook_no_data(self):
         result = self.app.post("/teabotWebhook")
         self.assertEqual(result.status_code, 200)
@@ -138,6 +190,155 @@ class TestEndpoints(TestCase):
         self.assertEqual(db_entry.timestamp, now)
         self.assertEqual(db_entry.state, 'TEAPOT FULL')
 
+    def test_store_state_drops_repeats(self):
+        for seconds, weight in [(0, 1200), (5, 1195), (10, 900)]:
+            timestamp = datetime(2017, 1, 1, 9, 0, seconds, 1)
+            result = self.app.post("/storeState", data=json.dumps({
+                'num_of_cups': 3,
+                'timestamp': timestamp.isoformat(),
+                'state': 'GOOD_TEAPOT',
+                'weight': weight
+            }))
+            self.assertEqual(result.status_code, 200)
+        self.assertEqual(
+            [(s.weight, s.last_seen.second)
+             for s in State.select().order_by(State.timestamp)],
+            [(1200, 5), (900, 10)]
+        )
+
+    @patch("teabot_endpoints.endpoints.state_broadcaster.notify")
+    def test_store_state_write_behind(self, mock_notify):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        buffer = write_behind.WriteBehindBuffer(directory)
+        with patch.object(write_behind, 'state_buffer', buffer), \
+                patch.object(State, 'write_behind_buffer', buffer):
+            for seconds, weight in [(0, 1200), (5, 1100), (10, 1000)]:
+                timestamp = datetime(2017, 1, 1, 9, 0, seconds, 1)
+                result = self.app.post("/storeState", data=json.dumps({
+                    'num_of_cups': 3,
+                    'timestamp': timestamp.isoformat(),
+                    'state': 'GOOD_TEAPOT',
+                    'weight': weight
+                }))
+                self.assertEqual(result.status_code, 200)
+            # The first reading changed the state, the rest are buffered
+            self.assertEqual(mock_notify.call_count, 1)
+            self.assertEqual(State.select().count(), 1)
+            self.assertEqual(
+                json.loads(self.app.get('/teabotWebhook').data)['text'],
+                _human_teapot_state(State.get_newest_state_record()))
+            self.assertEqual(State.get_newest_state_record().weight, 1000)
+
+            buffer.flush()
+        self.assertEqual(State.select().count(), 3)
+
+    @patch("teabot_endpoints.endpoints.state_broadcaster.start")
+    def test_state_stream(self, mock_start):
+        State.create(
+            state='FULL_TEAPOT',
+            timestamp=datetime(2017, 1, 1, 9),
+            num_of_cups=6,
+            weight=1500,
+            temperature=90
+        )
+        result = self.app.get("/stateStream")
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'text/event-stream')
+        stream = result.response
+        self.assertEqual(next(stream), "retry: 1000\n\n")
+
+        endpoints.state_broadcaster.poll()
+        event = next(stream)
+        self.assertTrue(event.startswith("event: state\ndata: "))
+        data = json.loads(event.split("data: ")[1])
+        self.assertEqual(data['state'], 'FULL_TEAPOT')
+        self.assertEqual(data['num_of_cups'], 6)
+        self.assertEqual(data['timestamp'], '2017-01-01T09:00:00')
+
+        result.close()
+        self.assertEqual(endpoints.state_broadcaster.subscriber_count, 0)
+
+    @patch("teabot_endpoints.endpoints.STATE_STREAM_KEEPALIVE", 15)
+    @patch("teabot_endpoints.endpoints.STATE_STREAM_MAX_DURATION", 0.05)
+    @patch("teabot_endpoints.endpoints.state_broadcaster.start")
+    def test_state_stream_ends_at_max_duration(self, mock_start):
+        result = self.app.get("/stateStream")
+        stream = result.response
+        self.assertEqual(next(stream), "retry: 1000\n\n")
+        start = time.time()
+        self.assertEqual(list(stream)[-1], ": keepalive\n\n")
+        self.assertLess(time.time() - start, 1)
+        result.close()
+
+    def test_store_states_array(self):
+        now = datetime.now()
+        result = self.app.post(
+            "/storeStates",
+            data=json.dumps([
+                {
+                    'num_of_cups': 3,
+                    'timestamp': now.isoformat(),
+                    'state': 'FULL_TEAPOT',
+                    'weight': 1200
+                },
+                {
+                    'num_of_cups': 2,
+                    'timestamp': (now + timedelta(seconds=1)).isoformat(),
+                    'state': 'FULL_TEAPOT'
+                }
+            ])
+        )
+        self.assertEqual(result.status_code, 200)
+        data = json.loads(result.data)
+        self.assertEqual(data['stored'], 2)
+        self.assertEqual(data['errors'], [])
+        database_entries = [d for d in State.select().order_by(State.id)]
+        self.assertEqual(len(database_entries), 2)
+        self.assertEqual(database_entries[0].weight, 1200)
+        self.assertEqual(database_entries[0].timestamp, now)
+        self.assertEqual(database_entries[1].weight, -1)
+        self.assertEqual(database_entries[1].temperature, 1)
+
+    def test_store_states_newline_delimited_with_errors(self):
+        now = datetime.now()
+        body = "\n".join([
+            json.dumps({
+                'num_of_cups': 3,
+                'timestamp': now.isoformat(),
+                'state': 'FULL_TEAPOT'
+            }),
+            "{not json",
+            json.dumps({'num_of_cups': 3, 'state': 'FULL_TEAPOT'}),
+            json.dumps({
+                'num_of_cups': 3,
+                'timestamp': 'yesterday',
+                'state': 'FULL_TEAPOT'
+            }),
+            "",
+            json.dumps({
+                'num_of_cups': 1,
+                'timestamp': now.isoformat(),
+                'state': 'EMPTY_TEAPOT'
+            })
+        ])
+        result = self.app.post("/storeStates", data=body)
+        self.assertEqual(result.status_code, 200)
+        data = json.loads(result.data)
+        self.assertEqual(data['stored'], 2)
+        self.assertEqual(
+            [error['index'] for error in data['errors']], [1, 2, 3])
+        self.assertEqual(
+            data['errors'][1]['error'], 'Missing field: timestamp')
+        self.assertEqual(State.select().count(), 2)
+
+    def test_store_states_malformed_array(self):
+        result = self.app.post("/storeStates", data="[{]")
+        self.assertEqual(result.status_code, 400)
+        data = json.loads(result.data)
+        self.assertEqual(data['stored'], 0)
+        self.assertEqual(State.select().count(), 0)
+
     def test_pluraliser_1_cup(self):
         result = _cup_puraliser(1)
         self.assertEqual(result, "1 cup")
@@ -204,6 +405,46 @@ class TestEndpoints(TestCase):
         self.assertEqual(result.status_code, 200)
         data = json.loads(result.data)
         self.assertEqual(data["teapotAge"], 5)
+        self.assertEqual(
+            result.headers['Cache-Control'], 'public, max-age=5')
+        self.assertNotIn('ETag', result.headers)
+
+    @patch("teabot_endpoints.endpoints._get_current_time", autospec=True)
+    def test_teapot_prediction(self, mock_time):
+        mock_time.return_value = datetime(2016, 1, 1, 12, 10, 0)
+        State.record_reading({
+            'state': 'FULL_TEAPOT',
+            'timestamp': datetime(2016, 1, 1, 12, 0, 0),
+            'num_of_cups': 4,
+            'weight': 1400,
+            'temperature': 95
+        })
+        for minute in range(1, 11):
+            State.record_reading({
+                'state': 'GOOD_TEAPOT',
+                'timestamp': datetime(2016, 1, 1, 12, minute, 0),
+                'num_of_cups': 4,
+                'weight': 1400 - 50 * minute,
+                'temperature': 95 - minute
+            })
+        with patch.object(endpoints, 'teapot_forecasters', {}):
+            result = self.app.get("/teapotPrediction")
+        self.assertEqual(result.status_code, 200)
+        data = json.loads(result.data)
+        self.assertAlmostEqual(data['minutesUntilEmpty'], 10)
+        self.assertEqual(data['emptyAt'], '2016-01-01T12:20:00')
+        self.assertAlmostEqual(data['weightPerMinute'], -50)
+        self.assertGreater(data['minutesUntilCold'], 0)
+        self.assertLess(data['temperaturePerMinute'], 0)
+        self.assertEqual(
+            result.headers['Cache-Control'], 'public, max-age=5')
+
+    def test_teapot_prediction_without_readings(self):
+        with patch.object(endpoints, 'teapot_forecasters', {}):
+            result = self.app.get("/teapotPrediction")
+        data = json.loads(result.data)
+        self.assertIsNone(data['minutesUntilEmpty'])
+        self.assertIsNone(data['coldAt'])
 
     def test_pot_makers(self):
         PotMaker.create(
@@ -225,6 +466,213 @@ class TestEndpoints(TestCase):
         data = json.loads(result.data)
         self.assertEqual(len(data['potMakers']), 2)
 
+    def test_pot_makers_not_modified(self):
+        PotMaker.create(
+            name='aaron',
+            number_of_pots_made=1,
+            total_weight_made=12,
+            number_of_cups_made=5,
+            largest_single_pot=2
+        )
+        result = self.app.get('/potMakers')
+        etag = result.headers['ETag']
+        self.assertEqual(
+            result.headers['Cache-Control'], 'public, max-age=5')
+
+        with count_queries() as counter:
+            result = self.app.get(
+                '/potMakers', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 304)
+        self.assertEqual(result.data, '')
+        self.assertEqual(result.headers['ETag'], etag)
+        # Only the version stamp is read
+        self.assertEqual(counter.count, 1)
+
+    def test_pot_makers_modified_after_claim(self):
+        maker = PotMaker.create(
+            name='aaron',
+            number_of_pots_made=1,
+            total_weight_made=12,
+            number_of_cups_made=5,
+            largest_single_pot=2
+        )
+        State.create(
+            state="FULL_TEAPOT",
+            timestamp=datetime.now(),
+            num_of_cups=4,
+            weight=1000
+        )
+        etag = self.app.get('/potMakers').headers['ETag']
+        State.claim_latest_full_teapot(maker)
+
+        result = self.app.get('/potMakers', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(result.headers['ETag'], etag)
+        data = json.loads(result.data)
+        self.assertEqual(data['potMakers'][0]['numberOfPotsMade'], 2)
+
+    def test_etag_of_non_ascii_query(self):
+        result = self.app.get('/potMakers', query_string='x=\xc3\xa9')
+        self.assertEqual(result.status_code, 200)
+        etag = result.headers['ETag']
+        self.assertNotEqual(self.app.get('/potMakers').headers['ETag'], etag)
+        self.assertEqual(self.app.get(
+            '/potMakers', query_string='x=\xc3\xa9',
+            headers={'If-None-Match': etag}
+        ).status_code, 304)
+
+    def test_tea_webhook_modified_after_store_state(self):
+        State.create(state="GOOD_TEAPOT", timestamp=datetime.now(),
+                     num_of_cups=4)
+        etag = self.app.get('/teabotWebhook').headers['ETag']
+        self.assertEqual(
+            self.app.get(
+                '/teabotWebhook', headers={'If-None-Match': etag}
+            ).status_code,
+            304
+        )
+        self.assertNotEqual(
+            self.app.get('/numberOfNewTeapots').headers['ETag'], etag)
+
+        self.app.post("/storeState", data=json.dumps({
+            'num_of_cups': 3,
+            'timestamp': datetime.now().isoformat(),
+            'state': 'GOOD_TEAPOT'
+        }))
+        result = self.app.get(
+            '/teabotWebhook', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(
+            json.loads(result.data)['text'], 'There are 3 cups left')
+
+    def test_tea_webhook_post_not_cached(self):
+        result = self.app.post('/teabotWebhook')
+        self.assertEqual(result.status_code, 200)
+        self.assertNotIn('ETag', result.headers)
+
+    def _create_leaderboard(self):
+        for name, pots, inactive in [
+                ('aaron', 3, False), ('bob', 5, False), ('carol', 4, True)]:
+            PotMaker.create(
+                name=name,
+                number_of_pots_made=pots,
+                total_weight_made=pots * 1000,
+                number_of_cups_made=pots * 4,
+                largest_single_pot=1000,
+                inactive=inactive
+            )
+
+    def test_leaderboard(self):
+        self._create_leaderboard()
+        result = self.app.get('/leaderboard?perPage=1&page=2')
+        self.assertEqual(result.status_code, 200)
+        data = json.loads(result.data)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['page'], 2)
+        self.assertEqual(data['perPage'], 1)
+        self.assertEqual(data['leaderboard'], [{
+            'rank': 2,
+            'name': 'aaron',
+            'numberOfPotsMade': 3,
+            'totalWeightMade': 3000,
+            'largestSinglePot': 1000,
+            'numberOfCupsMade': 12,
+            'inactive': False
+        }])
+
+        data = json.loads(self.app.get(
+            '/leaderboard?sort=cups&includeInactive=true').data)
+        self.assertEqual(
+            [maker['name'] for maker in data['leaderboard']],
+            ['bob', 'carol', 'aaron'])
+
+    @patch("teabot_endpoints.endpoints._get_current_time", autospec=True)
+    def test_leaderboard_week(self, mock_time):
+        mock_time.return_value = datetime(2017, 1, 12, 12)
+        self._create_leaderboard()
+        State.create(state="FULL_TEAPOT", timestamp=datetime(2017, 1, 10),
+                     num_of_cups=4, weight=900)
+        State.claim_latest_full_teapot(
+            PotMaker.get_single_pot_maker('aaron'))
+
+        data = json.loads(self.app.get('/leaderboard?period=week').data)
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['leaderboard'][0]['name'], 'aaron')
+        self.assertEqual(data['leaderboard'][0]['numberOfPotsMade'], 1)
+        etag = self.app.get('/leaderboard?period=week').headers['ETag']
+
+        # A new week starts a new leaderboard
+        mock_time.return_value = datetime(2017, 1, 16, 12)
+        result = self.app.get(
+            '/leaderboard?period=week', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data)['total'], 0)
+
+    def test_leaderboard_invalid_arguments(self):
+        for query in ['sort=name', 'period=year', 'page=0', 'perPage=101',
+                      'page=one']:
+            result = self.app.get('/leaderboard?' + query)
+            self.assertEqual(result.status_code, 400)
+            self.assertIn('error', json.loads(result.data))
+
+    @patch('teabot_endpoints.endpoints._get_current_time')
+    def test_stats(self, mock_time):
+        mock_time.return_value = datetime(2017, 1, 3, 12)
+        stats.stats_cache.clear()
+        State.create(state="FULL_TEAPOT", timestamp=datetime(2017, 1, 2, 9),
+                     num_of_cups=4, weight=1400)
+        State.create(state="FULL_TEAPOT", timestamp=datetime(2017, 1, 3, 9),
+                     num_of_cups=6, weight=1900)
+
+        result = self.app.get('/stats/potsPerDay')
+        self.assertEqual(result.status_code, 200)
+        self.assertIn('max-age', result.headers['Cache-Control'])
+        self.assertEqual(json.loads(result.data), {
+            'stat': 'potsPerDay',
+            'bucket': 'day',
+            'from': '2016-12-04T00:00:00',
+            'to': '2017-01-04T00:00:00',
+            'columns': ['day', 'pots', 'cups'],
+            'rows': [['2017-01-02', 1, 4], ['2017-01-03', 1, 6]]
+        })
+
+        data = json.loads(self.app.get(
+            '/stats/cupsPerHour?from=2017-01-03T08:30:00'
+            '&to=2017-01-03T10:00:00').data)
+        self.assertEqual(data['from'], '2017-01-03T08:00:00')
+
+        data = json.loads(self.app.get(
+            '/stats/temperature?from=2017-01-03&interval=5').data)
+        self.assertEqual(data['columns'][1], 'minutesSinceMade')
+
+    @patch('teabot_endpoints.retention.RETENTION_RAW_DAYS', 1)
+    @patch('teabot_endpoints.endpoints._get_current_time')
+    def test_stats_start_after_pruned_readings(self, mock_time):
+        mock_time.return_value = datetime(2017, 1, 3, 12, 30)
+        data = json.loads(self.app.get(
+            '/stats/cupsPerHour?from=2017-01-01').data)
+        self.assertEqual(data['from'], '2017-01-02T12:00:00')
+        data = json.loads(self.app.get(
+            '/stats/potAge?from=2017-01-01').data)
+        self.assertEqual(data['from'], '2017-01-03T00:00:00')
+        data = json.loads(self.app.get(
+            '/stats/potsPerDay?from=2017-01-01').data)
+        self.assertEqual(data['from'], '2017-01-01T00:00:00')
+        result = self.app.get(
+            '/stats/cupsPerHour?from=2017-01-01&to=2017-01-02')
+        self.assertEqual(result.status_code, 400)
+
+    def test_stats_invalid_arguments(self):
+        self.assertEqual(self.app.get('/stats/teaLeaves').status_code, 404)
+        for query in ['potsPerDay?from=yesterday',
+                      'potsPerDay?from=2017-01-02&to=2017-01-01',
+                      'potsPerDay?from=2010-01-01&to=2017-01-01',
+                      'cupsPerHour?from=2017-01-01&to=2017-03-01',
+                      'temperature?interval=0']:
+            result = self.app.get('/stats/' + query)
+            self.assertEqual(result.status_code, 400, query)
+            self.assertIn('error', json.loads(result.data))
+
     def test_claim_pot_already_claimed(self):
         maker = PotMaker.create(
             name='bob',
@@ -285,6 +733,21 @@ class TestEndpoints(TestCase):
         updated_state = State.get_latest_full_teapot()
         self.assertEqual(updated_state.claimed_by, maker)
 
+    def test_claim_pot_unknown_pot_maker(self):
+        State.create(state="FULL_TEAPOT", timestamp=datetime.now(),
+                     num_of_cups=3)
+        result = self.app.post(
+            '/claimPot', data=json.dumps({'potMaker': 'nobody'}))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data)['submitMessage'],
+                         'You need to select a pot maker')
+
+    def test_claim_pot_no_teapot(self):
+        result = self.app.post(
+            '/claimPot', data=json.dumps({'potMaker': 'bob'}))
+        self.assertEqual(json.loads(result.data)['submitMessage'],
+                         'There is no pot to claim')
+
     def test_claim_pot_no_pot_maker(self):
         State.create(
             state="FULL_TEAPOT",
@@ -297,3 +760,162 @@ class TestEndpoints(TestCase):
         data = json.loads(result.data)
         self.assertEqual(
             data['submitMessage'], 'You need to select a pot maker')
+
+    def test_claim_pot_invalid_json(self):
+        State.create(state="FULL_TEAPOT", timestamp=datetime.now(),
+                     num_of_cups=3)
+        result = self.app.post('/claimPot', data='{"potMaker": ')
+        self.assertEqual(result.status_code, 400)
+        self.assertTrue(
+            json.loads(result.data)['error'].startswith('Invalid JSON'))
+
+    def test_store_state_invalid_fields(self):
+        result = self.app.post("/storeState", data=json.dumps({
+            'timestamp': 'yesterday',
+            'state': 'TEAPOT FULL',
+            'weight': 'heavy'
+        }))
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(json.loads(result.data)['fields'], {
+            'num_of_cups': 'Missing field: num_of_cups',
+            'timestamp': "Invalid timestamp: u'yesterday'",
+            'weight': "Invalid weight: u'heavy'"
+        })
+        self.assertEqual(State.select().count(), 0)
+
+    def test_store_state_rejects_non_integers(self):
+        for field, value in [('num_of_cups', 2.9), ('num_of_cups', True),
+                             ('num_of_cups', '3'), ('weight', 1200.5),
+                             ('temperature', False)]:
+            reading = {
+                'num_of_cups': 3,
+                'timestamp': datetime.now().isoformat(),
+                'state': 'GOOD_TEAPOT',
+                'weight': 1200,
+                'temperature': 80
+            }
+            reading[field] = value
+            result = self.app.post("/storeState", data=json.dumps(reading))
+            self.assertEqual(result.status_code, 400, reading)
+            self.assertEqual(
+                list(json.loads(result.data)['fields']), [field])
+        self.assertEqual(State.select().count(), 0)
+
+    def test_store_state_null_weight_and_temperature(self):
+        result = self.app.post("/storeState", data=json.dumps({
+            'num_of_cups': 3,
+            'timestamp': datetime.now().isoformat(),
+            'state': 'GOOD_TEAPOT',
+            'weight': None,
+            'temperature': None
+        }))
+        self.assertEqual(result.status_code, 200)
+        state = State.get()
+        self.assertIsNone(state.weight)
+        self.assertIsNone(state.temperature)
+
+    def test_flip_teapot_request_missing_mac_address(self):
+        result = self.app.post('/flipTeapotRequest', data=json.dumps({}))
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(json.loads(result.data)['fields'], {
+            'dash_mac_address': 'Missing field: dash_mac_address'})
+
+    def test_flip_teapot_request_unknown_mac_address(self):
+        result = self.app.post(
+            '/flipTeapotRequest', data=json.dumps({'dash_mac_address': 'abc'}))
+        self.assertEqual(result.status_code, 404)
+        self.assertEqual(json.loads(result.data)['error'],
+                         'Unknown dash button: abc')
+
+    def test_flip_teapot_request_repeated_press(self):
+        PotMaker.create(name='bob', number_of_pots_made=1,
+                        total_weight_made=1000, number_of_cups_made=4,
+                        largest_single_pot=1000, mac_address='abc')
+        for _ in range(2):
+            result = self.app.post(
+                '/flipTeapotRequest',
+                data=json.dumps({'dash_mac_address': 'abc'}))
+            self.assertEqual(json.loads(result.data),
+                             {'requestedTeapot': True})
+        self.assertEqual(PotMaker.get_number_of_teapot_requests(), 1)
+
+    def test_unknown_teapot(self):
+        for path in ['/teapotAge', '/teabotWebhook', '/stats/potsPerDay',
+                     '/getNumberOfTeapotRequests']:
+            result = self.app.get(path + '?teapot=nowhere')
+            self.assertEqual(result.status_code, 404, path)
+            self.assertEqual(json.loads(result.data),
+                             {'error': 'Unknown teapot: nowhere'})
+        result = self.app.post('/storeState?teapot=nowhere', data='{}')
+        self.assertEqual(result.status_code, 404)
+
+    @patch.dict("teabot_endpoints.endpoints.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    def test_store_state_for_teapot(self):
+        etag = self.app.get('/teabotWebhook').headers['ETag']
+        result = self.app.post("/storeState?teapot=kitchen", data=json.dumps({
+            'num_of_cups': 3,
+            'timestamp': datetime.now().isoformat(),
+            'state': 'FULL_TEAPOT'
+        }))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(State.get_newest_state_record('kitchen').teapot,
+                         'kitchen')
+
+        # The default teapot's responses are still current
+        self.assertEqual(self.app.get(
+            '/teabotWebhook', headers={'If-None-Match': etag}
+        ).status_code, 304)
+        result = self.app.get('/teabotWebhook?teapot=kitchen')
+        self.assertEqual(
+            json.loads(result.data)['text'], 'There are 3 cups left')
+        result = self.app.get('/numberOfNewTeapots?teapot=kitchen')
+        self.assertEqual(json.loads(result.data), {'numberOfTeapots': 1})
+        result = self.app.get('/numberOfNewTeapots')
+        self.assertEqual(json.loads(result.data), {'numberOfTeapots': 0})
+
+    @patch.dict("teabot_endpoints.endpoints.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    def test_tea_webhook_from_teapot_room(self):
+        State.create(state="GOOD_TEAPOT", timestamp=datetime.now(),
+                     num_of_cups=1, teapot='kitchen')
+        result = self.app.post(
+            '/teabotWebhook', data={'channel_name': 'kitchen-tea'})
+        self.assertEqual(
+            json.loads(result.data)['text'], 'There is 1 cup left')
+        result = self.app.post(
+            '/teabotWebhook', data={'channel_name': 'random'})
+        self.assertEqual(
+            json.loads(result.data)['text'], 'Theres no teapot data :(')
+
+    @patch.dict("teabot_endpoints.endpoints.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    @patch(
+        "teabot_endpoints.endpoints.slack_communicator_wrapper",
+        auto_spec=True)
+    def test_tea_ready_for_teapot(self, mock_slack):
+        mock_slack.get_message_reaction_count.return_value = 0
+        State.create(state="FULL_TEAPOT", timestamp=datetime.now(),
+                     num_of_cups=2, teapot='kitchen')
+        PotMaker.create(name='bob', number_of_pots_made=1,
+                        total_weight_made=1000, number_of_cups_made=4,
+                        largest_single_pot=1000, mac_address='abc')
+        self.app.post('/flipTeapotRequest?teapot=kitchen',
+                      data=json.dumps({'dash_mac_address': 'abc'}))
+        result = self.app.get('/getNumberOfTeapotRequests?teapot=kitchen')
+        self.assertEqual(json.loads(result.data), {'teaRequests': 1})
+
+        self.app.post("/teaReady?teapot=kitchen")
+        mock_slack.post_message_to_room.assert_any_call(
+            "The Teapot :teapot: is ready with 2 cups", teapot='kitchen')
+        self.assertEqual(
+            PotMaker.get_number_of_teapot_requests('kitchen'), 0)
+
+    def test_responses_are_compact(self):
+        PotMaker.create(name='bob', number_of_pots_made=1,
+                        total_weight_made=1000, number_of_cups_made=4,
+                        largest_single_pot=1000)
+        result = self.app.get('/potMakers')
+        self.assertEqual(result.mimetype, 'application/json')
+        self.assertNotIn('\n', result.data)
+        self.assertNotIn(': ', result.data)
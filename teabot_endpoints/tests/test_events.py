@@ -0,0 +1,114 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database, count_queries
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.events import StateBroadcaster
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from peewee import SqliteDatabase
+from datetime import datetime
+import Queue
+
+test_db = SqliteDatabase(':memory:')
+
+
+class TestStateBroadcaster(TestCase):
+
+    def setUp(self):
+        self.broadcaster = StateBroadcaster()
+        # Poll from the test thread, the in-memory database is per thread
+        self.broadcaster.start = lambda: None
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestStateBroadcaster, self).run(result)
+
+    def _reading(self, state, num_of_cups, weight=1000,
+                 teapot=DEFAULT_TEAPOT):
+        State.create(
+            state=state,
+            timestamp=datetime.now(),
+            num_of_cups=num_of_cups,
+            weight=weight,
+            temperature=80,
+            teapot=teapot
+        )
+
+    def test_poll_no_readings(self):
+        events = self.broadcaster.subscribe()
+        self.assertEqual(self.broadcaster.poll(), {})
+        self.assertTrue(events.empty())
+
+    def test_poll_publishes_to_every_subscriber(self):
+        subscribers = [self.broadcaster.subscribe() for _ in range(3)]
+        self._reading('FULL_TEAPOT', 6)
+        event = self.broadcaster.poll()[DEFAULT_TEAPOT]
+        self.assertEqual(event['state'], 'FULL_TEAPOT')
+        self.assertEqual(event['num_of_cups'], 6)
+        self.assertEqual(self.broadcaster.current_event(), event)
+        for events in subscribers:
+            self.assertEqual(events.get_nowait(), event)
+
+    def test_poll_only_publishes_transitions(self):
+        events = self.broadcaster.subscribe()
+        self._reading('GOOD_TEAPOT', 4, 1200)
+        self.broadcaster.poll()
+        events.get_nowait()
+
+        self._reading('GOOD_TEAPOT', 4, 1190)
+        self.assertEqual(self.broadcaster.poll(), {})
+        self.assertTrue(events.empty())
+        self.assertEqual(self.broadcaster.current_event()['weight'], 1190)
+
+        self._reading('GOOD_TEAPOT', 3, 900)
+        self.broadcaster.poll()
+        self.assertEqual(events.get_nowait()['num_of_cups'], 3)
+
+    def test_poll_without_changes_is_one_query(self):
+        for _ in range(200):
+            self.broadcaster.subscribe()
+        self._reading('GOOD_TEAPOT', 4)
+        self.broadcaster.poll()
+        with count_queries() as counter:
+            self.broadcaster.poll()
+        self.assertEqual(counter.count, 1)
+
+    def test_subscribers_only_get_their_teapot(self):
+        teapot_events = self.broadcaster.subscribe()
+        kitchen_events = self.broadcaster.subscribe('kitchen')
+        self._reading('FULL_TEAPOT', 6, teapot='kitchen')
+        published = self.broadcaster.poll()
+        self.assertEqual(list(published), ['kitchen'])
+        self.assertTrue(teapot_events.empty())
+        self.assertEqual(kitchen_events.get_nowait()['num_of_cups'], 6)
+        self.assertIsNone(self.broadcaster.current_event())
+        self.assertEqual(
+            self.broadcaster.current_event('kitchen')['state'], 'FULL_TEAPOT')
+
+    def test_poll_of_many_teapots_is_one_query(self):
+        teapots = ['teapot%d' % number for number in range(50)]
+        for teapot in teapots:
+            self.broadcaster.subscribe(teapot)
+            self._reading('GOOD_TEAPOT', 4, teapot=teapot)
+        self.assertEqual(len(self.broadcaster.poll()), 50)
+        with count_queries() as counter:
+            self.broadcaster.poll()
+        self.assertEqual(counter.count, 1)
+
+    def test_unsubscribe(self):
+        events = self.broadcaster.subscribe()
+        self.broadcaster.unsubscribe(events)
+        self.assertEqual(self.broadcaster.subscriber_count, 0)
+        self._reading('GOOD_TEAPOT', 4)
+        self.broadcaster.poll()
+        self.assertTrue(events.empty())
+
+    def test_slow_subscriber_drops_oldest_event(self):
+        events = self.broadcaster.subscribe()
+        for number in range(events.maxsize + 1):
+            self.broadcaster.publish({'num_of_cups': number})
+        received = []
+        while True:
+            try:
+                received.append(events.get_nowait()['num_of_cups'])
+            except Queue.Empty:
+                break
+        self.assertEqual(received, range(1, events.maxsize + 1))
@@ -0,0 +1,122 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database
+from teabot_endpoints import metrics
+from teabot_endpoints.metrics import MetricsRegistry, render
+from teabot_endpoints.models import InstrumentedSqliteDatabase, State, MODELS
+from teabot_endpoints.endpoints import app
+from mock import patch
+from datetime import datetime
+import json
+import os
+import shutil
+import tempfile
+
+test_db = InstrumentedSqliteDatabase(':memory:')
+
+
+class TestMetrics(TestCase):
+
+    def run(self, result=None):
+        directory = tempfile.mkdtemp()
+        try:
+            with patch.object(metrics, 'METRICS_DIR', directory), \
+                    patch.object(metrics, 'registry', MetricsRegistry()), \
+                    test_database(test_db, MODELS):
+                self.directory = directory
+                super(TestMetrics, self).run(result)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_render_histogram(self):
+        registry = MetricsRegistry()
+        labels = (('route', '/teaReady'), ('method', 'POST'))
+        for seconds in (0.002, 0.002, 0.3, 20):
+            registry.observe(
+                'teabot_request_duration_seconds', labels, seconds)
+        text = render([registry.snapshot()])
+        prefix = 'teabot_request_duration_seconds_bucket{' \
+            'route="/teaReady",method="POST",le='
+        self.assertIn(prefix + '"0.001"} 0\n', text)
+        self.assertIn(prefix + '"0.0025"} 2\n', text)
+        self.assertIn(prefix + '"0.5"} 3\n', text)
+        self.assertIn(prefix + '"10"} 3\n', text)
+        self.assertIn(prefix + '"+Inf"} 4\n', text)
+        self.assertIn(
+            'teabot_request_duration_seconds_count{route="/teaReady",'
+            'method="POST"} 4\n', text)
+        self.assertIn('# TYPE teabot_request_duration_seconds histogram\n',
+                      text)
+
+    def test_render_counter_escapes_labels(self):
+        registry = MetricsRegistry()
+        registry.inc('teabot_slack_call_errors_total',
+                     (('method', 'say "hi"'),), 2)
+        self.assertIn(
+            'teabot_slack_call_errors_total{method="say \\"hi\\""} 2\n',
+            render([registry.snapshot()]))
+
+    def test_collect_adds_up_workers(self):
+        labels = (('method', 'chat.postMessage'),)
+        metrics.registry.inc('teabot_slack_call_errors_total', labels, 3)
+        other_worker = MetricsRegistry()
+        other_worker.inc('teabot_slack_call_errors_total', labels, 4)
+        with open(os.path.join(self.directory, '1.json'), 'w') as snapshot:
+            json.dump(other_worker.snapshot(), snapshot)
+        # This worker's own snapshot is stale, the live values are used
+        metrics.flush()
+        metrics.registry.inc('teabot_slack_call_errors_total', labels)
+
+        self.assertIn(
+            'teabot_slack_call_errors_total{method="chat.postMessage"} 8\n',
+            metrics.collect())
+
+    def test_request_metrics(self):
+        State.create(state='GOOD_TEAPOT', timestamp=datetime.now(),
+                     num_of_cups=2)
+        client = app.test_client()
+        client.get('/numberOfNewTeapots')
+        client.get('/doesNotExist')
+
+        text = client.get('/metrics').data
+        self.assertIn(
+            'teabot_requests_total{route="/numberOfNewTeapots",method="GET",'
+            'status="200"} 1\n', text)
+        self.assertIn(
+            'teabot_requests_total{route="unmatched",method="GET",'
+            'status="404"} 1\n', text)
+        # One query for the version stamp and one for the counter
+        self.assertIn(
+            'teabot_request_db_queries_bucket{route="/numberOfNewTeapots",'
+            'method="GET",le="1"} 0\n', text)
+        self.assertIn(
+            'teabot_request_db_queries_bucket{route="/numberOfNewTeapots",'
+            'method="GET",le="2"} 1\n', text)
+
+    def test_queries_outside_requests_are_only_totalled(self):
+        State.create(state='GOOD_TEAPOT', timestamp=datetime.now(),
+                     num_of_cups=2)
+        text = render([metrics.registry.snapshot()])
+        self.assertNotIn('teabot_request_db_queries_count', text)
+        self.assertIn('\nteabot_db_queries_total ', text)
+
+    def test_state_compression_ratio(self):
+        self.assertNotIn('\nteabot_state_compression_ratio ',
+                         render([metrics.registry.snapshot()]))
+        for stored in (True, False, False, False, True):
+            metrics.record_state_reading(stored)
+        text = render([metrics.registry.snapshot()])
+        self.assertIn(
+            'teabot_state_readings_total{outcome="repeat"} 3\n', text)
+        self.assertIn('\nteabot_state_compression_ratio 2.5\n', text)
+
+    def test_slack_call_errors(self):
+        with self.assertRaises(ValueError):
+            with metrics.slack_call('chat.postMessage'):
+                raise ValueError()
+        text = render([metrics.registry.snapshot()])
+        self.assertIn(
+            'teabot_slack_call_errors_total{method="chat.postMessage"} 1\n',
+            text)
+        self.assertIn(
+            'teabot_slack_call_duration_seconds_count'
+            '{method="chat.postMessage"} 1\n', text)
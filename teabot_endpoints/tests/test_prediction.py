@@ -0,0 +1,263 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database, count_queries
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints.prediction import RollingLinearFit, TeapotForecast, \
+    Forecaster
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from teabot_endpoints.tests.pot_trace import pot_readings
+from peewee import SqliteDatabase
+from datetime import datetime, timedelta
+import random
+
+test_db = SqliteDatabase(':memory:')
+
+START = datetime(2017, 1, 1, 9)
+
+
+def _reading(minutes, state='GOOD_TEAPOT', weight=1400, temperature=80):
+    return {
+        'state': state,
+        'timestamp': START + timedelta(minutes=minutes),
+        'num_of_cups': 4,
+        'weight': weight,
+        'temperature': temperature
+    }
+
+
+class TestRollingLinearFit(TestCase):
+
+    def test_line(self):
+        fit = RollingLinearFit(100)
+        for x in range(10):
+            fit.add(1000000 + x, 7 - 2 * x)
+        slope, intercept, slope_error = fit.line()
+        self.assertAlmostEqual(slope, -2)
+        self.assertAlmostEqual(intercept, 7 + 2 * 1000000)
+        self.assertAlmostEqual(slope_error, 0)
+        self.assertAlmostEqual(fit.solve(-13), 1000010)
+
+    def test_too_few_points(self):
+        fit = RollingLinearFit(100)
+        fit.add(0, 1)
+        fit.add(1, 0)
+        self.assertIsNone(fit.line())
+        self.assertIsNone(fit.solve(0))
+
+    def test_points_expire(self):
+        fit = RollingLinearFit(10)
+        for x in range(10):
+            fit.add(x, 100 + x)
+        for x in range(10, 30):
+            fit.add(x, 100 - x)
+        self.assertEqual(len(fit), 11)
+        self.assertAlmostEqual(fit.line()[0], -1)
+
+    def test_older_points_ignored(self):
+        fit = RollingLinearFit(10)
+        self.assertTrue(fit.add(5, 1))
+        self.assertFalse(fit.add(4, 1))
+        self.assertEqual(len(fit), 1)
+
+    def test_level_noise_not_followed(self):
+        rand = random.Random(0)
+        fit = RollingLinearFit(1000)
+        for x in range(100):
+            fit.add(x, 1000 + rand.uniform(-5, 5))
+        self.assertIsNone(fit.solve(400))
+
+    def test_rising_line_never_falls(self):
+        fit = RollingLinearFit(100)
+        for x in range(10):
+            fit.add(x, x)
+        self.assertIsNone(fit.solve(-5))
+
+    def test_matches_full_refit_after_a_long_run(self):
+        rand = random.Random(0)
+        fit = RollingLinearFit(600)
+        points = []
+        for x in range(0, 3 * 24 * 3600, 10):
+            y = 2000 - x * 0.01 + rand.uniform(-5, 5)
+            fit.add(x, y)
+            points.append((x, y))
+
+        window = [point for point in points if point[0] >= x - 600]
+        mean_x = sum(px for px, _ in window) / float(len(window))
+        mean_y = sum(py for _, py in window) / len(window)
+        slope = sum((px - mean_x) * (py - mean_y) for px, py in window) / \
+            sum((px - mean_x) ** 2 for px, _ in window)
+        self.assertEqual(len(fit), len(window))
+        self.assertAlmostEqual(fit.line()[0], slope, places=9)
+
+
+class TestTeapotForecast(TestCase):
+
+    def _observe(self, forecast, reading):
+        forecast.observe(reading['timestamp'], reading['state'],
+                         reading['weight'], reading['temperature'])
+
+    def test_predicts_empty(self):
+        forecast = TeapotForecast(window=3600, empty_weight=400)
+        for minute in range(0, 10):
+            self._observe(
+                forecast, _reading(minute, weight=1400 - 50 * minute))
+        prediction = forecast.predict()
+        self.assertEqual(prediction.empty_at, START + timedelta(minutes=20))
+        self.assertAlmostEqual(prediction.weight_per_minute, -50)
+
+    def test_predicts_cold(self):
+        forecast = TeapotForecast(
+            window=3600, cold_temperature=50, room_temperature=20)
+        # Halves its distance from room temperature every ten minutes
+        for minute in range(0, 10):
+            self._observe(forecast, _reading(
+                minute, temperature=20 + 80 * 0.5 ** (minute / 10.0)))
+        prediction = forecast.predict()
+        # 80 to 30 degrees above room temperature
+        self.assertAlmostEqual(
+            (prediction.cold_at - START).total_seconds() / 60,
+            10 * 1.415, places=1)
+        self.assertLess(prediction.temperature_per_minute, 0)
+
+    def test_new_pot_starts_again(self):
+        forecast = TeapotForecast(window=3600)
+        for minute in range(0, 10):
+            self._observe(
+                forecast, _reading(minute, weight=1400 - 50 * minute))
+        self._observe(forecast, _reading(11, state='FULL_TEAPOT'))
+        self.assertIsNone(forecast.predict().empty_at)
+        self.assertEqual(len(forecast.weight), 1)
+
+    def test_empty_and_cold_reported_by_teapot(self):
+        forecast = TeapotForecast(window=3600, cold_temperature=50)
+        self._observe(forecast, _reading(0, state='FULL_TEAPOT'))
+        self._observe(forecast, _reading(1, temperature=60))
+        self._observe(forecast, _reading(2, state='COLD_TEAPOT',
+                                         temperature=55))
+        self._observe(forecast, _reading(3, state='COLD_TEAPOT',
+                                         temperature=53))
+        self.assertEqual(forecast.cold_temperature, 55)
+        self.assertEqual(forecast.predict().cold_at,
+                         START + timedelta(minutes=2))
+
+        self._observe(forecast, _reading(4, state='EMPTY_TEAPOT',
+                                         weight=420))
+        self._observe(forecast, _reading(5, state='EMPTY_TEAPOT',
+                                         weight=410))
+        self.assertEqual(forecast.empty_weight, 420)
+        self.assertEqual(forecast.predict().empty_at,
+                         START + timedelta(minutes=4))
+
+    def test_unknown_weight_and_older_readings_ignored(self):
+        forecast = TeapotForecast(window=3600)
+        self._observe(forecast, _reading(5))
+        self._observe(forecast, _reading(6, weight=-1))
+        self._observe(forecast, _reading(4))
+        self.assertEqual(len(forecast.weight), 1)
+        self.assertEqual(len(forecast.temperature), 2)
+        self.assertEqual(forecast.timestamp, START + timedelta(minutes=6))
+
+
+class TestForecaster(TestCase):
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestForecaster, self).run(result)
+
+    def _store(self, start, count, step=timedelta(seconds=10),
+               teapot=DEFAULT_TEAPOT):
+        State.record_readings([
+            dict(_reading(0, weight=2000 - number * 10),
+                 timestamp=start + step * number, teapot=teapot)
+            for number in range(count)
+        ])
+
+    def test_no_readings(self):
+        self.assertIsNone(Forecaster().predict().empty_at)
+
+    def test_reads_each_reading_once(self):
+        forecaster = Forecaster(window=3600)
+        self._store(START, 10)
+        self.assertEqual(forecaster.catch_up(), 10)
+        self.assertEqual(forecaster.catch_up(), 0)
+        self._store(START + timedelta(minutes=5), 3)
+        self.assertEqual(forecaster.catch_up(), 3)
+        self.assertEqual(len(forecaster.forecast.weight), 13)
+
+    def test_reads_only_its_teapot(self):
+        forecaster = Forecaster(window=3600, teapot='kitchen')
+        self._store(START, 10)
+        self.assertEqual(forecaster.catch_up(), 0)
+        self._store(START, 5, teapot='kitchen')
+        self.assertEqual(forecaster.catch_up(), 5)
+        self._store(START + timedelta(minutes=5), 10)
+        self.assertEqual(forecaster.catch_up(), 0)
+        self.assertEqual(len(forecaster.forecast.weight), 5)
+
+    def test_starts_from_window(self):
+        forecaster = Forecaster(window=600)
+        self._store(START, 1000)
+        self.assertEqual(forecaster.catch_up(), 61)
+
+        # Having fallen more than the window behind
+        self._store(START + timedelta(days=1), 100)
+        self.assertEqual(forecaster.catch_up(), 61)
+
+    def test_cost_does_not_grow_with_history(self):
+        forecaster = Forecaster(window=600)
+        self._store(START, 5000)
+        forecaster.predict()
+
+        with count_queries() as counter:
+            forecaster.predict()
+        self.assertEqual(counter.count, 1)
+
+        State.record_reading(dict(
+            _reading(0, weight=100), timestamp=START + timedelta(days=1)))
+        with count_queries() as counter:
+            forecaster.predict()
+        # The stamp, the newest reading through its cache and the new rows
+        self.assertLessEqual(counter.count, 4)
+
+        State.record_reading(dict(
+            _reading(0, weight=50),
+            timestamp=START + timedelta(days=1, seconds=10)))
+        self.assertEqual(forecaster.catch_up(), 1)
+
+    def test_accuracy_on_simulated_pots(self):
+        """Replays simulated pots through storage, predicting every five
+        minutes. Pours are random, so even knowing the rate they're poured at
+        leaves predictions of the empty pot a third out; the teapot is asked
+        to do about as well as that.
+        """
+        forecaster = Forecaster(window=1800)
+        start = START
+        empty_errors = []
+        cold_errors = []
+        checks = 0
+        for seed_value in range(10):
+            readings = list(pot_readings(
+                start, cups=4 + seed_value % 5, seed_value=seed_value))
+            empty_at = readings[-1]['timestamp']
+            cold_at = next((reading['timestamp'] for reading in readings
+                            if reading['state'] == 'COLD_TEAPOT'), None)
+            for number, reading in enumerate(readings):
+                State.record_reading(reading)
+                if number % 30 or reading['state'] != 'GOOD_TEAPOT':
+                    continue
+                checks += 1
+                prediction = forecaster.predict()
+                if prediction.empty_at is not None:
+                    empty_errors.append(
+                        abs((prediction.empty_at - empty_at).total_seconds()) /
+                        (empty_at - reading['timestamp']).total_seconds())
+                if cold_at is not None and prediction.cold_at is not None:
+                    cold_errors.append(
+                        abs((prediction.cold_at - cold_at).total_seconds()))
+            start = empty_at + timedelta(minutes=30)
+
+        empty_errors.sort()
+        cold_errors.sort()
+        self.assertGreater(len(empty_errors), checks * 0.6)
+        self.assertLess(empty_errors[len(empty_errors) // 2], 0.75)
+        self.assertLess(cold_errors[len(cold_errors) // 2], 3 * 60)
+        self.assertLess(cold_errors[-1], 10 * 60)
@@ -0,0 +1,152 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database
+from teabot_endpoints.models import State, PotMaker, SlackMessages, MODELS
+from teabot_endpoints.tests.query_plans import full_table_scans
+from peewee import SqliteDatabase
+from datetime import datetime
+
+test_db = SqliteDatabase(':memory:')
+
+# Arguments to call each model classmethod with
+CALLS = {
+    'PotMaker.get_all': (),
+    'PotMaker.iter_records': (),
+    'PotMaker.get_record': ('aaron',),
+    'PotMaker.get_record_by_mac_address': ('123',),
+    'PotMaker.get_leaderboard': (
+        'number_of_pots_made', 'WEEK', datetime(2016, 1, 1), False),
+    'PotMaker.get_single_pot_maker': ('aaron',),
+    'PotMaker.flip_requested_teapot': ('123',),
+    'PotMaker.flip_requested_teapots': (['123', '456'],),
+    'PotMaker.get_single_pot_maker_by_mac_address': ('123',),
+    'PotMaker.get_number_of_teapot_requests': (),
+    'PotMaker.reset_teapot_requests': (),
+    'State.get_newest_state': (),
+    'State._query_newest_state': (),
+    'State.get_newest_state_record': (),
+    'State._query_newest_state_record': (),
+    'State._buffered_reading': (None,),
+    'State.store_states': ([{
+        'state': 'FULL_TEAPOT',
+        'timestamp': datetime(2017, 1, 1),
+        'num_of_cups': 3
+    }],),
+    'State.record_reading': ({
+        'state': 'GOOD_TEAPOT',
+        'timestamp': datetime(2016, 1, 1, 0, 1),
+        'num_of_cups': 3
+    },),
+    'State.record_readings': ([{
+        'state': 'GOOD_TEAPOT',
+        'timestamp': datetime(2016, 1, 1, 0, 1),
+        'num_of_cups': 3
+    }, {
+        'state': 'GOOD_TEAPOT',
+        'timestamp': datetime(2016, 1, 1, 0, 2),
+        'num_of_cups': 2
+    }],),
+    'State._record_teapot_readings': ('kitchen', [{
+        'state': 'GOOD_TEAPOT',
+        'timestamp': datetime(2016, 1, 1, 0, 1),
+        'num_of_cups': 3
+    }]),
+    'State.claim_latest_full_teapot': (PotMaker(id=1),),
+    'State.get_number_of_new_teapots': (),
+    'State.backfill_counters': (),
+    'State.get_latest_full_teapot': (),
+    'State._query_latest_full_teapot': (),
+    'State.get_latest_full_teapot_record': (),
+    'State._query_latest_full_teapot_record': (),
+    'SlackMessages.store_message_details': ('1234.5', 'C1234'),
+    'SlackMessages.get_reaction_message_details': (),
+    'SlackMessages.clear_slack_message': (),
+    'DataVersion.bump': ('state',),
+    'DataVersion.get_stamp': ('state',),
+    'DataVersion.get_stamps': (['state', 'state:kitchen'],),
+    'Counter.increment': ('new_teapots',),
+    'Counter.set_value': ('new_teapots', 1),
+    'Counter.get_value': ('new_teapots',),
+    'SlackOutbox.enqueue': ('The tea is ready',),
+    'SlackOutbox.claim_next_message': (60,),
+    'ReactionCount.get_cached': ('C1234', '1234.5'),
+    'ReactionCount.claim_refresh': ('C1234', '1234.5', 30),
+    'ReactionCount.store_count': ('C1234', '1234.5', 3),
+    'StateRollup.get_latest_bucket': ('hour',),
+    'PotMakerStats.record_pot': (1, datetime(2016, 1, 1), 1200, 4),
+    'PotMakerStats.rebuild': (),
+    'WriteBehindSegment.store': ('segment', [{
+        'state': 'GOOD_TEAPOT',
+        'timestamp': datetime(2016, 1, 1, 0, 1),
+        'num_of_cups': 3
+    }]),
+    'WriteBehindSegment.forget': ('segment',),
+}
+
+# Classmethods that are expected to read a whole table
+ALLOWED_SCANS = {
+    # Returns every pot maker
+    'PotMaker.get_all': ['potmaker'],
+    'PotMaker.iter_records': ['potmaker'],
+    # Reads every teapot's claimed pots, run once by hand
+    'PotMakerStats.rebuild': ['state'],
+}
+
+
+def _model_classmethods():
+    names = []
+    for model in MODELS:
+        for name, attribute in vars(model).items():
+            if isinstance(attribute, classmethod):
+                names.append('%s.%s' % (model.__name__, name))
+    return names
+
+
+class TestQueryPlans(TestCase):
+    """Runs every model classmethod and checks that none of the queries they
+    issue scan a whole table
+    """
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestQueryPlans, self).run(result)
+
+    def setUp(self):
+        PotMaker.create(
+            name='aaron',
+            number_of_pots_made=1,
+            total_weight_made=12,
+            number_of_cups_made=5,
+            largest_single_pot=2,
+            mac_address='123'
+        )
+        State.create(
+            state="FULL_TEAPOT",
+            timestamp=datetime(2016, 1, 1),
+            num_of_cups=3
+        )
+        SlackMessages.create(timestamp='1234.5', channel='C1234')
+
+    def test_every_classmethod_is_checked(self):
+        self.assertEqual(sorted(_model_classmethods()), sorted(CALLS))
+
+    def test_all_time_leaderboard(self):
+        for include_inactive in (True, False):
+            self.assertEqual(full_table_scans(
+                test_db, PotMaker.get_leaderboard, 'largest_single_pot',
+                include_inactive=include_inactive
+            ), [])
+
+    def test_no_full_table_scans(self):
+        models = dict((model.__name__, model) for model in MODELS)
+        unexpected = {}
+        for name, args in CALLS.items():
+            model_name, method_name = name.split('.')
+            method = getattr(models[model_name], method_name)
+            scans = [
+                (sql, table)
+                for sql, table in full_table_scans(test_db, method, *args)
+                if table not in ALLOWED_SCANS.get(name, [])
+            ]
+            if scans:
+                unexpected[name] = scans
+        self.assertEqual(unexpected, {})
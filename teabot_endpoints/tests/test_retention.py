@@ -0,0 +1,207 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database
+from teabot_endpoints.models import State, StateRollup, DataVersion, \
+    MODELS, STATE_HISTORY_VERSION
+from teabot_endpoints.retention import roll_up_next_hour, \
+    prune_raw_readings, run_retention, raw_readings_cutoff
+from teabot_endpoints.tests.query_plans import full_table_scans
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from peewee import SqliteDatabase
+from mock import patch
+from datetime import datetime, timedelta
+
+test_db = SqliteDatabase(':memory:')
+
+
+class TestRetention(TestCase):
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestRetention, self).run(result)
+
+    def _reading(self, timestamp, state, weight, temperature=80,
+                 teapot=DEFAULT_TEAPOT):
+        State.create(
+            state=state,
+            timestamp=timestamp,
+            num_of_cups=4,
+            weight=weight,
+            temperature=temperature,
+            teapot=teapot
+        )
+
+    def _create_history(self):
+        self._reading(datetime(2017, 1, 1, 9, 0, 10), 'FULL_TEAPOT', 1500, 90)
+        self._reading(datetime(2017, 1, 1, 9, 0, 40), 'GOOD_TEAPOT', 1400, 86)
+        self._reading(datetime(2017, 1, 1, 9, 1, 5), 'GOOD_TEAPOT', 1200, 82)
+        self._reading(datetime(2017, 1, 1, 9, 30, 0), 'COLD_TEAPOT', 1100, 40)
+        self._reading(datetime(2017, 1, 1, 11, 15, 0), 'EMPTY_TEAPOT', 300)
+        self._reading(datetime(2017, 1, 1, 12, 5, 0), 'EMPTY_TEAPOT', 300)
+
+    def test_roll_up_next_hour(self):
+        self._create_history()
+        now = datetime(2017, 1, 1, 12, 10)
+        self.assertEqual(roll_up_next_hour(now), datetime(2017, 1, 1, 9))
+
+        hour = StateRollup.get(StateRollup.period == StateRollup.HOUR)
+        self.assertEqual(hour.bucket, datetime(2017, 1, 1, 9))
+        self.assertEqual(hour.readings, 4)
+        self.assertEqual(hour.min_weight, 1100)
+        self.assertEqual(hour.max_weight, 1500)
+        self.assertEqual(hour.avg_weight, 1300)
+        self.assertEqual(hour.min_temperature, 40)
+        self.assertEqual(hour.first_state, 'FULL_TEAPOT')
+        self.assertEqual(hour.last_state, 'COLD_TEAPOT')
+        self.assertEqual(hour.transitions, 2)
+
+        minutes = list(StateRollup.select().where(
+            StateRollup.period == StateRollup.MINUTE
+        ).order_by(StateRollup.bucket))
+        self.assertEqual(
+            [m.bucket.minute for m in minutes], [0, 1, 30])
+        self.assertEqual([m.readings for m in minutes], [2, 1, 1])
+        self.assertEqual([m.transitions for m in minutes], [1, 0, 1])
+        self.assertEqual(minutes[0].avg_weight, 1450)
+
+        # Empty hours are skipped and the unfinished hour is left alone
+        self.assertEqual(roll_up_next_hour(now), datetime(2017, 1, 1, 11))
+        eleven = StateRollup.get(
+            StateRollup.period == StateRollup.HOUR,
+            StateRollup.bucket == datetime(2017, 1, 1, 11))
+        self.assertEqual(eleven.transitions, 1)
+        self.assertIsNone(roll_up_next_hour(now))
+
+    def test_roll_up_each_teapot(self):
+        self._create_history()
+        self._reading(datetime(2017, 1, 1, 9, 0, 20), 'FULL_TEAPOT', 1600,
+                      teapot='kitchen')
+        self._reading(datetime(2017, 1, 1, 10, 0, 20), 'COLD_TEAPOT', 1500,
+                      teapot='kitchen')
+        now = datetime(2017, 1, 1, 12, 10)
+        roll_up_next_hour(now)
+        roll_up_next_hour(now)
+
+        hours = dict(
+            ((hour.teapot, hour.bucket.hour), hour)
+            for hour in StateRollup.select().where(
+                StateRollup.period == StateRollup.HOUR))
+        self.assertEqual(sorted(hours), sorted([
+            (DEFAULT_TEAPOT, 9), ('kitchen', 9), ('kitchen', 10)]))
+        self.assertEqual(hours[DEFAULT_TEAPOT, 9].readings, 4)
+        self.assertEqual(hours['kitchen', 9].max_weight, 1600)
+        # The state before the hour is the teapot's own
+        self.assertEqual(hours['kitchen', 10].transitions, 1)
+
+    def test_roll_up_late_readings_again(self):
+        self._create_history()
+        now = datetime(2017, 1, 1, 12, 10)
+        while roll_up_next_hour(now):
+            pass
+        # e.g. replayed from a write-behind log after a restart
+        self._reading(datetime(2017, 1, 1, 9, 45), 'EMPTY_TEAPOT', 300)
+        self._reading(datetime(2017, 1, 1, 10, 5), 'EMPTY_TEAPOT', 300)
+
+        self.assertEqual(roll_up_next_hour(now), datetime(2017, 1, 1, 9))
+        hours = dict(
+            (hour.bucket.hour, hour) for hour in StateRollup.select().where(
+                StateRollup.period == StateRollup.HOUR))
+        self.assertEqual(sorted(hours), [9, 10, 11])
+        self.assertEqual(hours[9].readings, 5)
+        self.assertEqual(hours[9].last_state, 'EMPTY_TEAPOT')
+        self.assertEqual(hours[10].readings, 1)
+        self.assertEqual(StateRollup.select().where(
+            StateRollup.period == StateRollup.MINUTE,
+            StateRollup.bucket == datetime(2017, 1, 1, 9, 45)).count(), 1)
+        self.assertIsNone(roll_up_next_hour(now))
+
+    def test_late_readings_not_pruned_before_roll_up(self):
+        self._create_history()
+        now = datetime(2017, 1, 1, 12, 10)
+        while roll_up_next_hour(now):
+            pass
+        self._reading(datetime(2017, 1, 1, 9, 45), 'EMPTY_TEAPOT', 300)
+        self.assertEqual(prune_raw_readings(datetime(2017, 1, 2)), 4)
+        self.assertEqual(State.select().where(
+            State.timestamp == datetime(2017, 1, 1, 9, 45)).count(), 1)
+
+    @patch("teabot_endpoints.retention.RETENTION_RAW_DAYS", 1)
+    def test_pruned_hours_not_rolled_up_again(self):
+        self._create_history()
+        roll_up_next_hour(datetime(2017, 1, 1, 10))
+        self.assertEqual(prune_raw_readings(datetime(2017, 1, 1, 10)), 3)
+        self._reading(datetime(2017, 1, 1, 9, 45), 'EMPTY_TEAPOT', 300)
+        self.assertEqual(
+            roll_up_next_hour(datetime(2017, 1, 3)), datetime(2017, 1, 1, 11))
+        nine = StateRollup.get(
+            StateRollup.period == StateRollup.HOUR,
+            StateRollup.bucket == datetime(2017, 1, 1, 9))
+        self.assertEqual(nine.readings, 4)
+
+    @patch("teabot_endpoints.retention.STATE_INSERT_BATCH_SIZE", 2)
+    def test_roll_up_in_batches(self):
+        for teapot in ['office%d' % number for number in range(5)]:
+            self._reading(datetime(2017, 1, 1, 9, 0, 10), 'FULL_TEAPOT', 1500,
+                          teapot=teapot)
+        roll_up_next_hour(datetime(2017, 1, 1, 12))
+        self.assertEqual(StateRollup.select().count(), 10)
+
+    @patch.dict("teabot_endpoints.retention.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    def test_prune_keeps_newest_reading_of_each_teapot(self):
+        self._create_history()
+        self._reading(datetime(2017, 1, 1, 9, 0, 20), 'GOOD_TEAPOT', 1600,
+                      teapot='kitchen')
+        kitchen = State.get_newest_state_record('kitchen').id
+        roll_up_next_hour(datetime(2017, 1, 1, 10))
+        self.assertEqual(prune_raw_readings(datetime(2017, 1, 2)), 3)
+        self.assertEqual(State.get_newest_state_record('kitchen').id, kitchen)
+
+    def test_prune_only_rolled_up_readings(self):
+        self._create_history()
+        cutoff = datetime(2017, 1, 2)
+        self.assertEqual(prune_raw_readings(cutoff), 0)
+        roll_up_next_hour(datetime(2017, 1, 1, 10))
+        self.assertEqual(prune_raw_readings(cutoff), 3)
+        self.assertEqual(State.select().count(), 3)
+
+    def test_prune_bumps_state_history_version(self):
+        self._create_history()
+        roll_up_next_hour(datetime(2017, 1, 1, 10))
+        stamp = DataVersion.get_stamp(STATE_HISTORY_VERSION)
+        prune_raw_readings(datetime(2017, 1, 2))
+        pruned = DataVersion.get_stamp(STATE_HISTORY_VERSION)
+        self.assertNotEqual(pruned, stamp)
+        prune_raw_readings(datetime(2017, 1, 2))
+        self.assertEqual(
+            DataVersion.get_stamp(STATE_HISTORY_VERSION), pruned)
+
+    @patch("teabot_endpoints.retention.RETENTION_RAW_DAYS", 30)
+    def test_raw_readings_cutoff_moves_an_hour_at_a_time(self):
+        self.assertEqual(
+            raw_readings_cutoff(datetime(2017, 2, 1, 9, 59)),
+            datetime(2017, 1, 2, 9))
+
+    @patch("teabot_endpoints.retention.BATCH_PAUSE", 0)
+    @patch("teabot_endpoints.retention.RETENTION_BATCH_SIZE", 2)
+    def test_run_retention_keeps_model_answers(self):
+        self._create_history()
+        newest = State.get_newest_state().id
+        latest_full = State.get_latest_full_teapot().id
+        new_teapots = State.get_number_of_new_teapots()
+
+        now = datetime(2017, 1, 1, 12, 10) + timedelta(days=30)
+        self.assertEqual(run_retention(now), (3, 4))
+
+        self.assertEqual(State.get_newest_state().id, newest)
+        self.assertEqual(State.get_latest_full_teapot().id, latest_full)
+        self.assertEqual(State.get_number_of_new_teapots(), new_teapots)
+        self.assertEqual(State.backfill_counters(), new_teapots)
+        self.assertEqual(run_retention(now), (0, 0))
+
+    def test_no_full_table_scans(self):
+        self._create_history()
+        now = datetime(2017, 3, 1)
+        self.assertEqual(
+            full_table_scans(test_db, roll_up_next_hour, now), [])
+        self.assertEqual(
+            full_table_scans(test_db, prune_raw_readings, now), [])
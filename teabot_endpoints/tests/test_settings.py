@@ -0,0 +1,21 @@
+from unittest import TestCase
+from teabot_endpoints.settings import parse_teapot_rooms
+
+
+class TestSettings(TestCase):
+
+    def test_parse_teapot_rooms(self):
+        self.assertEqual(parse_teapot_rooms(''), [])
+        self.assertEqual(
+            parse_teapot_rooms(' kitchen = #kitchen-tea,,london=#tea-ldn, '),
+            [('kitchen', '#kitchen-tea'), ('london', '#tea-ldn')])
+
+    def test_parse_teapot_rooms_rejects_bad_entries(self):
+        for value, entry in [
+                ('kitchen=#kitchen-tea,london', 'london'),
+                ('kitchen=', 'kitchen='),
+                ('kitchen= ,london=#tea-ldn', 'kitchen='),
+                ('=#tea-ldn', '=#tea-ldn')]:
+            with self.assertRaises(ValueError) as context:
+                parse_teapot_rooms(value)
+            self.assertIn(repr(entry), str(context.exception))
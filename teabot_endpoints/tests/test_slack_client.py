@@ -0,0 +1,167 @@
+from unittest import TestCase
+from benchmarks.fake_slack import FakeSlackServer
+from teabot_endpoints.slack_client import SlackClient, SlackError, \
+    SlackRateLimited, TokenBucket
+import threading
+import time
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(2, 3, clock=self.clock,
+                                  sleep=self.clock.sleep)
+
+    def test_burst_then_rate(self):
+        for _ in range(4):
+            self.assertTrue(self.bucket.acquire())
+        self.assertEqual(self.clock.slept, [0.5])
+        self.assertTrue(self.bucket.acquire())
+        self.assertEqual(self.clock.slept, [0.5, 0.5])
+
+    def test_refills_up_to_capacity(self):
+        for _ in range(3):
+            self.bucket.acquire()
+        self.clock.now += 60
+        for _ in range(3):
+            self.bucket.acquire()
+        self.assertEqual(self.clock.slept, [])
+
+    def test_pause(self):
+        self.bucket.pause(10)
+        self.assertEqual(self.bucket.paused_for(), 10)
+        self.assertTrue(self.bucket.acquire())
+        self.assertEqual(self.clock.slept, [10])
+        # A single call when the pause ends, then the rate applies
+        self.assertTrue(self.bucket.acquire())
+        self.assertEqual(self.clock.slept, [10, 0.5])
+
+    def test_max_wait(self):
+        self.bucket.pause(10)
+        self.assertFalse(self.bucket.acquire(max_wait=5))
+        self.assertEqual(self.clock.slept, [])
+        self.assertTrue(self.bucket.acquire(max_wait=10))
+
+
+class TestSlackClient(TestCase):
+
+    def setUp(self):
+        self.server = FakeSlackServer().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = SlackClient('xoxb-test', base_url=self.server.url,
+                                  rate=100, burst=100, max_wait=1)
+        self.addCleanup(self.client.session.close)
+
+    def test_post_message(self):
+        response = self.client.post_message(
+            '#teapot', 'The tea is ready', icon_emoji=':teapot:')
+        self.assertEqual(response['channel'], 'C0TEAPOT')
+        self.assertIn('ts', response)
+
+    def test_connections_reused(self):
+        for _ in range(5):
+            self.client.post_message('#teapot', 'The tea is ready')
+            self.client.get_reactions('C0TEAPOT', '1234.5')
+        self.assertEqual(self.server.calls, {
+            'chat.postMessage': 5, 'reactions.get': 5})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_error(self):
+        with self.assertRaises(SlackError) as context:
+            self.client.call('chat.unknown')
+        self.assertEqual(str(context.exception), 'unknown_method')
+
+    def test_rate_limited_retries_after_retry_after(self):
+        self.server.rate_limit('chat.postMessage', 2, '0.1')
+        start = time.time()
+        self.client.post_message('#teapot', 'The tea is ready')
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(self.server.calls['chat.postMessage'], 3)
+
+    def test_rate_limited_for_too_long(self):
+        self.server.rate_limit('chat.postMessage', 1, '30')
+        with self.assertRaises(SlackRateLimited) as context:
+            self.client.post_message('#teapot', 'The tea is ready')
+        self.assertGreater(context.exception.retry_after, 29)
+        # Slack isn't called again until the Retry-After has passed
+        with self.assertRaises(SlackRateLimited):
+            self.client.post_message('#teapot', 'The tea is ready')
+        self.assertEqual(self.server.calls['chat.postMessage'], 1)
+        # Other methods have their own limit
+        self.client.get_reactions('C0TEAPOT', '1234.5')
+
+    def test_rate_limited_retries_exhausted(self):
+        self.client.retries = 1
+        self.server.rate_limit('chat.postMessage', 2, '0')
+        with self.assertRaises(SlackRateLimited):
+            self.client.post_message('#teapot', 'The tea is ready')
+        self.assertEqual(self.server.calls['chat.postMessage'], 2)
+
+    def test_concurrent_reactions_calls_coalesced(self):
+        self.server.latency = 0.2
+        results = []
+
+        def fetch():
+            results.append(self.client.get_reactions('C0TEAPOT', '1234.5'))
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.calls['reactions.get'], 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result == results[0] for result in results))
+
+        # Later calls go to Slack again
+        self.server.latency = 0
+        self.client.get_reactions('C0TEAPOT', '1234.5')
+        self.assertEqual(self.server.calls['reactions.get'], 2)
+
+    def test_coalesced_error_shared(self):
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait()
+            raise SlackError('timeout')
+
+        def wait():
+            try:
+                self.client.coalesced('key', lambda: 'not called')
+            except SlackError as e:
+                errors.append(e)
+
+        def lead():
+            try:
+                self.client.coalesced('key', fail)
+            except SlackError as e:
+                errors.append(e)
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=wait)
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual([str(e) for e in errors], ['timeout', 'timeout'])
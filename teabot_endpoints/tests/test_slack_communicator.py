@@ -0,0 +1,268 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database
+from teabot_endpoints.models import SlackMessages, SlackOutbox, \
+    ReactionCount, MODELS
+from teabot_endpoints.slack_communicator import SlackCommunicator
+from teabot_endpoints.slack_client import SlackError, SlackRateLimited
+from peewee import SqliteDatabase
+from mock import patch
+from datetime import datetime, timedelta
+
+test_db = SqliteDatabase(':memory:')
+# Runs reaction count refreshes in the test's thread, which can see the
+# in-memory test database
+refresh_inline = patch.object(
+    SlackCommunicator, '_refresh_in_background',
+    SlackCommunicator._try_refresh_reaction_count)
+
+
+class TestSlackCommunicator(TestCase):
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestSlackCommunicator, self).run(result)
+
+    def setUp(self):
+        patcher = patch("teabot_endpoints.slack_communicator.SlackClient")
+        self.mock_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.slack = self.mock_client.return_value
+        self.slack.post_message.return_value = {
+            'ok': True, 'ts': '1234.5', 'channel': 'C1234'}
+        self.communicator = SlackCommunicator()
+
+    def test_slack_client_built_on_first_use(self):
+        self.assertFalse(self.mock_client.called)
+        self.assertIs(self.communicator.slack, self.slack)
+        self.assertIs(self.communicator.slack, self.slack)
+        self.assertEqual(self.mock_client.call_count, 1)
+
+    def test_post_message_to_room_queues_message(self):
+        self.communicator.post_message_to_room("The tea is ready")
+        self.assertFalse(self.slack.post_message.called)
+        message = SlackOutbox.get()
+        self.assertEqual(message.message, "The tea is ready")
+        self.assertEqual(message.status, SlackOutbox.PENDING)
+
+    def test_deliver_next_message_in_order(self):
+        self.communicator.post_message_to_room("first")
+        self.communicator.post_message_to_room("second", True)
+
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.slack.post_message.assert_called_with(
+            "#teapot", "first", icon_emoji=":teapot:")
+        self.assertIsNone(SlackMessages.get_reaction_message_details())
+
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.slack.post_message.assert_called_with(
+            "#teapot", "second", icon_emoji=":teapot:")
+        reaction_message = SlackMessages.get_reaction_message_details()
+        self.assertEqual(reaction_message.timestamp, '1234.5')
+        self.assertEqual(reaction_message.channel, 'C1234')
+
+        self.assertFalse(self.communicator.deliver_next_message())
+        self.assertEqual(
+            SlackOutbox.select().where(
+                SlackOutbox.status == SlackOutbox.DELIVERED).count(),
+            2)
+
+    @patch.dict("teabot_endpoints.slack_communicator.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    def test_deliver_to_teapot_room(self):
+        self.communicator.post_message_to_room("ready", True, 'kitchen')
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.slack.post_message.assert_called_with(
+            "#kitchen-tea", "ready", icon_emoji=":teapot:")
+        self.assertIsNone(SlackMessages.get_reaction_message_details())
+        self.assertEqual(
+            SlackMessages.get_reaction_message_details('kitchen').channel,
+            'C1234')
+
+    def test_deliver_next_message_failure_backs_off(self):
+        self.slack.post_message.side_effect = Exception("timed out")
+        self.communicator.post_message_to_room("The tea is ready")
+
+        self.assertFalse(self.communicator.deliver_next_message())
+        message = SlackOutbox.get()
+        self.assertEqual(message.status, SlackOutbox.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.last_error, "timed out")
+        self.assertGreater(message.next_attempt, datetime.now())
+
+        # Not retried until the backoff has passed
+        self.assertFalse(self.communicator.deliver_next_message())
+        self.assertEqual(self.slack.post_message.call_count, 1)
+
+        SlackOutbox.update(
+            next_attempt=datetime.now() - timedelta(seconds=1)).execute()
+        self.slack.post_message.side_effect = None
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.assertEqual(SlackOutbox.get().status, SlackOutbox.DELIVERED)
+
+    def test_deliver_next_message_rate_limited_waits_retry_after(self):
+        self.slack.post_message.side_effect = SlackRateLimited(
+            'chat.postMessage', 59.5)
+        self.communicator.post_message_to_room("The tea is ready")
+
+        self.assertFalse(self.communicator.deliver_next_message())
+        self.assertGreater(
+            SlackOutbox.get().next_attempt,
+            datetime.now() + timedelta(seconds=59))
+
+    @patch("teabot_endpoints.slack_communicator.SLACK_OUTBOX_MAX_ATTEMPTS", 2)
+    def test_deliver_next_message_gives_up(self):
+        self.slack.post_message.side_effect = Exception("timed out")
+        self.communicator.post_message_to_room("first")
+        self.communicator.post_message_to_room("second")
+        for _ in range(2):
+            SlackOutbox.update(next_attempt=datetime.now()).execute()
+            self.communicator.deliver_next_message()
+
+        first = SlackOutbox.get(SlackOutbox.message == "first")
+        self.assertEqual(first.status, SlackOutbox.FAILED)
+        self.slack.post_message.side_effect = None
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.slack.post_message.assert_called_with(
+            "#teapot", "second", icon_emoji=":teapot:")
+
+    @patch.dict("teabot_endpoints.settings.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea', 'annex': '#teapot'})
+    def test_retrying_message_only_holds_up_its_channel(self):
+        self.slack.post_message.side_effect = Exception("timed out")
+        self.communicator.post_message_to_room("first")
+        self.communicator.deliver_next_message()
+        self.slack.post_message.side_effect = None
+        self.communicator.post_message_to_room("second")
+        self.communicator.post_message_to_room("annex", teapot='annex')
+        self.communicator.post_message_to_room("kitchen", teapot='kitchen')
+
+        # The annex posts to the same channel as the default teapot, so only
+        # the kitchen's message goes ahead of the retry
+        self.assertTrue(self.communicator.deliver_next_message())
+        self.slack.post_message.assert_called_with(
+            "#kitchen-tea", "kitchen", icon_emoji=":teapot:")
+        self.assertFalse(self.communicator.deliver_next_message())
+
+        SlackOutbox.update(next_attempt=datetime.now()).execute()
+        for message in ("first", "second", "annex"):
+            self.assertTrue(self.communicator.deliver_next_message())
+            self.slack.post_message.assert_called_with(
+                "#teapot", message, icon_emoji=":teapot:")
+
+    @patch.dict("teabot_endpoints.settings.TEAPOT_ROOMS",
+                {'kitchen': '#kitchen-tea'})
+    def test_claimed_message_only_holds_up_its_channel(self):
+        self.communicator.post_message_to_room("first")
+        self.communicator.post_message_to_room("kitchen", teapot='kitchen')
+        self.assertEqual(
+            SlackOutbox.claim_next_message(60).message, "first")
+        self.assertEqual(
+            SlackOutbox.claim_next_message(60).message, "kitchen")
+        self.assertIsNone(SlackOutbox.claim_next_message(60))
+
+    def test_claimed_message_not_delivered_twice(self):
+        self.communicator.post_message_to_room("The tea is ready")
+        self.assertIsNotNone(SlackOutbox.claim_next_message(60))
+        self.assertIsNone(SlackOutbox.claim_next_message(60))
+
+    def _reactions(self, *counts):
+        return {'ok': True, 'message': {
+            'reactions': [{'count': count} for count in counts]
+        }}
+
+    def test_get_message_reaction_count_no_message(self):
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertFalse(self.slack.get_reactions.called)
+
+    @patch.object(SlackCommunicator, '_refresh_in_background')
+    def test_get_message_reaction_count_first_fill(self, mock_refresh):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        # The first count is fetched in the background, not by the request
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        mock_refresh.assert_called_once_with('C1234', '1234.5')
+        self.assertFalse(self.slack.get_reactions.called)
+
+    @refresh_inline
+    def test_get_message_reaction_count_cached(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        self.slack.get_reactions.return_value = self._reactions(2, 3)
+
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 5)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 5)
+        self.slack.get_reactions.assert_called_once_with('C1234', '1234.5')
+
+    @refresh_inline
+    def test_get_message_reaction_count_no_reactions(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        self.slack.get_reactions.return_value = {'ok': True, 'message': {}}
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertEqual(self.slack.get_reactions.call_count, 1)
+
+    def test_get_message_reaction_count_first_fill_claimed(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        # Another worker is fetching the first count
+        ReactionCount.claim_refresh('C1234', '1234.5', 30)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertFalse(self.slack.get_reactions.called)
+
+        ReactionCount.store_count('C1234', '1234.5', 3)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 3)
+        self.assertFalse(self.slack.get_reactions.called)
+
+    @refresh_inline
+    def test_get_message_reaction_count_first_fill_failed(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        self.slack.get_reactions.side_effect = SlackError("ratelimited")
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+
+        # The claim is released so the next request tries again
+        self.slack.get_reactions.side_effect = None
+        self.slack.get_reactions.return_value = self._reactions(2)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 0)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 2)
+        self.assertEqual(self.slack.get_reactions.call_count, 2)
+
+    @patch.object(SlackCommunicator, '_refresh_in_background')
+    def test_get_message_reaction_count_stale(self, mock_refresh):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        ReactionCount.store_count('C1234', '1234.5', 4)
+        ReactionCount.update(
+            fetched=datetime.now() - timedelta(minutes=10)).execute()
+
+        # The stale count is served while a single refresh is started
+        self.assertEqual(self.communicator.get_message_reaction_count(), 4)
+        self.assertEqual(self.communicator.get_message_reaction_count(), 4)
+        mock_refresh.assert_called_once_with('C1234', '1234.5')
+        self.assertFalse(self.slack.get_reactions.called)
+
+        self.slack.get_reactions.return_value = self._reactions(6)
+        self.communicator._refresh_reaction_count('C1234', '1234.5')
+        self.assertEqual(self.communicator.get_message_reaction_count(), 6)
+        self.assertIsNone(
+            ReactionCount.get_cached('C1234', '1234.5').refreshing_until)
+
+    def test_refresh_failure_releases_claim(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        ReactionCount.claim_refresh('C1234', '1234.5', 30)
+        self.slack.get_reactions.side_effect = Exception("timed out")
+        with self.assertRaises(Exception):
+            self.communicator._refresh_reaction_count('C1234', '1234.5')
+        self.assertTrue(ReactionCount.claim_refresh('C1234', '1234.5', 30))
+
+    def test_clear_slack_message_clears_reaction_count(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        ReactionCount.store_count('C1234', '1234.5', 4)
+        SlackMessages.clear_slack_message()
+        self.assertIsNone(ReactionCount.get_cached('C1234', '1234.5'))
+
+    def test_clear_slack_message_of_one_teapot(self):
+        SlackMessages.store_message_details('1234.5', 'C1234')
+        SlackMessages.store_message_details('1234.6', 'C5678', 'kitchen')
+        SlackMessages.clear_slack_message('kitchen')
+        self.assertIsNone(
+            SlackMessages.get_reaction_message_details('kitchen'))
+        self.assertEqual(
+            SlackMessages.get_reaction_message_details().timestamp, '1234.5')
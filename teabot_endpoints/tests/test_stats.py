@@ -0,0 +1,216 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database, count_queries
+from teabot_endpoints.models import State, MODELS
+from teabot_endpoints import stats
+from teabot_endpoints.retention import roll_up_next_hour, prune_raw_readings
+from teabot_endpoints.tests.query_plans import full_table_scans
+from teabot_endpoints.settings import DEFAULT_TEAPOT
+from peewee import SqliteDatabase
+from mock import patch
+from datetime import datetime
+
+test_db = SqliteDatabase(':memory:')
+
+START = datetime(2017, 1, 2)
+END = datetime(2017, 1, 4)
+NOW = datetime(2017, 1, 10)
+
+
+class TestStats(TestCase):
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestStats, self).run(result)
+
+    def setUp(self):
+        stats.stats_cache.clear()
+        history = [
+            ((2, 9, 0), 'FULL_TEAPOT', 6, 90),
+            ((2, 9, 5), 'GOOD_TEAPOT', 5, 86),
+            ((2, 9, 20), 'GOOD_TEAPOT', 3, 80),
+            ((2, 10, 10), 'COLD_TEAPOT', 1, 40),
+            ((2, 10, 30), 'EMPTY_TEAPOT', 0, 25),
+            ((2, 14, 0), 'FULL_TEAPOT', 4, 92),
+            ((2, 14, 30), 'GOOD_TEAPOT', 2, 85),
+            # Replaces the pot from the day before, which never emptied
+            ((3, 8, 0), 'FULL_TEAPOT', 5, 95),
+            ((3, 9, 0), 'EMPTY_TEAPOT', 0, 30),
+        ]
+        for (day, hour, minute), state, cups, temperature in history:
+            State.create(
+                state=state,
+                timestamp=datetime(2017, 1, day, hour, minute),
+                num_of_cups=cups,
+                weight=400 + cups * 250,
+                temperature=temperature
+            )
+
+    def _rows(self, name, start=START, end=END, now=NOW, options=(),
+              teapot=DEFAULT_TEAPOT):
+        stat = stats.STATS[name]
+        return stats.stats_cache.get_rows(
+            name, stat, stats.bucket_range(stat, start, end), now, options,
+            teapot)
+
+    def test_pots_per_day(self):
+        self.assertEqual(self._rows('potsPerDay'), [
+            ('2017-01-02', 2, 10),
+            ('2017-01-03', 1, 5),
+        ])
+
+    def test_pot_age(self):
+        self.assertEqual(self._rows('potAge'), [
+            ('2017-01-02', 2, 1, 90.0, 90.0),
+            ('2017-01-03', 1, 1, 60.0, 60.0),
+        ])
+
+    def test_cups_per_hour(self):
+        self.assertEqual(self._rows('cupsPerHour'), [
+            ('2017-01-02 09:00', 3),
+            ('2017-01-02 10:00', 3),
+            ('2017-01-02 14:00', 2),
+            ('2017-01-03 08:00', 0),
+            ('2017-01-03 09:00', 5),
+        ])
+
+    def test_cups_per_hour_counts_pour_at_start_of_range(self):
+        self.assertEqual(
+            self._rows('cupsPerHour', start=datetime(2017, 1, 2, 10),
+                       end=datetime(2017, 1, 2, 11)),
+            [('2017-01-02 10:00', 3)]
+        )
+
+    def test_temperature_curve(self):
+        rows = self._rows('temperature', options=(('interval', 30),))
+        self.assertEqual(rows, [
+            ('2017-01-02', 0, 87.0, 4),
+            ('2017-01-02', 30, 85.0, 1),
+            ('2017-01-02', 60, 40.0, 1),
+            ('2017-01-02', 90, 25.0, 1),
+            ('2017-01-03', 0, 95.0, 1),
+            ('2017-01-03', 60, 30.0, 1),
+        ])
+
+    def test_bucket_range(self):
+        stat = stats.STATS['cupsPerHour']
+        self.assertEqual(
+            stats.bucket_range(
+                stat, datetime(2017, 1, 2, 9, 30), datetime(2017, 1, 2, 11)),
+            [datetime(2017, 1, 2, 9), datetime(2017, 1, 2, 10)]
+        )
+
+    def test_closed_buckets_are_cached(self):
+        self._rows('potsPerDay')
+        with count_queries() as counter:
+            self.assertEqual(len(self._rows('potsPerDay')), 2)
+        # Only the version stamp is read
+        self.assertEqual(counter.count, 1)
+
+    def test_open_buckets_are_queried_again(self):
+        now = datetime(2017, 1, 3, 12)
+        self._rows('potsPerDay', now=now)
+        State.create(
+            state='FULL_TEAPOT', timestamp=datetime(2017, 1, 3, 11),
+            num_of_cups=2)
+        with count_queries() as counter:
+            rows = self._rows('potsPerDay', now=now)
+        self.assertEqual(rows, [
+            ('2017-01-02', 2, 10),
+            ('2017-01-03', 2, 7),
+        ])
+        self.assertEqual(counter.count, 2)
+        sql = counter.get_queries()[-1].msg[1]
+        self.assertEqual(sql[1], '2017-01-03 00:00:00')
+
+    def test_settling_buckets_are_not_cached(self):
+        # The day is over but its last pot could still be emptied
+        self._rows('potAge', now=datetime(2017, 1, 3, 12))
+        with count_queries() as counter:
+            self._rows('potAge', now=datetime(2017, 1, 3, 12))
+        self.assertEqual(counter.count, 2)
+
+    def test_cache_cleared_by_bulk_upload(self):
+        self._rows('potsPerDay')
+        State.store_states([{
+            'state': 'FULL_TEAPOT',
+            'timestamp': datetime(2017, 1, 2, 16),
+            'num_of_cups': 3
+        }])
+        self.assertEqual(self._rows('potsPerDay'), [
+            ('2017-01-02', 3, 13),
+            ('2017-01-03', 1, 5),
+        ])
+
+    def test_cache_kept_by_upload_of_recent_readings(self):
+        self._rows('potsPerDay')
+        State.store_states([{
+            'state': 'FULL_TEAPOT',
+            'timestamp': datetime.now(),
+            'num_of_cups': 3
+        }])
+        with count_queries() as counter:
+            self.assertEqual(len(self._rows('potsPerDay')), 2)
+        self.assertEqual(counter.count, 1)
+
+    def test_cache_keyed_by_options(self):
+        self._rows('temperature', options=(('interval', 30),))
+        rows = self._rows('temperature', options=(('interval', 60),))
+        self.assertEqual(rows[:2], [
+            ('2017-01-02', 0, 86.6, 5),
+            ('2017-01-02', 60, 32.5, 2),
+        ])
+
+    def test_each_teapot_counted_on_its_own(self):
+        self.assertEqual(self._rows('potsPerDay', teapot='kitchen'), [])
+        State.create(
+            state='FULL_TEAPOT', timestamp=datetime(2017, 1, 2, 11),
+            num_of_cups=3, teapot='kitchen')
+        State.create(
+            state='EMPTY_TEAPOT', timestamp=datetime(2017, 1, 2, 11, 30),
+            num_of_cups=0, teapot='kitchen')
+        stats.stats_cache.clear()
+        self.assertEqual(self._rows('potsPerDay', teapot='kitchen'), [
+            ('2017-01-02', 1, 3),
+        ])
+        self.assertEqual(self._rows('potAge', teapot='kitchen'), [
+            ('2017-01-02', 1, 1, 30.0, 30.0),
+        ])
+        self.assertEqual(self._rows('potsPerDay')[0], ('2017-01-02', 2, 10))
+
+    def test_cache_cleared_by_pruning(self):
+        cached = self._rows('cupsPerHour')
+        while roll_up_next_hour(NOW):
+            pass
+        self.assertEqual(prune_raw_readings(NOW), 5)
+        rows = self._rows('cupsPerHour')
+        self.assertNotEqual(rows, cached)
+        stats.stats_cache.clear()
+        self.assertEqual(self._rows('cupsPerHour'), rows)
+
+    def test_first_whole_bucket(self):
+        stat = stats.STATS['potAge']
+        self.assertEqual(
+            stats.first_whole_bucket(stat, datetime(2017, 1, 2, 9)),
+            datetime(2017, 1, 3))
+        self.assertEqual(
+            stats.first_whole_bucket(stat, datetime(2017, 1, 2)),
+            datetime(2017, 1, 2))
+
+    def test_cache_emptied_when_full(self):
+        with patch.object(stats.stats_cache, 'max_buckets', 1):
+            self._rows('potsPerDay', end=datetime(2017, 1, 3))
+            self._rows('cupsPerHour', end=datetime(2017, 1, 2, 1))
+            self.assertEqual(len(stats.stats_cache._rows), 1)
+
+    def test_queries_use_timestamp_indexes(self):
+        for name, stat in stats.STATS.items():
+            self.assertEqual(
+                full_table_scans(test_db, stat.query, START, END), [], name)
+
+    def test_queries_run_without_window_functions(self):
+        # Window functions need SQLite 3.25, newer than the Docker image's
+        for name, stat in stats.STATS.items():
+            with count_queries() as counter:
+                list(stat.query(START, END))
+            for query in counter.get_queries():
+                self.assertNotIn(' OVER ', query.msg[0], name)
@@ -0,0 +1,217 @@
+from unittest import TestCase
+from playhouse.test_utils import test_database
+from teabot_endpoints.models import State, WriteBehindSegment, DataVersion, \
+    Counter, MODELS, STATE_HISTORY_VERSION, NEW_TEAPOTS_COUNTER
+from teabot_endpoints import write_behind
+from teabot_endpoints.write_behind import WriteBehindBuffer, Segment, \
+    encode_reading, decode_reading
+from peewee import SqliteDatabase
+from mock import patch
+from datetime import datetime, timedelta
+import glob
+import os
+import shutil
+import tempfile
+
+test_db = SqliteDatabase(':memory:')
+
+
+def _reading(seconds, state='GOOD_TEAPOT', num_of_cups=4, weight=1000):
+    return {
+        'state': state,
+        'timestamp': datetime(2017, 1, 1, 9) + timedelta(seconds=seconds),
+        'num_of_cups': num_of_cups,
+        'weight': weight,
+        'temperature': 80
+    }
+
+
+class TestWriteBehind(TestCase):
+
+    def run(self, result=None):
+        with test_database(test_db, MODELS):
+            super(TestWriteBehind, self).run(result)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.buffer = self._buffer()
+        State.record_reading(_reading(0, weight=1500))
+
+    def _buffer(self, batch_size=100):
+        buffer = WriteBehindBuffer(self.directory, batch_size)
+        patcher = patch.object(State, 'write_behind_buffer', buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return buffer
+
+    def _segments(self):
+        return glob.glob(os.path.join(self.directory, '*.log'))
+
+    def _crash(self, buffer):
+        """Closes the buffer's segments without storing them, as if its
+        worker had died
+        """
+        for segment in buffer._sealed + [buffer._segment]:
+            segment.log.close()
+
+    def test_encode_decode(self):
+        reading = _reading(1)
+        self.assertEqual(decode_reading(encode_reading(reading)), reading)
+        with self.assertRaises(ValueError):
+            decode_reading(encode_reading(reading)[:-5])
+
+    def test_readings_buffered(self):
+        self.assertFalse(self.buffer.append(_reading(10, weight=1400)))
+        self.assertFalse(self.buffer.append(_reading(20, weight=1300)))
+        self.assertEqual(State.select().count(), 1)
+        self.assertEqual(self.buffer.buffered, 2)
+        self.assertEqual(len(self._segments()), 1)
+
+        # The newest reading is seen before it's stored
+        newest = State.get_newest_state_record()
+        self.assertIsNone(newest.id)
+        self.assertEqual(newest.weight, 1300)
+        self.assertEqual(State.get_newest_state().weight, 1300)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.buffered, 0)
+        self.assertEqual(self._segments(), [])
+        self.assertEqual(WriteBehindSegment.select().count(), 0)
+        self.assertEqual(
+            [state.weight for state in State.select().order_by(State.id)],
+            [1500, 1400, 1300])
+        self.assertIsNotNone(State.get_newest_state_record().id)
+
+    def test_newest_reading_seen_by_other_workers(self):
+        self.buffer.append(_reading(10, weight=1400))
+        other = WriteBehindBuffer(self.directory)
+        self.assertEqual(other.newest_reading()['weight'], 1400)
+        self.buffer.append(_reading(20, weight=1300))
+        self.assertEqual(other.newest_reading()['weight'], 1300)
+
+    def test_newest_reading_of_each_teapot(self):
+        self.buffer.append(_reading(10, weight=1400))
+        self.buffer.append(dict(_reading(20, weight=900), teapot='kitchen'))
+        self.buffer.append(dict(_reading(30, weight=700), teapot='kitchen'))
+        self.assertEqual(State.get_newest_state_record().weight, 1400)
+        kitchen = State.get_newest_state_record('kitchen')
+        self.assertEqual((kitchen.weight, kitchen.teapot), (700, 'kitchen'))
+
+        self.buffer.flush()
+        self.assertEqual(
+            State.select().where(State.teapot == 'kitchen').count(), 2)
+        self.assertEqual(State.get_newest_state_record().weight, 1400)
+
+    def test_state_change_stored_straight_away(self):
+        self.buffer.append(_reading(10, weight=1400))
+        self.assertTrue(self.buffer.append(
+            _reading(20, num_of_cups=3, weight=1200)))
+        self.assertEqual(self.buffer.buffered, 0)
+        self.assertEqual(State.select().count(), 3)
+        self.assertEqual(State.get_newest_state_record().num_of_cups, 3)
+
+    def test_full_teapot_stored_straight_away(self):
+        self.assertTrue(self.buffer.append(
+            _reading(10, state='FULL_TEAPOT', num_of_cups=6)))
+        self.assertEqual(Counter.get_value(NEW_TEAPOTS_COUNTER), 1)
+        self.assertEqual(
+            State.get_latest_full_teapot_record().timestamp,
+            _reading(10)['timestamp'])
+
+    def test_state_change_kept_when_store_fails(self):
+        with patch.object(WriteBehindSegment, 'store',
+                          side_effect=Exception('database is locked')):
+            self.assertFalse(self.buffer.append(
+                _reading(10, num_of_cups=3)))
+        self.assertTrue(self.buffer.flush_due.is_set())
+        self.assertEqual(self.buffer.buffered, 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(State.get_newest_state_record().num_of_cups, 3)
+
+    def test_repeats_only_update_last_seen(self):
+        self.buffer.append(_reading(10, weight=1505))
+        self.buffer.append(_reading(20, weight=1400))
+        self.buffer.append(_reading(30, weight=1402))
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(
+            [(state.weight, state.last_seen.second)
+             for state in State.select().order_by(State.id)],
+            [(1500, 10), (1400, 30)])
+
+    def test_flush_due_when_batch_full(self):
+        buffer = self._buffer(batch_size=2)
+        buffer.append(_reading(10, weight=1400))
+        self.assertFalse(buffer.flush_due.is_set())
+        buffer.append(_reading(20, weight=1300))
+        self.assertTrue(buffer.flush_due.is_set())
+        buffer.flush()
+        self.assertFalse(buffer.flush_due.is_set())
+
+    def test_replay_after_crash(self):
+        self.buffer.append(_reading(10, weight=1400))
+        self.buffer.append(_reading(20, weight=1300))
+        # A live worker's segment is left alone
+        replacement = self._buffer()
+        self.assertEqual(replacement.replay(), 0)
+        self.assertEqual(len(self._segments()), 1)
+
+        stamp = DataVersion.get_stamp(STATE_HISTORY_VERSION)
+        self._crash(self.buffer)
+        self.assertEqual(replacement.replay(), 2)
+        self.assertEqual(self._segments(), [])
+        self.assertEqual(State.select().count(), 3)
+        self.assertNotEqual(
+            DataVersion.get_stamp(STATE_HISTORY_VERSION), stamp)
+
+    def test_replay_skips_cut_short_reading(self):
+        self.buffer.append(_reading(10, weight=1400))
+        self._crash(self.buffer)
+        with open(self._segments()[0], 'ab') as log:
+            log.write(encode_reading(_reading(20, weight=1300))[:-10])
+        self.assertEqual(self._buffer().replay(), 1)
+        self.assertEqual(State.get_newest_state_record().weight, 1400)
+
+    def test_replay_segment_already_stored(self):
+        self.buffer.append(_reading(10, weight=1400))
+        segment = self.buffer._segment
+        # The worker died after storing the segment but before deleting it
+        WriteBehindSegment.store(segment.name, segment.readings)
+        self._crash(self.buffer)
+        self.assertEqual(self._buffer().replay(), 0)
+        self.assertEqual(self._segments(), [])
+        self.assertEqual(State.select().count(), 2)
+
+    def test_claim_deleted_segment(self):
+        self.assertIsNone(
+            Segment.claim(os.path.join(self.directory, 'gone.log')))
+
+
+class TestStartWriteBehind(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for patcher in [
+                patch.object(write_behind, 'STATE_WRITE_BEHIND_DIR',
+                             directory),
+                patch.object(write_behind, 'state_buffer', None),
+                patch.object(write_behind, 'write_behind_worker', None),
+                patch.object(State, 'write_behind_buffer', None),
+                patch.object(WriteBehindBuffer, 'replay'),
+                patch.object(WriteBehindBuffer, 'flush')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_start_and_stop(self):
+        buffer = write_behind.start_write_behind()
+        self.assertIs(State.write_behind_buffer, buffer)
+        self.assertIs(write_behind.start_write_behind(), buffer)
+
+        worker = write_behind.write_behind_worker
+        worker.stop()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        buffer.replay.assert_called_once_with()
+        # Once more as it stops
+        self.assertTrue(buffer.flush.called)
@@ -0,0 +1,379 @@
+"""Write-behind buffering of teapot readings. Instead of committing each
+/storeState reading, a worker appends it to a log segment of its own and a
+background thread stores the buffered readings in one transaction once
+enough have built up or a little time has passed, so the workers take
+SQLite's write lock once a batch rather than once a reading.
+
+Each segment is a file of JSON lines that its worker holds an exclusive lock
+on until the segment has been stored and deleted. A segment that can be
+locked by someone else belongs to a worker that died, and is stored by the
+next worker to start. Each teapot's newest reading is also written to a file
+shared by the workers, which State.get_newest_state checks, so it's visible
+to every worker as soon as it arrives.
+"""
+from settings import STATE_WRITE_BEHIND_DIR, STATE_WRITE_BEHIND_BATCH_SIZE, \
+    STATE_WRITE_BEHIND_INTERVAL, STATE_WRITE_BEHIND_FSYNC, DEFAULT_TEAPOT
+from models import State, WriteBehindSegment, DataVersion, \
+    STATE_HISTORY_VERSION
+from datetime import datetime
+import codec
+import errno
+import fcntl
+import glob
+import logging
+import metrics
+import os
+import threading
+import urllib
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+SEGMENT_SUFFIX = '.log'
+NEWEST_READING_FILE = 'newest.json'
+# Other teapots' newest readings are kept in files named after the teapot
+TEAPOT_NEWEST_READING_FILE = 'newest-%s.json'
+
+state_buffer = None
+write_behind_worker = None
+
+
+def encode_reading(reading):
+    """Encodes a reading as a line of JSON
+
+    Args:
+        - reading (dict) - State field values
+    Returns:
+        - String - The line, ending in a newline
+    """
+    return codec.dumps(dict(
+        reading, timestamp=reading['timestamp'].strftime(TIMESTAMP_FORMAT)
+    )) + '\n'
+
+
+def decode_reading(line):
+    """Decodes a line written by encode_reading
+
+    Raises:
+        - ValueError if the line isn't a whole reading
+    """
+    if not line.endswith('\n'):
+        raise ValueError("Incomplete reading: %r" % line)
+    reading = codec.decode(line)
+    reading['timestamp'] = datetime.strptime(
+        reading['timestamp'], TIMESTAMP_FORMAT)
+    return reading
+
+
+def changes_state(previous, reading):
+    """Tells whether a reading is one that readers need to see stored
+    straight away, a FULL_TEAPOT or a change of state or number of cups
+
+    Args:
+        - previous (StateRecord) - The newest reading, None if there isn't
+        one
+        - reading (dict) - State field values of the new reading
+    Returns:
+        - bool
+    """
+    return previous is None or reading['state'] == 'FULL_TEAPOT' or \
+        reading['state'] != previous.state or \
+        reading['num_of_cups'] != previous.num_of_cups
+
+
+def _modified(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
+
+
+class Segment(object):
+    """A log of buffered readings, locked by the worker it belongs to
+
+    Args:
+        - path (String) - The segment's file
+        - log (file) - The file, open and locked
+        - readings (list) - The readings in the file
+    """
+
+    def __init__(self, path, log, readings=None):
+        self.path = path
+        self.log = log
+        self.readings = readings or []
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)[:-len(SEGMENT_SUFFIX)]
+
+    @classmethod
+    def create(cls, directory):
+        """Creates an empty segment. It's locked before it's given its name,
+        so no other worker can mistake it for one left by a dead worker.
+        """
+        path = os.path.join(directory, uuid.uuid4().hex + SEGMENT_SUFFIX)
+        log = open(path + '.tmp', 'ab')
+        fcntl.flock(log, fcntl.LOCK_EX)
+        os.rename(path + '.tmp', path)
+        return cls(path, log)
+
+    @classmethod
+    def claim(cls, path):
+        """Locks and reads a segment left by a worker that has died
+
+        Returns:
+            - Segment or None if its worker still has it locked, or it has
+            been stored and deleted in the meantime
+        """
+        try:
+            log = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            log.close()
+            return None
+        if not os.path.exists(path):
+            log.close()
+            return None
+
+        readings = []
+        for line in log:
+            try:
+                readings.append(decode_reading(line))
+            except ValueError:
+                # Only the last line can be cut short, by the worker dying
+                # part way through writing it
+                logger.warning("Skipping %r in %s", line, path)
+        return cls(path, log, readings)
+
+    def append(self, reading, fsync=False):
+        self.log.write(encode_reading(reading))
+        self.log.flush()
+        if fsync:
+            os.fsync(self.log.fileno())
+        self.readings.append(reading)
+
+    def store(self):
+        """Stores the readings, then deletes the segment
+
+        Returns:
+            - int - number of rows inserted
+        """
+        inserted = WriteBehindSegment.store(self.name, self.readings)
+        if inserted is None:
+            logger.info("%s has already been stored", self.path)
+            inserted = 0
+        else:
+            metrics.record_state_reading(True, inserted)
+            metrics.record_state_reading(
+                False, len(self.readings) - inserted)
+        os.remove(self.path)
+        self.log.close()
+        WriteBehindSegment.forget(self.name)
+        return inserted
+
+
+class WriteBehindBuffer(object):
+    """Buffers a worker's readings in log segments until they're stored
+
+    Args:
+        - directory (String) - Where the segments are kept, shared by the
+        workers
+        - batch_size (int) - Readings to buffer before a flush is due
+        - fsync (bool) - Whether to fsync each reading to the log
+    """
+
+    def __init__(self, directory=STATE_WRITE_BEHIND_DIR,
+                 batch_size=STATE_WRITE_BEHIND_BATCH_SIZE,
+                 fsync=STATE_WRITE_BEHIND_FSYNC):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.flush_due = threading.Event()
+        self._segment = None
+        # Segments no longer appended to, waiting to be stored in order
+        self._sealed = []
+        # The newest reading of each teapot, keyed by teapot, as
+        # (file key, reading)
+        self._newest = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def append(self, reading):
+        """Buffers a reading. Readings that change the state of the teapot
+        are stored straight away, along with those buffered before them.
+
+        Args:
+            - reading (dict) - State field values
+        Returns:
+            - bool - True if the reading was stored
+        """
+        store_now = changes_state(State.get_newest_state_record(
+            reading.get('teapot', DEFAULT_TEAPOT)), reading)
+        with self._lock:
+            if self._segment is None:
+                self._segment = Segment.create(self.directory)
+            self._segment.append(reading, self.fsync)
+            self._write_newest_reading(reading)
+            if len(self._segment.readings) >= self.batch_size:
+                self.flush_due.set()
+        if not store_now:
+            return False
+        try:
+            self.flush()
+        except Exception:
+            # The reading is safe in the log, the flush is retried
+            logger.exception("Error storing buffered readings")
+            self.flush_due.set()
+            return False
+        return True
+
+    def newest_path(self, teapot=DEFAULT_TEAPOT):
+        """Returns the file the teapot's newest reading is written to"""
+        if teapot == DEFAULT_TEAPOT:
+            return os.path.join(self.directory, NEWEST_READING_FILE)
+        return os.path.join(self.directory, TEAPOT_NEWEST_READING_FILE % (
+            urllib.quote(teapot, safe=''),))
+
+    def _write_newest_reading(self, reading):
+        path = self.newest_path(reading.get('teapot', DEFAULT_TEAPOT))
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as newest:
+            newest.write(encode_reading(reading))
+        os.rename(temporary, path)
+
+    def newest_reading(self, teapot=DEFAULT_TEAPOT):
+        """Returns the teapot's newest reading buffered by any worker. It
+        may already have been stored.
+
+        Args:
+            - teapot (String) - Name of the teapot
+        Returns:
+            - dict - State field values or None
+        """
+        path = self.newest_path(teapot)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        cached_key, reading = self._newest.get(teapot, (None, None))
+        if key != cached_key:
+            try:
+                with open(path, 'rb') as newest:
+                    reading = decode_reading(newest.read())
+            except (IOError, ValueError):
+                return None
+            self._newest[teapot] = (key, reading)
+        return reading
+
+    @property
+    def buffered(self):
+        """Number of readings waiting to be stored"""
+        with self._lock:
+            segments = list(self._sealed)
+            if self._segment is not None:
+                segments.append(self._segment)
+            return sum(len(segment.readings) for segment in segments)
+
+    def flush(self):
+        """Stores every buffered reading, oldest segment first. A segment
+        that fails to store is kept, with those after it, for the next flush.
+
+        Returns:
+            - int - number of rows inserted
+        """
+        with self._flush_lock:
+            with self._lock:
+                self.flush_due.clear()
+                if self._segment is not None:
+                    self._sealed.append(self._segment)
+                    self._segment = None
+                sealed = list(self._sealed)
+            inserted = 0
+            for segment in sealed:
+                inserted += segment.store()
+                with self._lock:
+                    self._sealed.remove(segment)
+            return inserted
+
+    def replay(self):
+        """Stores the segments left behind by workers that died
+
+        Returns:
+            - int - number of rows inserted
+        """
+        inserted = 0
+        for path in sorted(
+                glob.glob(os.path.join(self.directory, '*' + SEGMENT_SUFFIX)),
+                key=_modified):
+            segment = Segment.claim(path)
+            if segment is not None:
+                logger.info("Replaying %s readings from %s",
+                            len(segment.readings), path)
+                inserted += segment.store()
+        if inserted:
+            # Their readings can be older than the stats already cached
+            DataVersion.bump(STATE_HISTORY_VERSION)
+        return inserted
+
+
+class WriteBehindWorker(threading.Thread):
+    """Background thread that stores the buffered readings every interval
+    seconds, or sooner if a batch fills up, and once more when it's stopped
+    """
+
+    def __init__(self, buffer, interval=STATE_WRITE_BEHIND_INTERVAL):
+        super(WriteBehindWorker, self).__init__(name='write-behind')
+        self.daemon = True
+        self.buffer = buffer
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            self.buffer.replay()
+        except Exception:
+            logger.exception("Error replaying write-behind segments")
+        while not self._stopped.is_set():
+            self.buffer.flush_due.wait(self.interval)
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        try:
+            self.buffer.flush()
+        except Exception:
+            logger.exception("Error storing buffered readings")
+
+    def stop(self):
+        self._stopped.set()
+        self.buffer.flush_due.set()
+
+
+def start_write_behind():
+    """Starts buffering readings in this process, if it isn't already, and
+    the thread that stores them
+
+    Returns:
+        - WriteBehindBuffer - The buffer
+    """
+    global state_buffer, write_behind_worker
+    if state_buffer is None:
+        state_buffer = WriteBehindBuffer(STATE_WRITE_BEHIND_DIR)
+        State.write_behind_buffer = state_buffer
+    if write_behind_worker is None or not write_behind_worker.is_alive():
+        write_behind_worker = WriteBehindWorker(state_buffer)
+        write_behind_worker.start()
+    return state_buffer